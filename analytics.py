@@ -0,0 +1,227 @@
+# Session analytics over the stamp logs, for a PC or the Raspberry Pi (needs NumPy, never runs on the board)
+# The logs are streamed into columns (start, stop, task, note, device) and every report is a vectorized pass
+# over those arrays, so multi-million row archives from many devices take seconds instead of spreadsheet
+# formulas. Reads "stamp.csv" as the states write it (fragments, repeated header rows, "Delta Formula"
+# filler, rows glued together when no voice note was taken), "sessions.bin" from sessionlog.py and rotated
+# logs through their manifest ("stamp.man", see logrotate.py).
+#
+# Times on the device are the RTC's local time, they are kept as naive epoch seconds here, so a day is
+# simply epoch // 86400. A stop time earlier in the day than its start means the session ran past midnight,
+# and sessions spanning several days have their seconds split over each day in the daily totals.
+#
+#   python3 analytics.py stamp.csv|stamp.man|sessions.bin|STORE [more logs...]      STORE is a folder written by ingest.py
+
+import os
+import re
+
+import numpy as np
+
+DAY = 86400
+WEEK_OFFSET = 3             # 1970-01-01 was a Thursday, (day + 3) // 7 counts weeks starting on Monday
+CHUNK = 1 << 22             # characters read per pass over a csv log
+
+# One session in stamp.csv: date, time in, time out, then optionally the voice note filler
+_SESSION = re.compile(r'(\d+)/(\d+)/(\d+),\s*(\d+):(\d+):(\d+),\s*(\d+):(\d+):(\d+),\s*'
+                      r'(?:Delta Formula,\s*(Speech to text voice note))?')
+
+_SESSION_RECORD = np.dtype([('start', '<u4'), ('stop', '<u4'), ('task', '<u2'), ('note', 'u1'), ('pad', 'u1')])
+
+
+################################################################################
+# Columns
+
+class Sessions(object):
+
+    def __init__(self, start, stop, task, note, device):
+        self.start = np.asarray(start, dtype=np.int64)      # epoch seconds
+        self.stop = np.asarray(stop, dtype=np.int64)
+        self.task = np.asarray(task, dtype=np.int64)
+        self.note = np.asarray(note, dtype=bool)
+        self.device = np.asarray(device, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def duration(self):
+        return self.stop - self.start
+
+    @staticmethod
+    def concat(parts):
+        parts = list(parts)
+        if not parts:
+            return Sessions([], [], [], [], [])
+        return Sessions(*[np.concatenate([getattr(p, column) for p in parts])
+                          for column in ('start', 'stop', 'task', 'note', 'device')])
+
+    def sorted(self):
+        order = np.argsort(self.start, kind='stable')
+        return Sessions(self.start[order], self.stop[order], self.task[order], self.note[order], self.device[order])
+
+
+def _days_from_civil(y, m, d):
+    """Days since 1970-01-01 for arrays of year, month, day (proleptic Gregorian)."""
+    y = y - (m <= 2)
+    era = np.floor_divide(y, 400)
+    yoe = y - era * 400
+    mp = (m + 9) % 12
+    doy = (153 * mp + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def _columns_from_matches(matches, task, device):
+    if not matches:
+        return Sessions([], [], [], [], [])
+    count = len(matches)
+    digits = ' '.join([' '.join(m[:9]) for m in matches])         # one string parse instead of 9 int() per row
+    fields = np.fromstring(digits, dtype=np.int64, sep=' ').reshape(count, 9)
+    note = np.fromiter((m[9] != '' for m in matches), dtype=bool, count=count)
+    month, day, year = fields[:, 0], fields[:, 1], fields[:, 2]
+    midnight = _days_from_civil(year, month, day) * DAY
+    time_in = fields[:, 3] * 3600 + fields[:, 4] * 60 + fields[:, 5]
+    time_out = fields[:, 6] * 3600 + fields[:, 7] * 60 + fields[:, 8]
+    start = midnight + time_in
+    stop = midnight + time_out + DAY * (time_out < time_in)     # the stop time only has a clock, not a date
+    return Sessions(start, stop, np.full(count, task), note, np.full(count, device))
+
+
+def read_stamp_csv(path, device=0, task=1):
+    """Stream a stamp.csv into Sessions. Incomplete fragments (a start with no stop) are skipped.
+    "path" can also be a list of files read as one log, like the segments of a rotated log."""
+    parts = []
+    pending = []                            # the unfinished line in pieces, joined once its line break comes
+    for chunk in _chunks([path] if isinstance(path, str) else path):
+        cut = chunk.rfind('\n') + 1        # sessions never span a line break, carry the unfinished line over
+        if not cut:                         # rows glued together without a note can run on for many chunks
+            pending.append(chunk)
+            continue
+        pending.append(chunk[:cut])
+        text = ''.join(pending)
+        pending = [chunk[cut:]]
+        parts.append(_columns_from_matches(_SESSION.findall(text), task, device))
+    parts.append(_columns_from_matches(_SESSION.findall(''.join(pending)), task, device))
+    return Sessions.concat(parts)
+
+
+def _chunks(paths):
+    """The text of "paths" one after the other, CHUNK characters at a time, with each file's header row dropped."""
+    for path in paths:
+        with open(path, 'r', newline='') as f:
+            first = True
+            while True:
+                chunk = f.read(CHUNK)
+                if not chunk:
+                    break
+                if first and chunk.startswith('Date,'):
+                    chunk = chunk[chunk.find('\n') + 1:]     # a rotation can cut a session in two around it
+                first = False
+                yield chunk
+
+
+def read_rotated(manifest, device=0):
+    """Read a rotated log through its manifest (stamp.man from logrotate.py), the active file included."""
+    folder = os.path.dirname(manifest)
+    with open(manifest, 'r') as f:
+        names = [line.split(',')[0] for line in f if line.count(',') == 2]
+    names.append(os.path.basename(manifest)[:-len('.man')] + '.csv')
+    return read_stamp_csv([os.path.join(folder, name) for name in names if os.path.exists(os.path.join(folder, name))],
+                          device)
+
+
+def read_sessions_bin(path, device=0):
+    """Load a sessions.bin written by sessionlog.SessionLog."""
+    records = np.fromfile(path, dtype=_SESSION_RECORD)
+    return Sessions(records['start'], records['stop'], records['task'], records['note'] != 0,
+                    np.full(len(records), device))
+
+
+def read_logs(paths):
+    """Read many device logs, the device column is the position of the path in "paths"."""
+    parts = []
+    for device, path in enumerate(paths):
+        if os.path.isdir(path):                     # a store written by ingest.py, with its own device column
+            from ingest import Store
+            parts.append(Store(path).sessions())
+        elif path.endswith('.bin'):
+            parts.append(read_sessions_bin(path, device))
+        elif path.endswith('.man'):
+            parts.append(read_rotated(path, device))
+        else:
+            parts.append(read_stamp_csv(path, device))
+    return Sessions.concat(parts)
+
+
+################################################################################
+# Reports, each one vectorized pass
+
+def daily_totals(sessions):
+    """Tracked seconds per day as (days, seconds), a session past midnight counts towards every day it covers."""
+    start = sessions.start
+    stop = np.maximum(sessions.stop, start)
+    first = start // DAY
+    last = np.where(stop > start, (stop - 1) // DAY, first)
+    spans = last - first + 1
+    which = np.repeat(np.arange(len(start)), spans)             # one row per (session, day) piece
+    piece_day = first[which] + (np.arange(len(which)) - np.repeat(np.cumsum(spans) - spans, spans))
+    piece = (np.minimum(stop[which], (piece_day + 1) * DAY) -
+             np.maximum(start[which], piece_day * DAY))
+    days, inverse = np.unique(piece_day, return_inverse=True)
+    return days, np.bincount(inverse, weights=piece, minlength=len(days)).astype(np.int64)
+
+
+def weekly_totals(sessions):
+    """Tracked seconds per Monday-based week as (weeks, seconds), weeks counted from the epoch."""
+    days, seconds = daily_totals(sessions)
+    weeks, inverse = np.unique((days + WEEK_OFFSET) // 7, return_inverse=True)
+    return weeks, np.bincount(inverse, weights=seconds, minlength=len(weeks)).astype(np.int64)
+
+
+def task_totals(sessions):
+    """Tracked seconds and session count per task id as (tasks, seconds, counts)."""
+    tasks, inverse = np.unique(sessions.task, return_inverse=True)
+    seconds = np.bincount(inverse, weights=np.maximum(sessions.duration, 0), minlength=len(tasks))
+    return tasks, seconds.astype(np.int64), np.bincount(inverse, minlength=len(tasks))
+
+
+def adherence(sessions, target):
+    """Share of sessions that lasted at least "target" seconds (the focus timer length), per day as (days, share)."""
+    days, inverse = np.unique(sessions.start // DAY, return_inverse=True)
+    kept = np.bincount(inverse, weights=sessions.duration >= target, minlength=len(days))
+    return days, kept / np.bincount(inverse, minlength=len(days))
+
+
+def _clock(seconds):
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def _day_label(day):
+    return str(np.datetime64(int(day), 'D'))
+
+
+def report(sessions, focus=25 * 60, out=None):
+    import sys
+    out = sys.stdout if out is None else out
+    out.write('%d sessions, %s tracked, %d with a voice note\n' % (
+        len(sessions), _clock(int(np.maximum(sessions.duration, 0).sum())), int(sessions.note.sum())))
+    days, seconds = daily_totals(sessions)
+    out.write('\nday          tracked\n')
+    for day, total in zip(days, seconds):
+        out.write('%s  %9s\n' % (_day_label(day), _clock(int(total))))
+    weeks, seconds = weekly_totals(sessions)
+    out.write('\nweek of      tracked\n')
+    for week, total in zip(weeks, seconds):
+        out.write('%s  %9s\n' % (_day_label(week * 7 - WEEK_OFFSET), _clock(int(total))))
+    tasks, seconds, counts = task_totals(sessions)
+    out.write('\ntask  sessions    tracked\n')
+    for task, total, count in zip(tasks, seconds, counts):
+        out.write('%4d  %8d  %9s\n' % (task, count, _clock(int(total))))
+    days, share = adherence(sessions, focus)
+    if len(days):
+        out.write('\nsessions of at least %s: %.0f%% on average over %d days\n' % (
+            _clock(focus), 100.0 * share.mean(), len(days)))
+
+
+if __name__ == '__main__':
+    import sys
+    report(read_logs(sys.argv[1:]).sorted())
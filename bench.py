@@ -0,0 +1,224 @@
+# Benchmark suite, replays switch traces through the state machine on the simulator
+# A trace is a list of taps (virtual time, switch number). Every case runs one trace through the event driven
+# loop of code.py against the virtual clock, so the switch timing is the same on every run and only the code
+# is measured. Per case: transitions per second of the time spent in transitions (exit, screen request, enter,
+# log entry), p50/p99 of the time one transition takes, the real time of the whole replay (idle ticks of the
+# loop included, so it mostly follows the tick rate), log bytes written per session and peak memory. Results go to a JSON file, --compare prints the change against an older one.
+#
+# Memory is measured on a second replay so the tracking doesn't slow the timed one down.
+# Runs on CPython (the simulator's RAM files are io.BytesIO and io.TextIOWrapper, which MicroPython lacks).
+# Peak memory is tracemalloc's peak, so only compare results of the same Python build.
+#
+#   python3 bench.py [-o bench.json] [--compare old.json] [--sessions N] [trace.txt ...]
+#
+# A recorded trace file has one tap per line, "seconds switch" (switch 0 is switch_1), "#" starts a comment.
+
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from hal_sim import SimHAL
+from sdlog import BufferedLog
+from sessionlog import SessionLog
+from state_machine import build_machine
+
+EVENT_TICK = 0.005          # same as code.py
+LOG_FLUSH_INTERVAL = 10.0   # same as code.py
+HOLD = 0.2                  # how long each tap is held, seconds
+GAP = 1.0                   # mean time between taps, seconds
+EPOCH = 1700000000          # RTC start, any fixed date keeps the log sizes reproducible
+
+# Switch presses that walk one session from Home back to Home
+PATHS = {
+    'voice_note': (0, 0, 0, 0, 0),      # Home, Profile 1, Tracking1, Voice Note, Record, Home
+    'no_note':    (0, 0, 0, 1),         # ... Voice Note, Home without a note
+    'focus':      (0, 1, 0),            # Home, Profile 1, Focus Timer 1, Home
+    'profile2':   (1, 0),               # Home, Profile 2, Home
+}
+
+_now_ns = time.perf_counter_ns
+
+
+################################################################################
+# Traces
+
+def synthetic_trace(paths, sessions, seed=1):
+    """Taps for "sessions" walks, each one picked at random from "paths", about GAP seconds apart."""
+    rng = random.Random(seed)
+    taps = []
+    at = 1.0
+    for _ in range(sessions):
+        for key in PATHS[paths[rng.getrandbits(8) % len(paths)]]:
+            at += GAP * (0.5 + rng.getrandbits(8) / 256.0)
+            taps.append((at, key))
+    return taps
+
+
+def load_trace(path):
+    """Read a recorded trace file, see the top of this file."""
+    taps = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if line:
+                at, key = line.split()
+                taps.append((float(at), int(key)))
+    return taps
+
+
+################################################################################
+# One case
+
+def _replay(taps, binary):
+    """Run "taps" through a fresh machine, returns (hal, sorted transition times in ns, sessions, elapsed ns)."""
+    hw = SimHAL(epoch=EPOCH)
+    for at, key in taps:
+        hw.switches[key].tap(at, HOLD)
+    stamp_log = BufferedLog(hw, "stamp.csv", flush_interval=LOG_FLUSH_INTERVAL)
+    machine = build_machine(hw, stamp_log)
+    if binary:
+        machine.session_log = SessionLog(hw, flush_interval=LOG_FLUSH_INTERVAL)
+        machine.session_log.open()
+
+    tracking = machine.index_of['Tracking1']
+    go_to_index = machine.go_to_index
+    took = []
+    sessions = [0]
+
+    def timed_go_to_index(target):
+        began = _now_ns()
+        go_to_index(target)
+        took.append(_now_ns() - began)
+        if target == tracking:
+            sessions[0] += 1
+
+    machine.start()
+    machine.go_to_index = timed_go_to_index
+    end = taps[-1][0] + 2 * HOLD if taps else 0.0
+    began = _now_ns()
+    while hw.monotonic() < end:
+        machine.run_events(EVENT_TICK)
+        machine.poll()
+    machine.stamp_log.flush()
+    if binary:
+        machine.session_log.flush()
+    elapsed = _now_ns() - began
+    took.sort()
+    return hw, took, sessions[0], elapsed
+
+
+def run_case(taps, binary=False):
+    """Replay "taps" twice, once timed and once with memory tracking on, returns the results as a dict."""
+    hw, took, sessions, elapsed = _replay(taps, binary)
+    gc.collect()
+    tracemalloc.start()
+    _replay(taps, binary)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    written = 0
+    for name in ("stamp.csv", "sessions.bin", "sessions.idx"):
+        written += hw.size(name) or 0
+    count = len(took)
+    return {
+        'taps': len(taps),
+        'transitions': count,
+        'sessions': sessions,
+        'transitions_per_s': count * 1e9 / sum(took) if count else 0.0,
+        'p50_us': took[count // 2] / 1000.0 if count else 0.0,
+        'p99_us': took[(99 * (count - 1)) // 100] / 1000.0 if count else 0.0,
+        'replay_ms': elapsed / 1e6,
+        'log_bytes': written,
+        'log_bytes_per_session': float(written) / sessions if sessions else 0.0,
+        'peak_bytes': peak,
+    }
+
+
+################################################################################
+# Suite
+
+def run_suite(sessions=200, traces=()):
+    """All synthetic cases plus one case per recorded trace file, as an ordered list of (name, results)."""
+    cases = [
+        ('voice_note', synthetic_trace(['voice_note'], sessions), False),
+        ('no_note', synthetic_trace(['no_note'], sessions), False),
+        ('focus', synthetic_trace(['focus'], sessions), False),
+        ('mixed', synthetic_trace(sorted(PATHS), sessions), False),
+        ('mixed_binary', synthetic_trace(sorted(PATHS), sessions), True),
+    ]
+    for path in traces:
+        cases.append((path, load_trace(path), False))
+    return [(name, run_case(taps, binary)) for name, taps, binary in cases]
+
+
+def _implementation():
+    impl = sys.implementation
+    return '%s %s' % (impl.name, '.'.join([str(part) for part in impl.version[:3]]))
+
+
+def save(results, path):
+    document = {'implementation': _implementation(),
+                'platform': sys.platform,
+                'cases': dict(results),
+                'order': [name for name, _ in results]}
+    with open(path, "w") as f:
+        f.write(json.dumps(document))
+        f.write("\n")
+
+
+# Printed columns: results key, heading, number format (all 10 characters wide)
+COLUMNS = (('transitions_per_s', 'trans/s', '%10.0f'), ('p50_us', 'p50 us', '%10.1f'), ('p99_us', 'p99 us', '%10.1f'),
+           ('replay_ms', 'replay ms', '%10.1f'), ('log_bytes_per_session', 'B/session', '%10.1f'),
+           ('peak_bytes', 'peak B', '%10d'))
+
+
+def show(results, old=None):
+    """Print the results, with the change against "old" (a loaded results file) below each row."""
+    print('%-14s' % 'case' + ''.join(['%10s' % title for _, title, _ in COLUMNS]))
+    for name, case in results:
+        print('%-14s' % name + ''.join([fmt % case[key] for key, _, fmt in COLUMNS]))
+        previous = old['cases'].get(name) if old else None
+        if previous:
+            changes = []
+            for key, _, _ in COLUMNS:
+                if previous.get(key):
+                    changes.append('%+9.1f%%' % (100.0 * (case[key] - previous[key]) / previous[key]))
+                else:
+                    changes.append('%10s' % '-')
+            print('%-14s' % '  vs old' + ''.join(changes))
+
+
+def main(argv):
+    out = 'bench.json'
+    compare = None
+    sessions = 200
+    traces = []
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg == '-o':
+            out = args.pop(0)
+        elif arg == '--compare':
+            compare = args.pop(0)
+        elif arg == '--sessions':
+            sessions = int(args.pop(0))
+        else:
+            traces.append(arg)
+
+    old = None
+    if compare is not None:
+        with open(compare, "r") as f:
+            old = json.loads(f.read())
+        if old.get('implementation') != _implementation():
+            print('note: %s was made on %s' % (compare, old.get('implementation')))
+    results = run_suite(sessions, traces)
+    show(results, old)
+    save(results, out)
+    print('results written to %s' % out)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,110 @@
+# Checkpoint of the running session for resume after a power cut
+# The session stamps used to live only in the state objects, a reset during Tracking1 came back up in Home and
+# the session was gone. Checkpoint keeps the current state and the open session (start and stop stamps, focus
+# timer start) in a small record in the board's non-volatile memory (microcontroller.nvm, hal.nvm), and boot
+# resumes from it with one read instead of going back to the log:
+#
+#   sequence (u16), state index (u8), version (u8), session start (u32), session stop (u32), timer start (u32),
+#   session task (u8), CRC-16 (u16)   = 19 bytes
+#
+# NVM is flash and the SAMD51 erases a whole block for every write, so a save only writes when the record
+# changes: the state index is stored only for states that can be resumed (State.resumable: Tracking1, Focus
+# Timer 1, Voice Note, Record), every other state stores the start state, which means nothing to resume.
+# Moving between Home and the profiles writes nothing, a session is one write per state it passes through.
+# That count is what limits wear: the whole of microcontroller.nvm sits in one erase block, so every save
+# erases the block whatever slot it writes.
+# Records are not rewritten in place: "slots" records form a ring and every save goes to the next slot, the
+# one with the highest sequence number and a good CRC is current. The ring is there for torn writes, not for
+# wear: a cut while the new record is written leaves a bad CRC in that slot and the previous record wins. A
+# cut during the erase itself can lose every slot, the board then boots into Home as without a checkpoint.
+
+import array
+import struct
+
+from crc import crc16
+
+RECORD = '<HBBIIIB'
+RECORD_SIZE = struct.calcsize(RECORD)
+SLOT_SIZE = RECORD_SIZE + 2
+VERSION = 2                 # 2 added the task, older records are ignored
+
+
+class Checkpoint(object):
+
+    def __init__(self, hal, offset=0, slots=16):
+        self.hal = hal
+        self.nvm = getattr(hal, 'nvm', None)    # None on boards without NVM, checkpoints are then off
+        self.offset = offset
+        self.slots = slots if self.nvm is None else min(slots, (len(self.nvm) - offset) // SLOT_SIZE)
+        self.saves = 0                          # records written since boot
+        self._slot = 0                          # slot the next record goes to
+        self._seq = 0
+        self._last = array.array('L', [0] * 5)  # record last written or loaded, without its sequence number
+        self._valid = False                     # False until _last holds one
+        self._buf = bytearray(SLOT_SIZE)
+        self._record = memoryview(self._buf)[:RECORD_SIZE]     # the part the CRC covers, sliced once
+
+    def load(self):
+        """The newest good record as (state index, session start, session stop, timer start, task), None when there is none."""
+        if self.nvm is None:
+            return None
+        data = bytes(self.nvm[self.offset:self.offset + self.slots * SLOT_SIZE])     # the one read at boot
+        best = None
+        for slot in range(self.slots):
+            at = slot * SLOT_SIZE
+            if crc16(data[at:at + RECORD_SIZE]) != data[at + RECORD_SIZE] | data[at + RECORD_SIZE + 1] << 8:
+                continue
+            seq, index, version, start, stop, timer, task = struct.unpack_from(RECORD, data, at)
+            if version != VERSION:
+                continue
+            if best is None or (seq - best[0]) & 0xffff < 0x8000:      # newer, the sequence wraps
+                best = (seq, slot, (index, start, stop, timer, task))
+        if best is None:
+            return None
+        self._seq = best[0]
+        self._slot = (best[1] + 1) % self.slots
+        for i in range(5):
+            self._last[i] = best[2][i]
+        self._valid = True
+        return best[2]
+
+    def save(self, machine):
+        """Write the machine's state and open session to the next slot, unless it is already the current record."""
+        if self.nvm is None:
+            return
+        resumable = machine.state.resumable
+        if not (self._valid or resumable):      # nothing on record and nothing to resume
+            return
+        index = machine.index if resumable else machine.start_index
+        last = self._last                       # compared field by field, a transition builds no tuple
+        if (self._valid and last[0] == index and last[1] == machine.session.start and
+                last[2] == machine.session.stop and last[3] == machine.timer_start and last[4] == machine.session.task):
+            return
+        self._seq = (self._seq + 1) & 0xffff
+        struct.pack_into(RECORD, self._buf, 0, self._seq, index, VERSION, machine.session.start,
+                         machine.session.stop, machine.timer_start, machine.session.task)
+        crc = crc16(self._record)
+        self._buf[RECORD_SIZE] = crc & 0xff
+        self._buf[RECORD_SIZE + 1] = crc >> 8
+        at = self.offset + self._slot * SLOT_SIZE
+        self.nvm[at:at + SLOT_SIZE] = self._buf
+        self._slot = (self._slot + 1) % self.slots
+        last[0] = index
+        last[1] = machine.session.start
+        last[2] = machine.session.stop
+        last[3] = machine.timer_start
+        last[4] = machine.session.task
+        self._valid = True
+        self.saves += 1
+
+    def restore(self, machine):
+        """Resume the machine from the newest record (see StateMachine.resume), returns False and leaves it
+        alone when there is nothing to resume."""
+        record = self.load()
+        if (record is None or record[0] >= len(machine.objects) or record[0] == machine.start_index or
+                not machine.objects[record[0]].resumable):
+            return False
+        machine.session.resume(record[1], record[2], record[4])
+        machine.timer_start = record[3]
+        machine.resume(record[0])
+        return True
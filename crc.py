@@ -0,0 +1,22 @@
+# CRC-16/CCITT-FALSE, table driven
+# Checks the NVM checkpoint records (checkpoint.py) and the screen link frames (screenlink.py).
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xffff
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def crc16(data, crc=0xffff):
+    """CRC-16/CCITT-FALSE of "data" (bytes, bytearray or memoryview)."""
+    for byte in data:
+        crc = ((crc << 8) & 0xffff) ^ _CRC_TABLE[(crc >> 8) ^ byte]
+    return crc
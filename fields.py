@@ -0,0 +1,21 @@
+# Live screen fields
+# The data a state shows besides its screen (State.fields), as (field id, text) pairs. The ids and their text
+# layout are shared by the states and by the screen link (screenlink.py), which sends them to the controller.
+
+from hal import from_epoch
+
+DATE_TIME = 1               # "m/d/yyyy h:mm"
+ELAPSED = 2                 # tracked time of the running session, "h:mm"
+REMAINING = 3               # focus timer countdown, "h:mm"
+TEXT = 4                    # text lines of a spec-only screen
+TODAY = 5                   # time tracked today, the running session included, "h:mm"
+
+
+def date_time(epoch):                               # Text of the DATE_TIME field
+    t = from_epoch(epoch)
+    return "%d/%d/%d %d:%02d" % (t.tm_mon, t.tm_mday, t.tm_year, t.tm_hour, t.tm_min)
+
+
+def duration(seconds):                              # Text of the ELAPSED, REMAINING and TODAY fields
+    minutes = max(0, int(seconds)) // 60
+    return "%d:%02d" % (minutes // 60, minutes % 60)
@@ -0,0 +1,136 @@
+# Multi-tenant runtime: many logical state machines in one process (meant for the Raspberry Pi host)
+# A StateMachine carries its own hardware, state objects and logs, which is far too heavy to keep one per
+# user or device by the hundred thousand. Fleet compiles the spec once and shares the tables between all
+# its machines; a machine is only a slot in a few typed arrays:
+#
+#   state index (1 byte), task id (1 byte), session START and STOP epochs (4 bytes each)
+#
+# The state classes are not run for fleet machines. What they do to a session is read once from the same
+# class attributes StateMachine runs them from (State.on_enter, State.on_exit, State.hook_actions, State.task)
+# and applied to the columns in dispatch(). Finished sessions go to the "sink" callable.
+#
+#   python3 fleet.py [machines] [rounds]        benchmark: memory per machine and events per second
+
+import array
+
+from state_machine import BEGIN, END, LOG_NOTE, MACHINE_SPEC, compile_spec
+
+
+class Fleet(object):
+
+    def __init__(self, count, spec=None, sink=None):
+        tables = compile_spec(MACHINE_SPEC if spec is None else spec, None)
+        self.names = tables['names']
+        self.events = tables['events']
+        self.table = tables['table']
+        self.sink = sink                            # sink(machine, start, stop, task, note) for every finished session
+        self.sessions = 0                           # finished sessions so far
+
+        objects = tables['objects']
+        self.on_enter = array.array('B', [state.on_enter for state in objects])
+        self.on_exit = array.array('B', [state.on_exit for state in objects])
+        self.task_of = array.array('B', [state.task for state in objects])
+        self.on_hook = tables['hook_actions']       # a hook's tracing and screen work has no fleet counterpart, only its session action
+
+        # Per machine columns, preallocated
+        self.count = count
+        self.state = array.array('B', [tables['start']]) * count
+        self.task = array.array('B', [0]) * count
+        self.start = array.array('I', [0]) * count
+        self.stop = array.array('I', [0]) * count
+
+    def state_name(self, machine):
+        return self.names[self.state[machine]]
+
+    def dispatch(self, machine, key_number, now):
+        """One switch press for one machine at epoch "now", returns True when it changed state."""
+        index = self.state[machine]
+        at = index * self.events + key_number
+        target = self.table[at]
+        if target < 0:
+            return False
+        if self.on_hook[at]:
+            self._act(machine, self.on_hook[at], now)
+        if self.on_exit[index]:
+            self._act(machine, self.on_exit[index], now)
+        self.state[machine] = target
+        if self.on_enter[target]:
+            self._act(machine, self.on_enter[target], now)
+        return True
+
+    def dispatch_batch(self, machines, keys, now):
+        """Dispatch keys[i] to machines[i] for every i, all at epoch "now". Returns the number of transitions."""
+        # Same as dispatch() with everything pulled into locals, this loop is the hot path
+        state = self.state
+        table = self.table
+        width = self.events
+        on_hook = self.on_hook
+        on_exit = self.on_exit
+        on_enter = self.on_enter
+        act = self._act
+        moved = 0
+        for machine, key in zip(machines, keys):
+            index = state[machine]
+            at = index * width + key
+            target = table[at]
+            if target < 0:
+                continue
+            if on_hook[at]:
+                act(machine, on_hook[at], now)
+            if on_exit[index]:
+                act(machine, on_exit[index], now)
+            state[machine] = target
+            if on_enter[target]:
+                act(machine, on_enter[target], now)
+            moved += 1
+        return moved
+
+    def _act(self, machine, action, now):           # StateMachine.act() on the columns, on BEGIN the state is already the one entered
+        if action == BEGIN:
+            self.start[machine] = now
+            self.task[machine] = self.task_of[self.state[machine]]
+        elif action == END:
+            self.stop[machine] = now
+        else:
+            self.sessions += 1
+            if self.sink is not None:
+                self.sink(machine, self.start[machine], self.stop[machine], self.task[machine], action == LOG_NOTE)
+
+    def bytes_per_machine(self):
+        return (self.state.itemsize + self.task.itemsize + self.start.itemsize + self.stop.itemsize)
+
+
+################################################################################
+# Benchmark
+
+def _benchmark(count, rounds):
+    import random
+    import time
+    import tracemalloc
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fleet = Fleet(count)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    rng = random.Random(1)
+    machines = array.array('L', range(count))
+    batches = [array.array('B', [rng.randrange(fleet.events) for _ in range(count)]) for _ in range(4)]
+    now = 1700000000
+    moved = 0
+    began = time.perf_counter()
+    for r in range(rounds):
+        moved += fleet.dispatch_batch(machines, batches[r % len(batches)], now + r)
+    took = time.perf_counter() - began
+
+    print('machines            %d' % count)
+    print('bytes per machine   %.1f measured, %d in the columns' % (float(after - before) / count, fleet.bytes_per_machine()))
+    print('events              %d in %.3f s, %.0f events/s' % (count * rounds, took, count * rounds / took))
+    print('transitions         %d, sessions finished %d' % (moved, fleet.sessions))
+
+
+if __name__ == '__main__':
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+               int(sys.argv[2]) if len(sys.argv) > 2 else 20)
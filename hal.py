@@ -0,0 +1,267 @@
+# Hardware abstraction layer
+# Every pin, switch, the RTC and the SD card used by the states are reached through one object.
+# DeviceHAL builds it from the CircuitPython drivers on the M4 express, hal_sim.SimHAL builds
+# an in-memory stand-in so the state machine can run on a Linux box (see create() below).
+# Only the pins are set up when DeviceHAL is created, so the first screen can go out right away;
+# the RTC (I2C) and the SD card (SPI) come up the first time something reads the clock or a file.
+
+import os
+import sys
+import time
+
+try:
+    from calendar import timegm
+except ImportError:         # CircuitPython has no time zones, its mktime() reads the fields as they are
+    timegm = time.mktime
+
+
+################################################################################
+# Pin map, names of the "board" attributes so this table can be read without the board module
+
+# Input Pins
+SWITCH_1_PIN = 'D5'
+SWITCH_2_PIN = 'D6'
+SWITCH_PINS = (SWITCH_1_PIN, SWITCH_2_PIN)     # key number order, append a pin here for another button
+
+# Output Pins
+HOME_SCRN_OUT = 'D4'
+PROFILE1_SCRN_OUT = 'D14'
+TRACK1_SCRN_OUT = 'D15'
+FOCUS1_SCRN_OUT = 'D16'
+PROFILE2_SCRN_OUT = 'D17'
+VOICENOTE_SCRN_OUT = 'D18'
+RECORD_SCRN_OUT = 'D19'
+
+# SD card chip select line on the M4 board
+SD_CS_PIN = 'D10'
+
+# UART to the e-paper controller when the screens go over the serial link (screenlink.py)
+DISPLAY_TX_PIN = 'TX'
+DISPLAY_RX_PIN = 'RX'
+DISPLAY_BAUD = 115200
+
+# Debounce interval used by keypad in event driven mode, seconds
+KEY_INTERVAL = 0.02
+
+# Tickless idle (StateMachine.run_tickless): waits shorter than this are slept in KEY_INTERVAL steps, longer ones
+# in light sleep with the switches as pin alarms, seconds
+LIGHT_SLEEP_MIN = 0.5
+
+# Polled mode: seconds between two scans of the switches, and how many scans in a row must agree
+# before a switch changes state (1, 2 or 4, see scanner.py)
+SCAN_INTERVAL = 0.01
+SCAN_SAMPLES = 4
+
+# Attribute name of each screen select output, in the order of the pins above
+SCREENS = (
+    ('home_scrn', HOME_SCRN_OUT),
+    ('profile1_scrn', PROFILE1_SCRN_OUT),
+    ('track1_scrn', TRACK1_SCRN_OUT),
+    ('focus1_scrn', FOCUS1_SCRN_OUT),
+    ('profile2_scrn', PROFILE2_SCRN_OUT),
+    ('voicenote_scrn', VOICENOTE_SCRN_OUT),
+    ('record_scrn', RECORD_SCRN_OUT),
+)
+
+
+################################################################################
+# Time conversion, the RTC keeps plain local time with no zone and every epoch in the logs counts it as UTC,
+# so a PC (the simulator, the recorder) must not bring its own time zone in
+
+def to_epoch(t):
+    """Epoch seconds of the struct_time "t", as read from the RTC."""
+    return int(timegm(t))
+
+
+from_epoch = getattr(time, 'gmtime', time.localtime)    # epoch seconds -> struct_time, the inverse of to_epoch
+
+
+################################################################################
+# Switch used in event driven mode, a placeholder: the edges only exist as keypad events, which go straight
+# to StateMachine.dispatch, so there are no fell/rose flags and "value" always reads released
+
+class KeySwitch(object):
+
+    def __init__(self):
+        self.value = True
+
+    def update(self):                           # Nothing to poll, edges arrive through the event queue
+        pass
+
+
+################################################################################
+# The real hardware
+
+class DeviceHAL(object):
+
+    def __init__(self, mount="/sd", events=False):
+        import board
+        import digitalio
+        import microcontroller
+        import supervisor
+        from scanner import SwitchScanner, ScannedSwitch, pin_reader
+
+        self.mount = mount
+        self.keys = None
+        self.scanner = None
+        self.scan_interval = SCAN_INTERVAL
+        self.virtual_time = False
+        self._runtime = supervisor.runtime
+        self._rtc = None                        # the RTC and its I2C bus come up the first time they are used
+        self._mounted = False                   # the SD card is mounted on the first file access
+        self._uart = None                       # the display UART is only set up when the screen link asks for it
+        self.nvm = microcontroller.nvm          # non-volatile bytes for checkpoint.py, None on boards without
+
+        # Initialization of inputs
+        if events:
+            # keypad scans and debounces the pins in the background and queues the edges,
+            # read them with get_event(), the switches below carry no edge state
+            import keypad
+            pins = [getattr(board, name) for name in SWITCH_PINS]
+            self.keys = keypad.Keys(pins, value_when_pressed=False, pull=True, interval=KEY_INTERVAL)
+            self.switches = tuple([KeySwitch() for _ in SWITCH_PINS])
+        else:
+            # One scanner samples and debounces every switch together, scan() once per loop
+            pins = [self._input(digitalio, getattr(board, name)) for name in SWITCH_PINS]
+            self.scanner = SwitchScanner(pin_reader(pins), len(pins), SCAN_SAMPLES)
+            self.switches = tuple([ScannedSwitch(self.scanner, key) for key in range(len(pins))])
+        self.switch_1 = self.switches[0]                # indexed by keypad key number
+        self.switch_2 = self.switches[1]
+
+        # Initialization of outputs
+
+        # Lights up LED for log on SD card:
+        self.led = self._output(digitalio, board.LED)
+        for name, pin in SCREENS:
+            setattr(self, name, self._output(digitalio, getattr(board, pin)))
+
+    @property
+    def rtc(self):                              # The PCF8523, I2C and the driver are only set up on first use
+        if self._rtc is None:
+            import board
+            import busio
+            import adafruit_pcf8523
+            # Creates object I2C that connects the I2C module to pins SCL and SDA
+            i2c = busio.I2C(board.SCL, board.SDA)
+            # Creates an object that can access the RTC and communicate that information along using I2C.
+            self._rtc = adafruit_pcf8523.PCF8523(i2c)
+        return self._rtc
+
+    def display_port(self):                     # UART to the e-paper controller for screenlink.ScreenLink, set up on first use
+        if self._uart is None:
+            import board
+            import busio
+            self._uart = busio.UART(getattr(board, DISPLAY_TX_PIN), getattr(board, DISPLAY_RX_PIN),
+                                    baudrate=DISPLAY_BAUD, timeout=0)
+        return self._uart
+
+    def _path(self, name):                      # Full path of "name" on the card, mounts the card on first use
+        if not self._mounted:
+            import board
+            import busio
+            import digitalio
+            import adafruit_sdcard
+            import storage
+            # Creates object that connects SPI bus and a digital output for the microSD card's CS line.
+            spi = busio.SPI(board.SCK, MOSI=board.MOSI, MISO=board.MISO)
+            cs = digitalio.DigitalInOut(getattr(board, SD_CS_PIN))
+
+            # This creates the microSD card object and the filesystem object, then mounts it
+            # so "/sd" on the CircuitPython filesystem reads and writes from the card
+            sdcard = adafruit_sdcard.SDCard(spi, cs)
+            storage.mount(storage.VfsFat(sdcard), self.mount)
+            self._mounted = True
+        return self.mount + "/" + name
+
+    @staticmethod
+    def _input(digitalio, pin):
+        pin_io = digitalio.DigitalInOut(pin)
+        pin_io.direction = digitalio.Direction.INPUT
+        pin_io.pull = digitalio.Pull.UP
+        return pin_io
+
+    @staticmethod
+    def _output(digitalio, pin):
+        pin_io = digitalio.DigitalInOut(pin)
+        pin_io.direction = digitalio.Direction.OUTPUT
+        return pin_io
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def monotonic_ns(self):
+        return time.monotonic_ns()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def scan(self):                             # Polled mode: sample and debounce all switches in one pass
+        self.scanner.update()
+
+    def get_event(self):                        # Next queued keypad event (key_number, pressed), None when empty
+        return self.keys.events.get()
+
+    def wait(self, timeout):                    # Idle until an event may be waiting, time.sleep idles the core between ticks
+        if not self.keys.events:
+            time.sleep(timeout)
+
+    def sleep_until(self, deadline):            # Tickless idle until time.monotonic() reaches "deadline" or a switch is pressed
+        timeout = deadline - time.monotonic()
+        if timeout <= 0 or self.keys.events:
+            return
+        if timeout < LIGHT_SLEEP_MIN:
+            time.sleep(min(timeout, KEY_INTERVAL))  # a press waits at most one debounce interval
+            return
+        # keypad owns the pins, hand them to pin alarms for the sleep. keypad starts with every key released,
+        # so the switch that woke the board is still held when it scans again and queues the press
+        import alarm
+        import board
+        import keypad
+        pins = [getattr(board, name) for name in SWITCH_PINS]
+        self.keys.deinit()
+        try:
+            alarm.light_sleep_until_alarms(alarm.time.TimeAlarm(monotonic_time=deadline),
+                                           *[alarm.pin.PinAlarm(pin, value=False, pull=True) for pin in pins])
+        finally:
+            self.keys = keypad.Keys(pins, value_when_pressed=False, pull=True, interval=KEY_INTERVAL)
+
+    def serial_command(self):                   # One character typed on the serial monitor, None when nothing waits
+        if self._runtime.serial_bytes_available:
+            return sys.stdin.read(1)
+        return None
+
+    def open(self, name, mode="r"):             # Opens a file on the SD card, "name" is relative to the mount point
+        return open(self._path(name), mode)
+
+    def size(self, name):                       # Size of a file on the SD card in bytes, None when it doesn't exist
+        try:
+            return os.stat(self._path(name))[6]
+        except OSError:
+            return None
+
+    def remove(self, name):
+        os.remove(self._path(name))
+
+    def rename(self, old, new):                 # "new" must not exist yet, FAT won't replace a file
+        os.rename(self._path(old), self._path(new))
+
+
+################################################################################
+# Backend selection
+
+def create(simulate=None, events=False):
+    """Return DeviceHAL on a CircuitPython board, otherwise the simulation backend.
+
+    With events=True the switches are delivered as edge events (see StateMachine.run_events)
+    instead of being polled through scan().
+    """
+    if simulate is None:
+        try:
+            import board    # pylint: disable=unused-import
+            simulate = False
+        except ImportError:
+            simulate = True
+    if simulate:
+        from hal_sim import SimHAL
+        return SimHAL()
+    return DeviceHAL(events=events)
@@ -0,0 +1,285 @@
+# Simulation backend for the hardware abstraction layer (see hal.py)
+# Runs the state machine on a Linux box: a virtual clock that only moves when the code sleeps,
+# switches driven by a script of edges, a fake RTC that follows the virtual clock and an "/sd"
+# kept in RAM (or in a real directory such as a tmpfs mount).
+# Meant for CPython (tests, bench.py, recorder.py), the CircuitPython build never imports this file.
+
+import heapq
+import io
+import os
+
+from hal import SCAN_INTERVAL, SCAN_SAMPLES, SCREENS, from_epoch, to_epoch
+from scanner import SwitchScanner
+
+
+################################################################################
+# Virtual clock, sleeping advances time instantly
+
+class SimClock(object):
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def advance_to(self, when):                 # Jump forward, never backwards
+        if when > self.now:
+            self.now = when
+
+
+################################################################################
+# Switch with the same surface as adafruit_debouncer.Debouncer (update, value, fell, rose)
+
+class SimSwitch(object):
+
+    def __init__(self, clock):
+        self._clock = clock
+        self._edges = []                        # heap of (time, sequence, level) waiting to be applied
+        self._seq = 0
+        self._level = True                      # raw pin level, pulled up so idle is high
+        self.value = True
+        self.fell = False
+        self.rose = False
+
+    def set(self, level, at=None):              # Drive the pin to "level", now or at virtual time "at"
+        if at is None:
+            self._level = level
+        else:
+            self._seq += 1
+            heapq.heappush(self._edges, (at, self._seq, level))
+
+    def press(self, at=None):
+        self.set(False, at)
+
+    def release(self, at=None):
+        self.set(True, at)
+
+    def tap(self, at, hold=0.05):               # Press at "at" and release "hold" seconds later
+        self.set(False, at)
+        self.set(True, at + hold)
+
+    def pending(self):                          # Virtual time of the next scripted edge, None when idle
+        return self._edges[0][0] if self._edges else None
+
+    def pop_edge(self):                         # Apply the next scripted edge, returns True when the level changed
+        level = heapq.heappop(self._edges)[2]
+        changed = level != self._level
+        self._level = self.value = level
+        return changed
+
+    def level(self):                            # Raw pin level now, after every scripted edge that is due
+        edges = self._edges
+        now = self._clock.now
+        while edges and edges[0][0] <= now:
+            self._level = heapq.heappop(edges)[2]
+        return self._level
+
+    def update(self):
+        self.level()
+        previous = self.value
+        self.value = self._level
+        self.fell = previous and not self.value
+        self.rose = self.value and not previous
+
+
+################################################################################
+# Input event, same fields as keypad.Event
+
+class SimEvent(object):
+
+    def __init__(self, key_number, pressed, timestamp):
+        self.key_number = key_number
+        self.pressed = pressed
+        self.released = not pressed
+        self.timestamp = timestamp
+
+
+################################################################################
+# Output pin, only remembers its level
+
+class SimPin(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.value = False
+
+
+################################################################################
+# PCF8523 stand-in, the date and time move with the virtual clock
+
+class SimRTC(object):
+
+    def __init__(self, clock, epoch=0):
+        self._clock = clock
+        self._offset = epoch - clock.now
+
+    @property
+    def datetime(self):
+        return from_epoch(int(self._offset + self._clock.now))
+
+    @datetime.setter
+    def datetime(self, t):
+        self._offset = to_epoch(tuple(t)) - self._clock.now
+
+
+################################################################################
+# RAM backed "/sd", a dictionary of file name to bytes
+
+class _RamFile(io.BytesIO):
+
+    def __init__(self, fs, name, data, append):
+        io.BytesIO.__init__(self, data)
+        self._fs = fs
+        self._name = name
+        if append:
+            self.seek(0, 2)
+
+    def flush(self):
+        io.BytesIO.flush(self)
+        self._fs.files[self._name] = self.getvalue()
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+        io.BytesIO.close(self)
+
+
+class RamFS(object):
+
+    def __init__(self):
+        self.files = {}
+
+    def open(self, name, mode="r"):
+        if "r" in mode and name not in self.files:
+            raise OSError(2, "No such file", name)
+        data = b"" if "w" in mode else self.files.get(name, b"")
+        self.files.setdefault(name, data)
+        f = _RamFile(self, name, data, "a" in mode)
+        if "b" in mode:
+            return f
+        return io.TextIOWrapper(f, encoding="utf-8", newline="")
+
+    def size(self, name):
+        data = self.files.get(name)
+        return None if data is None else len(data)
+
+    def remove(self, name):
+        if self.files.pop(name, None) is None:
+            raise OSError(2, "No such file", name)
+
+    def rename(self, old, new):
+        if old not in self.files:
+            raise OSError(2, "No such file", old)
+        if new in self.files:
+            raise OSError(17, "File exists", new)
+        self.files[new] = self.files.pop(old)
+
+
+################################################################################
+# The simulated hardware, same attribute names as hal.DeviceHAL
+
+class SimHAL(object):
+
+    def __init__(self, sd_path=None, epoch=0, nvm=None):
+        self.clock = SimClock()
+        self.switch_1 = SimSwitch(self.clock)
+        self.switch_2 = SimSwitch(self.clock)
+        self.switches = (self.switch_1, self.switch_2)     # indexed like keypad key numbers
+        self.scanner = SwitchScanner(self._read_switches, len(self.switches), SCAN_SAMPLES)
+        self.scan_interval = SCAN_INTERVAL
+        self.virtual_time = True                # runtime.py waits on the virtual clock instead of asyncio's
+        self.led = SimPin('led')
+        for name, _ in SCREENS:
+            setattr(self, name, SimPin(name))
+        self.rtc = SimRTC(self.clock, epoch)
+        self.sd_path = sd_path                  # None keeps the card in RAM, or a directory (tmpfs) to write through
+        self.fs = None if sd_path else RamFS()
+        self.serial_input = []                  # characters "typed" on the serial monitor, oldest first
+        self.controller = None                  # screenlink.SimController behind display_port()
+        self.nvm = nvm if nvm is not None else bytearray(b'\xff' * 1024)    # pass the same one in to simulate a reboot
+
+    def monotonic(self):
+        return self.clock.monotonic()
+
+    def monotonic_ns(self):
+        return int(round(self.clock.now * 1000000000))     # rounded, a deadline given in seconds lands on its nanosecond
+
+    def sleep(self, seconds):
+        self.clock.sleep(seconds)
+
+    def _read_switches(self):                   # Raw levels as a pressed bitmask, like scanner.pin_reader
+        bits = 0
+        for key, switch in enumerate(self.switches):
+            if not switch.level():
+                bits |= 1 << key
+        return bits
+
+    def scan(self):
+        self.scanner.update()
+
+    def next_edge(self):                        # Virtual time of the earliest scripted edge on any switch
+        pending = [t for t in (switch.pending() for switch in self.switches) if t is not None]
+        return min(pending) if pending else None
+
+    def get_event(self):                        # Event driven mode, the scripted edges come out as keypad style events
+        while True:
+            due = self.get_event_due()
+            if due is None:
+                return None
+            for key, switch in enumerate(self.switches):
+                if switch.pending() == due:
+                    if switch.pop_edge():
+                        return SimEvent(key, not switch.value, due)
+                    break
+
+    def wait(self, timeout):                    # Same as DeviceHAL.wait, an edge during the sleep is seen when it ends
+        if self.get_event_due() is None:
+            self.clock.sleep(timeout)
+
+    def sleep_until(self, deadline):            # Tickless idle, the clock jumps to "deadline" or the next scripted edge (the pin alarm)
+        if self.get_event_due() is not None:
+            return
+        edge = self.next_edge()
+        self.clock.advance_to(deadline if edge is None else min(deadline, edge))
+
+    def get_event_due(self):                    # Time of the earliest edge already waiting in the "queue", else None
+        due = self.next_edge()
+        return due if due is not None and due <= self.clock.now else None
+
+    def serial_command(self):
+        return self.serial_input.pop(0) if self.serial_input else None
+
+    def display_port(self):                     # The display UART, looped back to a simulated e-paper controller
+        from screenlink import Loopback, SimController
+        if self.controller is None:
+            self.controller = SimController()
+        return Loopback(self.controller)
+
+    def open(self, name, mode="r"):
+        if self.fs is not None:
+            return self.fs.open(name, mode)
+        return open(self.sd_path + "/" + name, mode)
+
+    def size(self, name):
+        if self.fs is not None:
+            return self.fs.size(name)
+        try:
+            return os.stat(self.sd_path + "/" + name)[6]      # st_size, MicroPython returns a plain tuple
+        except OSError:
+            return None
+
+    def remove(self, name):
+        if self.fs is not None:
+            self.fs.remove(name)
+        else:
+            os.remove(self.sd_path + "/" + name)
+
+    def rename(self, old, new):
+        if self.fs is not None:
+            self.fs.rename(old, new)
+        else:
+            os.rename(self.sd_path + "/" + old, self.sd_path + "/" + new)
@@ -0,0 +1,159 @@
+# Heap telemetry
+# The M4's heap is small and MicroPython only frees by collecting: every string a transition formats stays
+# until the next gc.collect(), and that collection runs whenever an allocation finds no room, often in the
+# middle of a transition. HeapMonitor.attach() wraps the machine's transition and poll() like instrument.py
+# does and records:
+#
+#   bytes allocated per transition, overall and per target state (small and steady when no state formats strings)
+#   collections that ran inside a transition or elsewhere in the loop, seen as gc.mem_alloc() going down
+#   gc.mem_free() now and its low water mark
+#   the pause of every collection it runs itself
+#
+# It also moves the collections out of the transitions: when gc.mem_free() drops below "low" it collects from
+# poll(), between transitions, and times that pause. detach() puts the originals back. Serial monitor letters
+# while attached (through StateMachine.commands):
+#   h   print the report (with micropython.mem_info(), whose "max free sz" shows fragmentation)
+#   c   collect now and time it            z   start over
+#
+# On CPython (the simulator) there is no gc.mem_alloc(), tracemalloc is started instead and a transition's
+# bytes are the peak it held above where it started; collections are not seen. The numbers only show which
+# paths allocate, CPython boxes every int and float the board keeps in a word.
+
+import gc
+
+from instrument import Histogram
+
+try:
+    from micropython import mem_info
+except ImportError:
+    mem_info = None
+
+if hasattr(gc, 'mem_alloc'):
+    tracemalloc = None
+
+    def _mark():
+        return gc.mem_alloc()
+
+    def _since(mark):                   # Bytes allocated since "mark", negative when a collection ran meanwhile
+        return gc.mem_alloc() - mark
+
+    _free = gc.mem_free
+else:
+    import tracemalloc
+
+    def _mark():
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+    def _since(mark):
+        return tracemalloc.get_traced_memory()[1] - mark
+
+    def _free():
+        return 0
+
+
+class HeapMonitor(object):
+
+    def __init__(self, machine, low=16 * 1024):
+        self.machine = machine
+        self.hal = machine.hal
+        self.low = low                          # collect from poll() below this much free heap, None never does
+        self.allocated = Histogram('B')         # bytes per transition
+        self.into = [Histogram('B') for _ in range(len(machine.names))]    # the same by target state
+        self.pause = Histogram()                # collections run here, us
+        self.in_transition = 0                  # collections that ran inside a transition
+        self.elsewhere = 0                      # and in the rest of the loop
+        self.lowest = None                      # low water mark of gc.mem_free()
+        self._last = 0                          # _mark() at the end of the last wrapped call
+        self._saved = None
+
+    def attach(self):
+        """Start watching the machine, safe to call once."""
+        machine = self.machine
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._saved = (machine.go_to_index, machine.poll)
+        go_to_index, poll = self._saved
+
+        def watched_go_to_index(target):
+            mark = _mark()
+            go_to_index(target)
+            used = _since(mark)
+            if used < 0:
+                self.in_transition += 1
+            else:
+                self.allocated.record(used)
+                self.into[target].record(used)
+            self._last = _mark()
+        machine.go_to_index = watched_go_to_index
+
+        def watched_poll():
+            if tracemalloc is None and gc.mem_alloc() < self._last:
+                self.elsewhere += 1             # nobody here collected since the last call
+            poll()
+            free = _free()
+            if self.lowest is None or free < self.lowest:
+                self.lowest = free
+            if self.low is not None and tracemalloc is None and free < self.low:
+                self.collect()
+            self._last = _mark()
+        machine.poll = watched_poll
+        for letter in 'hcz':
+            machine.commands[letter] = self._command(letter)
+        self._last = _mark()
+
+    def detach(self):
+        if self._saved is None:
+            return
+        machine = self.machine
+        del machine.go_to_index             # back to the class methods
+        del machine.poll
+        for letter in 'hcz':
+            machine.commands.pop(letter, None)
+        self._saved = None
+
+    def collect(self):
+        """gc.collect() now, outside any transition, and record the pause."""
+        clock = self.hal.monotonic_ns
+        began = clock()
+        gc.collect()
+        self.pause.record((clock() - began) // 1000)
+        self._last = _mark()
+
+    def reset(self):
+        for histogram in [self.allocated, self.pause] + self.into:
+            histogram.reset()
+        self.in_transition = 0
+        self.elsewhere = 0
+        self.lowest = None
+
+    def command(self, letter):                      # One of the serial monitor commands listed at the top
+        if letter == 'h':
+            self.dump()
+        elif letter == 'c':
+            self.collect()
+            self.dump()
+        elif letter == 'z':
+            self.reset()
+
+    def _command(self, letter):
+        return lambda: self.command(letter)
+
+    def report(self):
+        """The numbers as a list of text lines."""
+        allocating = self.allocated.count - self.allocated.counts[0]       # bucket 0 holds the zeros
+        lines = ['heap free %d, lowest %s' % (_free(), self.lowest),
+                 'transition alloc  %s, %d of them allocated' % (self.allocated.summary(), allocating),
+                 'collections %d in a transition, %d elsewhere, pause %s' % (
+                     self.in_transition, self.elsewhere, self.pause.summary())]
+        for i, name in enumerate(self.machine.names):
+            if self.into[i].count:
+                lines.append('into %s: %s' % (name, self.into[i].summary()))
+        return lines
+
+    def dump(self):
+        """Print the report to the serial monitor."""
+        for line in self.report():
+            print(line)
+        if mem_info is not None:
+            mem_info()
@@ -0,0 +1,297 @@
+# Fleet log ingestion for the Raspberry Pi host (needs NumPy, never runs on the board)
+# Every device writes its own stamp.csv (fragments, repeated header rows, "Delta Formula" filler) or
+# sessions.bin. ingest() parses many of them at once in a process pool, repairs the fragments into whole
+# sessions (the same parser as analytics.py) and merges everything into one store, a directory with:
+#
+#   sessions.bin    16 byte records sorted by start: start (u32), stop (u32), device (u32), task (u16), note (u8), pad
+#   days.npy        record number of the first session of every day from "first_day" on, plus the record count
+#   catalog.json    device names and what was already read from every log file
+#
+# Each log file is a stream: the catalog keeps its device, the bytes read so far, where the last whole session
+# started and a hash of its first bytes. A file whose first bytes match a stream of its device and which is
+# at least as long is that stream grown, only the bytes after the last session are parsed again (the last
+# session is re-read because its voice note can arrive later). That also covers a rotated stamp.csv showing
+# up as stamp.0001.csv. A file that matches nothing is read whole, and skipped when its content hash equals
+# a file read before (the same card imported twice). Records are keyed by (device, start), a re-read
+# session replaces the old one.
+#
+# A rotation can cut a session in two: the closed segment ends with its date and time in, the next file starts
+# with the time out or the voice note. The stamp files of a device are put in rotation order (stamp.0001.csv,
+# stamp.0002.csv ... stamp.csv) and the text of each one from its last whole session on is parsed again with
+# the start of the next, like analytics.read_rotated reads the segments as one stream.
+#
+#   python3 ingest.py STORE LOG_OR_FOLDER... [-j WORKERS]      the device name is the log's folder name
+
+import hashlib
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+from analytics import DAY, _SESSION, _SESSION_RECORD, Sessions, _columns_from_matches
+
+STORE_RECORD = np.dtype([('start', '<u4'), ('stop', '<u4'), ('device', '<u4'), ('task', '<u2'),
+                         ('note', 'u1'), ('pad', 'u1')])
+HEAD = 4096                 # bytes hashed to recognise a stream when it has grown
+_SEGMENT = re.compile(r'\.(\d+)(?:-\d+)?\.csv$')    # stamp.0003.csv, or stamp.0001-0002.csv after logrotate's compact()
+
+
+################################################################################
+# Parsing, runs in the worker processes
+
+def _head(path, length):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(length)).hexdigest()
+
+
+def parse_log(job):
+    """Worker: parse the log "path" from byte "offset". "crc" is the CRC-32 of its first "size" bytes (read
+    before), it is carried on over the new bytes. Returns the new sessions as column arrays, the file size,
+    its CRC-32, the offset to start from next time and, for a csv read from the start, the text before its
+    first whole session without the header row (the end of a session the previous segment started)."""
+    path, offset, size, crc = job
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()                             # only the bytes not parsed before
+    crc = zlib.crc32(data[size - offset:], crc)
+    size = offset + len(data)
+    if path.endswith('.bin'):
+        count = len(data) // _SESSION_RECORD.itemsize
+        records = np.frombuffer(data, dtype=_SESSION_RECORD, count=count)
+        columns = (records['start'], records['stop'], records['task'], records['note'] != 0)
+        return path, columns, size, crc, offset + count * _SESSION_RECORD.itemsize, ''
+    text = data.decode('latin-1')                   # one character per byte, match positions are byte offsets
+    matches = []
+    first = last = None
+    for match in _SESSION.finditer(text):
+        matches.append(match.groups(''))
+        last = match.start()
+        if first is None:
+            first = last
+    sessions = _columns_from_matches(matches, 1, 0)
+    columns = (sessions.start, sessions.stop, sessions.task, sessions.note)
+    lead = ''
+    if offset == 0:
+        lead = text[:first]
+        if lead.startswith('Date,'):
+            lead = lead[lead.find('\n') + 1:]
+    return path, columns, size, crc, offset if last is None else offset + last, lead
+
+
+################################################################################
+# The store
+
+class Store(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.catalog = {'devices': [], 'streams': [], 'first_day': 0}
+        name = os.path.join(path, 'catalog.json')
+        if os.path.exists(name):
+            with open(name, 'r') as f:
+                self.catalog = json.load(f)
+
+    def records(self):
+        name = os.path.join(self.path, 'sessions.bin')
+        if not os.path.exists(name):
+            return np.zeros(0, dtype=STORE_RECORD)
+        return np.fromfile(name, dtype=STORE_RECORD)
+
+    def sessions(self):
+        """Every session in the store as analytics.Sessions, sorted by start."""
+        return _to_sessions(self.records())
+
+    def day(self, epoch):
+        """The sessions that started on the same day as "epoch", two reads of the index and one of the records."""
+        days = np.load(os.path.join(self.path, 'days.npy'), mmap_mode='r')
+        i = int(epoch) // DAY - self.catalog['first_day']
+        if i < 0 or i >= len(days) - 1:
+            return _to_sessions(np.zeros(0, dtype=STORE_RECORD))
+        first, end = int(days[i]), int(days[i + 1])
+        records = np.fromfile(os.path.join(self.path, 'sessions.bin'), dtype=STORE_RECORD,
+                              count=end - first, offset=first * STORE_RECORD.itemsize)
+        return _to_sessions(records)
+
+    def device_id(self, name):
+        devices = self.catalog['devices']
+        if name not in devices:
+            devices.append(name)
+        return devices.index(name)
+
+    def plan(self, paths):
+        """Pair every log with its stream. Returns the jobs, (path, device id, stream or None) for every log with
+        something new, and a dict path -> (device id, stream) of the logs read before with nothing new."""
+        by_head = {}                                # (head_len, head) -> streams, one head read per length
+        for stream in self.catalog['streams']:
+            by_head.setdefault((stream['head_len'], stream['head']), []).append(stream)
+        lengths = sorted(set(key[0] for key in by_head))
+        jobs = []
+        unchanged = {}
+        for path in paths:
+            device = self.device_id(os.path.basename(os.path.dirname(os.path.abspath(path))))
+            size = os.path.getsize(path)
+            best = None
+            for length in lengths:
+                if length > size:
+                    break
+                for stream in by_head.get((length, _head(path, length)), ()):
+                    if size < stream['size']:
+                        continue
+                    if size == stream['size'] and _crc(path) == stream['crc']:
+                        best = False                # read before, here or under another name, nothing new
+                        unchanged[path] = (device, stream)
+                        break
+                    if stream['device'] == device and (best is None or stream['size'] > best['size']):
+                        best = stream
+                if best is False:
+                    break
+            if best is not False:
+                jobs.append((path, device, best))
+        return jobs, unchanged
+
+    def save(self, records):
+        """Write the records (sorted by start) with their day index, the catalog last."""
+        folder = self.path
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        first_day = int(records['start'][0]) // DAY if len(records) else 0
+        last_day = int(records['start'][-1]) // DAY if len(records) else -1
+        days = np.searchsorted(records['start'] // DAY, np.arange(first_day, last_day + 2)).astype(np.int64)
+        records.tofile(os.path.join(folder, 'sessions.tmp'))
+        os.replace(os.path.join(folder, 'sessions.tmp'), os.path.join(folder, 'sessions.bin'))
+        with open(os.path.join(folder, 'days.tmp'), 'wb') as f:
+            np.save(f, days)
+        os.replace(os.path.join(folder, 'days.tmp'), os.path.join(folder, 'days.npy'))
+        self.catalog['first_day'] = first_day
+        with open(os.path.join(folder, 'catalog.tmp'), 'w') as f:
+            json.dump(self.catalog, f, indent=1)
+        os.replace(os.path.join(folder, 'catalog.tmp'), os.path.join(folder, 'catalog.json'))
+
+
+def _crc(path):
+    with open(path, 'rb') as f:
+        return zlib.crc32(f.read())
+
+
+def _records(columns, device):
+    start, stop, task, note = columns
+    records = np.zeros(len(start), dtype=STORE_RECORD)
+    records['start'], records['stop'], records['task'], records['note'] = start, stop, task, note
+    records['device'] = device
+    return records
+
+
+def _to_sessions(records):
+    return Sessions(records['start'], records['stop'], records['task'], records['note'] != 0, records['device'])
+
+
+def _segment_order(path):
+    """Sort key of a stamp file among its device's files: the rotated segments by number, the active one last."""
+    number = _SEGMENT.search(os.path.basename(path))
+    return (os.path.dirname(path), 0, int(number.group(1))) if number else (os.path.dirname(path), 1, 0)
+
+
+def stitch(files, leads):
+    """Sessions cut in two by a rotation. "files" maps every log path to (device id, stream), "leads" the
+    logs read from the start in this run to the text before their first whole session. The end of the
+    segment before each of those, from its stream's offset (its last whole session) on, is parsed with that
+    text. Returns the sessions found as store records."""
+    by_device = {}
+    for path, (device, _) in files.items():
+        if path.endswith('.csv'):
+            by_device.setdefault(device, []).append(path)
+    parts = []
+    for device, paths in sorted(by_device.items()):
+        paths.sort(key=_segment_order)
+        for before, path in zip(paths, paths[1:]):
+            if not leads.get(path) or os.path.dirname(before) != os.path.dirname(path):
+                continue
+            with open(before, 'rb') as f:
+                f.seek(files[before][1]['offset'])
+                carry = f.read().decode('latin-1')
+            sessions = _columns_from_matches(_SESSION.findall(carry + leads[path]), 1, device)
+            parts.append(_records((sessions.start, sessions.stop, sessions.task, sessions.note), device))
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=STORE_RECORD)
+
+
+def find_logs(paths):
+    """The logs in "paths", folders are searched for stamp*.csv and sessions.bin."""
+    logs = []
+    for path in paths:
+        if not os.path.isdir(path):
+            logs.append(path)
+            continue
+        for folder, _, names in sorted(os.walk(path)):
+            for name in sorted(names):
+                if (name.startswith('stamp') and name.endswith('.csv')) or name == 'sessions.bin':
+                    logs.append(os.path.join(folder, name))
+    return logs
+
+
+def ingest(store_path, paths, workers=None):
+    """Parse the logs in "paths" in parallel and merge what is new into the store. Returns (files parsed,
+    sessions added or replaced, files skipped as duplicates)."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    store = Store(store_path)
+    logs = find_logs(paths)
+    jobs, files = store.plan(logs)
+    skipped = len(logs) - len(jobs)
+    if not jobs:
+        return 0, 0, skipped
+    parsed = 0
+    by_path = dict((job[0], job) for job in jobs)
+    leads = {}
+    parts = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # largest first so one big log doesn't start last
+        order = sorted(jobs, key=lambda job: os.path.getsize(job[0]) - (job[2] or {'offset': 0})['offset'], reverse=True)
+        for path, columns, size, crc, offset, lead in pool.map(parse_log, [
+                (job[0], 0, 0, 0) if job[2] is None else (job[0], job[2]['offset'], job[2]['size'], job[2]['crc'])
+                for job in order]):
+            _, device, stream = by_path[path]
+            head = _head(path, min(HEAD, size))
+            if stream is None:
+                if any(other['size'] == size and other['crc'] == crc and other['head'] == head
+                       for other in store.catalog['streams']):
+                    skipped += 1                    # a copy of a file read in this same run
+                    continue
+                stream = {'device': device}
+                store.catalog['streams'].append(stream)
+            parsed += 1
+            stream.update({'path': path, 'size': size, 'crc': crc, 'offset': offset,
+                           'head_len': min(HEAD, size), 'head': head})
+            files[path] = (device, stream)
+            if lead:
+                leads[path] = lead
+            parts.append(_records(columns, device))
+    parts.append(stitch(files, leads))              # last, so a session completed across segments wins
+    new = np.concatenate(parts)
+    store.save(merge(store.records(), new))
+    return parsed, len(new), skipped
+
+
+def merge(old, new):
+    """Records of "old" and "new" keyed by (device, start), a key in "new" replaces the old record. Sorted by start."""
+    records = np.concatenate([old, new])
+    keys = records['device'].astype(np.int64) << 32 | records['start'].astype(np.int64)
+    _, last = np.unique(keys[::-1], return_index=True)      # the newest record of every key
+    records = records[len(records) - 1 - last]
+    return records[np.lexsort((records['device'], records['start']))]
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Merge device logs into one session store.')
+    parser.add_argument('store')
+    parser.add_argument('logs', nargs='+')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: one per core)')
+    args = parser.parse_args()
+    began = time.time()
+    parsed, added, skipped = ingest(args.store, args.logs, args.workers)
+    print('%d files parsed, %d skipped, %d sessions merged in %.2f s, %d in the store' % (
+        parsed, skipped, added, time.time() - began, len(Store(args.store).records())))
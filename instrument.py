@@ -0,0 +1,184 @@
+# Transition and loop instrumentation
+# Instruments.attach() wraps a StateMachine's transition, enter/exit callbacks, poll() and the SD log flushes
+# with timers that feed fixed size histograms; detach() puts the originals back. A machine that was never
+# attached runs exactly the code it always did, so the cost when disabled is nothing at all.
+#
+# Recorded: go_to_state latency (whole transition), each enter and exit callback, dwell time per state,
+# main loop iterations per second and the time every batch of log writes spends on the SD card.
+# dump() writes a text report to the serial monitor or appends it to a file on the card. While attached,
+# typing a letter on the serial monitor asks for it in the field (through StateMachine.commands):
+#   d   print the report            s   append it to "stats.txt" on the card            r   start over
+
+import array
+
+
+################################################################################
+# Log2 histogram in a fixed array, bucket n counts values below 2**n units
+
+class Histogram(object):
+
+    BUCKETS = 32
+
+    def __init__(self, unit='us'):
+        self.unit = unit
+        self.counts = array.array('L', [0] * self.BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.largest = 0
+
+    def record(self, value):
+        value = int(value)
+        bucket = value.bit_length() if value > 0 else 0
+        if bucket >= self.BUCKETS:
+            bucket = self.BUCKETS - 1
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += value
+        if value > self.largest:
+            self.largest = value
+
+    def percentile(self, share):
+        """Upper bound of the bucket holding the given share (0..1) of the values."""
+        wanted = share * self.count
+        seen = 0
+        for bucket, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= wanted:
+                return min(1 << bucket, self.largest)
+        return 0
+
+    def reset(self):
+        for bucket in range(self.BUCKETS):
+            self.counts[bucket] = 0
+        self.count = 0
+        self.total = 0
+        self.largest = 0
+
+    def summary(self):
+        if not self.count:
+            return 'n=0'
+        return 'n=%d mean=%d p50<=%d p99<=%d max=%d %s' % (
+            self.count, self.total // self.count, self.percentile(0.5), self.percentile(0.99), self.largest, self.unit)
+
+
+################################################################################
+# The instrument set for one machine
+
+class Instruments(object):
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.hal = machine.hal
+        count = len(machine.names)
+        self.transition = Histogram()
+        self.enter = [Histogram() for _ in range(count)]
+        self.exit = [Histogram() for _ in range(count)]
+        self.dwell = [Histogram('ms') for _ in range(count)]
+        self.sd_write = Histogram()
+        self.loops = 0
+        self._since = self.hal.monotonic_ns()
+        self._entered = self._since
+        self._saved = None
+
+    def attach(self):
+        """Start timing the machine, safe to call once."""
+        machine = self.machine
+        clock = self.hal.monotonic_ns
+        self._saved = (list(machine.enters), list(machine.exits), machine.go_to_index, machine.poll,
+                       [(log, log.flush) for log in self._logs()])
+
+        for i in range(len(machine.names)):
+            machine.enters[i] = self._timed(machine.enters[i], self.enter[i], clock)
+            machine.exits[i] = self._timed(machine.exits[i], self.exit[i], clock)
+
+        go_to_index = machine.go_to_index
+
+        def timed_go_to_index(target):
+            began = clock()
+            if machine.state is not None:
+                self.dwell[machine.index].record((began - self._entered) // 1000000)
+            go_to_index(target)
+            self._entered = clock()
+            self.transition.record((self._entered - began) // 1000)
+        machine.go_to_index = timed_go_to_index
+
+        poll = machine.poll
+
+        def counted_poll():
+            self.loops += 1
+            poll()
+        machine.poll = counted_poll
+        for letter in 'dsr':
+            machine.commands[letter] = self._command(letter)
+
+        for log, flush in self._saved[4]:
+            log.flush = self._timed(flush, self.sd_write, clock)
+
+    def detach(self):
+        if self._saved is None:
+            return
+        machine = self.machine
+        enters, exits, _, _, flushes = self._saved
+        machine.enters[:] = enters
+        machine.exits[:] = exits
+        del machine.go_to_index             # back to the class method
+        del machine.poll
+        for log, _ in flushes:
+            del log.flush
+        for letter in 'dsr':
+            machine.commands.pop(letter, None)
+        self._saved = None
+
+    def _logs(self):
+        logs = [self.machine.stamp_log]
+        if self.machine.session_log is not None:
+            logs.append(self.machine.session_log.records)
+        return logs
+
+    @staticmethod
+    def _timed(function, histogram, clock):
+        def timed(*args):
+            began = clock()
+            result = function(*args)
+            histogram.record((clock() - began) // 1000)
+            return result
+        return timed
+
+    def reset(self):
+        for histogram in [self.transition, self.sd_write] + self.enter + self.exit + self.dwell:
+            histogram.reset()
+        self.loops = 0
+        self._since = self.hal.monotonic_ns()
+
+    def command(self, letter):                      # One of the serial monitor commands listed at the top
+        if letter == 'd':
+            self.dump()
+        elif letter == 's':
+            self.dump("stats.txt")
+        elif letter == 'r':
+            self.reset()
+
+    def _command(self, letter):
+        return lambda: self.command(letter)
+
+    def report(self):
+        """The numbers as a list of text lines."""
+        elapsed = (self.hal.monotonic_ns() - self._since) / 1e9
+        lines = ['loops %d in %.1f s, %.1f/s' % (self.loops, elapsed, self.loops / elapsed if elapsed > 0 else 0.0),
+                 'transition  ' + self.transition.summary(),
+                 'sd write    ' + self.sd_write.summary()]
+        for i, name in enumerate(self.machine.names):
+            lines.append('%s: enter %s | exit %s | dwell %s' % (
+                name, self.enter[i].summary(), self.exit[i].summary(), self.dwell[i].summary()))
+        return lines
+
+    def dump(self, name=None):
+        """Print the report to the serial monitor, or append it to "name" on the SD card."""
+        if name is None:
+            for line in self.report():
+                print(line)
+            return
+        with self.hal.open(name, "a") as f:
+            for line in self.report():
+                f.write(line + "\r\n")
+            f.write("\r\n")
@@ -0,0 +1,92 @@
+# Button-to-transition latency, polled loop vs event driven loop vs tickless event loop
+# Runs on a Linux box with the simulation backend: the same taps are scripted into both loops and
+# the virtual time from the press edge to the transition is recorded, together with how often each
+# loop wakes up and how often it has to look at the switches (stand-ins for idle CPU).
+# In event driven mode a wakeup is only a look at the keypad queue, the core idles in between. The tickless
+# loop sleeps until the next deadline (screen settle, log flush) or a press, it wakes with the activity.
+# Debounce time is left out of both, the scanner and keypad both add roughly the same interval.
+#
+#   python3 latency.py [taps]
+
+import random
+import sys
+
+from hal_sim import SimHAL
+from state_machine import build_machine
+
+EVENT_TICK = 0.005      # same as code.py
+HOLD = 0.2              # how long each scripted press is held, seconds
+
+
+def _script(hw, taps, seed=1):
+    """Schedule "taps" presses on switch 1, spaced 0.5 to 2 s apart at random sub-tick offsets."""
+    rng = random.Random(seed)
+    presses = []
+    at = 1.0
+    for _ in range(taps):
+        at += rng.uniform(0.5, 2.0)
+        hw.switch_1.tap(at, HOLD)
+        presses.append(at)
+    return presses
+
+
+def _measure(mode, taps):
+    hw = SimHAL()
+    hw.scanner.samples = 1                  # debounce left out, see above
+    machine = build_machine(hw)
+    presses = _script(hw, taps)
+    transitions = []
+    go_to_index = machine.go_to_index
+    checks = [0]
+
+    def timed_go_to_index(target):
+        transitions.append(hw.monotonic())
+        go_to_index(target)
+
+    if mode != 'polled':
+        machine.dispatch = _counted(machine.dispatch, checks)
+    else:
+        machine.pressed = _counted(machine.pressed, checks)
+
+    wakeups = 0
+    machine.start()
+    machine.go_to_index = timed_go_to_index
+    end = presses[-1] + 1.0
+    while hw.monotonic() < end:
+        wakeups += 1
+        if mode == 'tickless':
+            machine.run_tickless()
+            machine.poll()
+        elif mode == 'events':
+            machine.run_events(EVENT_TICK)
+        else:
+            hw.scan()
+            machine.pressed()
+
+    delays = sorted(t - p for p, t in zip(presses, transitions))
+    return {
+        'mean_ms': 1000.0 * sum(delays) / len(delays),
+        'p99_ms': 1000.0 * delays[int(0.99 * (len(delays) - 1))],
+        'max_ms': 1000.0 * delays[-1],
+        'wakeups_per_s': wakeups / end,
+        'checks_per_s': checks[0] / end,
+    }
+
+
+def _counted(method, counter):
+    def wrapper(*args):
+        counter[0] += 1
+        method(*args)
+    return wrapper
+
+
+def main(taps=1000):
+    print('%-8s %10s %10s %10s %12s %14s' % ('loop', 'mean ms', 'p99 ms', 'max ms', 'wakeups/s', 'checks/s'))
+    for name in ('polled', 'events', 'tickless'):
+        r = _measure(name, taps)
+        print('%-8s %10.2f %10.2f %10.2f %12.1f %14.2f' % (name, r['mean_ms'], r['p99_ms'], r['max_ms'],
+                                                        r['wakeups_per_s'], r['checks_per_s']))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
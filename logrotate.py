@@ -0,0 +1,252 @@
+# Log rotation and tail reads for stamp.csv
+# RotatingLog is a BufferedLog whose file never grows past a limit. The active file keeps its name
+# ("stamp.csv") so nothing else changes. When a batch would push it past "max_bytes", or with "day" set
+# when the first batch of a new day arrives, the active file is closed off as a numbered segment
+# ("stamp.0001.csv", "stamp.0002.csv", ...) and a new active file starts with the header.
+#
+# Closed segments are listed oldest first in a manifest ("stamp.man"), one text line per segment:
+#
+#   segment name, bytes, first day (epoch // 86400, -1 when not known)
+#
+# A rotation appends the manifest line first and renames the active file second, so recover() can finish
+# a rotation that a power cut stopped half way. compact() merges old segments into one file and drops the
+# header rows earlier revisions wrote on every boot.
+#
+# tail() reads backwards from the end of the newest segment, a block at a time, until it has the last N
+# sessions, whatever the size of the log. Batches are written whole, not per session, so a session can
+# start in one segment and end in the next; the reader treats the segments as one stream.
+
+from sdlog import SECTOR, BufferedLog
+
+DAY = 86400
+NOTE = b'Speech to text voice note'
+
+
+class RotatingLog(BufferedLog):
+
+    def __init__(self, hal, name="stamp.csv", journal="stamp.jnl", sectors=2, flush_interval=10.0,
+                 max_bytes=256 * 1024, day=None, header=None):
+        BufferedLog.__init__(self, hal, name, journal, sectors, flush_interval)
+        stem = name[:name.rfind('.')]
+        self.manifest = stem + ".man"
+        self._segment = stem + ".%04d" + name[name.rfind('.'):]    # name pattern of the closed segments
+        self.max_bytes = max_bytes                  # None turns size based rotation off
+        self.day = day                              # callable returning today's day number, None for no daily rotation
+        self.header = header.encode() if isinstance(header, str) else header    # first bytes of every new active file
+        self._day = None                            # day of the first batch in the active file, None when unknown
+        self.rotations = 0
+
+    def recover(self):
+        """Finish a rotation or compaction cut short by a power cut, replay the log journal and start a new
+        file with the header. Call once at boot before writing, returns the bytes replayed from the journal."""
+        temporary = self.manifest + ".tmp"
+        if self.hal.size(temporary) is not None:            # compact() stopped between manifests
+            if self.hal.size(self.manifest) is None:
+                self.hal.rename(temporary, self.manifest)
+            else:
+                self.hal.remove(temporary)
+        segments = self.segments()
+        if segments:
+            last = segments[-1][0]
+            if self.hal.size(last) is None:
+                if self.hal.size(self.name) is not None:
+                    self.hal.rename(self.name, last)        # listed but not renamed yet
+                else:
+                    self._write_manifest(segments[:-1])     # nothing to rename, forget the line
+        replayed = BufferedLog.recover(self)
+        if self.header and not self.hal.size(self.name):
+            with self.hal.open(self.name, "wb") as f:
+                f.write(self.header)
+        self._day = self._first_day()
+        return replayed
+
+    def flush(self):
+        if not self._used:
+            return
+        if self._size is None:
+            self._size = self.hal.size(self.name) or 0
+        empty = len(self.header) if self.header else 0
+        if self._size > empty:
+            if self.max_bytes is not None and self._size + self._used > self.max_bytes:
+                self.rotate()
+            elif self.day is not None and self._day is not None and self.day() != self._day:
+                self.rotate()
+        if self.day is not None and self._day is None:
+            self._day = self.day()
+        BufferedLog.flush(self)
+
+    def rotate(self):
+        """Close the active file off as the next numbered segment and start a new one."""
+        segments = self.segments()
+        number = _numbers(segments[-1][0])[1] + 1 if segments else 1
+        segment = self._segment % number
+        size = self.hal.size(self.name) or 0
+        with self.hal.open(self.manifest, "ab") as f:
+            f.write(("%s,%d,%d\n" % (segment, size, -1 if self._day is None else self._day)).encode())
+        self.hal.rename(self.name, segment)
+        if self.header:
+            with self.hal.open(self.name, "wb") as f:
+                f.write(self.header)
+        self._size = len(self.header) if self.header else 0
+        self._day = None
+        self.rotations += 1
+
+    def segments(self):
+        """The closed segments, oldest first, as (name, bytes, first day) tuples."""
+        try:
+            f = self.hal.open(self.manifest, "rb")
+        except OSError:
+            return []
+        with f:
+            lines = f.read().decode().split('\n')
+        segments = []
+        for line in lines:
+            fields = line.split(',')
+            if len(fields) == 3:
+                segments.append((fields[0], int(fields[1]), int(fields[2])))
+        return segments
+
+    def names(self):
+        """Every file of the log, oldest first, the active file last."""
+        return [segment[0] for segment in self.segments()] + [self.name]
+
+    def tail(self, count):
+        """The last "count" sessions, oldest first, including entries still buffered in RAM."""
+        return tail_sessions(self.hal, self.names(), count, bytes(self._view[:self._used]), self.header)
+
+    def compact(self, keep=4):
+        """Merge every closed segment but the newest "keep" into one file. Returns the number of segments merged."""
+        segments = self.segments()
+        old = segments[:len(segments) - keep] if keep else segments
+        if len(old) < 2:
+            return 0
+        stem = self.name[:self.name.rfind('.')]
+        merged = "%s.%04d-%04d%s" % (stem, _numbers(old[0][0])[0], _numbers(old[-1][0])[1], self.name[self.name.rfind('.'):])
+        size = _merge(self.hal, [segment[0] for segment in old], merged, self.header)
+        # New manifest under a temporary name first, a cut before the rename leaves the old one in place
+        temporary = self.manifest + ".tmp"
+        self._write_manifest([(merged, size, old[0][2])] + segments[len(old):], temporary)
+        self.hal.remove(self.manifest)
+        self.hal.rename(temporary, self.manifest)
+        for name, _, _ in old:
+            if name != merged:
+                self.hal.remove(name)
+        return len(old)
+
+    def _write_manifest(self, segments, name=None):
+        with self.hal.open(self.manifest if name is None else name, "wb") as f:
+            for segment in segments:
+                f.write(("%s,%d,%d\n" % segment).encode())
+
+    def _first_day(self):
+        """Day of the first session in the active file, None when it has none."""
+        if self.day is None or not self.hal.size(self.name):
+            return None
+        with self.hal.open(self.name, "rb") as f:
+            sessions = parse_sessions(f.read(SECTOR))
+        if not sessions:
+            return None
+        month, day, year = [int(part) for part in sessions[0][0].split('/')]
+        return _days_from_civil(year, month, day)
+
+
+def _numbers(segment):                              # "stamp.0007.csv" is (7, 7), "stamp.0001-0007.csv" is (1, 7)
+    stem = segment[:segment.rfind('.')]
+    parts = stem[stem.rfind('.') + 1:].split('-')
+    return int(parts[0]), int(parts[-1])
+
+
+def _days_from_civil(year, month, day):            # Days since 1970-01-01, same naive calendar as the RTC
+    year -= month <= 2
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    return era * 146097 + yoe * 365 + yoe // 4 - yoe // 100 + doy - 719468
+
+
+def _merge(hal, names, merged, header):
+    """Concatenate the files "names" into "merged" with only one header row, returns its size."""
+    size = 0
+    with hal.open(merged, "wb") as out:
+        if header:
+            out.write(header)
+            size += len(header)
+        for name in names:
+            with hal.open(name, "rb") as f:
+                while True:
+                    line = f.readline()
+                    if not line:
+                        break
+                    if header and header in line:
+                        line = line.replace(header, b'')     # rev 5 wrote the header on every boot
+                    out.write(line)
+                    size += len(line)
+    return size
+
+
+################################################################################
+# Tail reads
+
+def tail_sessions(hal, names, count, pending=b'', header=None, block=SECTOR):
+    """The last "count" sessions of the text log split over the files "names" (oldest first), plus the
+    bytes still "pending" in RAM. Sessions are (date, time in, time out, note) tuples of strings, time
+    out is None for a session still running, note is True when a voice note was taken. The "header"
+    row at the start of each file is dropped, a batch can split a session's fields at a segment edge."""
+    if count <= 0:
+        return []
+    wanted = 2 * count + 2      # two slashes per date, one session more than asked so the oldest is whole
+    data = pending
+    slashes = pending.count(b'/')
+    whole = True                # reached the start of the oldest file
+    for name in reversed(names):
+        if slashes >= wanted:
+            whole = False
+            break
+        size = hal.size(name)
+        if not size:
+            continue
+        piece = b''
+        with hal.open(name, "rb") as f:
+            end = size
+            while end > 0 and slashes < wanted:
+                start = max(0, end - block)
+                f.seek(start)
+                chunk = f.read(end - start)
+                slashes += chunk.count(b'/')
+                piece = chunk + piece
+                end = start
+        if end > 0:
+            data = piece + data
+            whole = False
+            break
+        if header and piece.startswith(header):
+            piece = piece[len(header):]
+        data = piece + data
+    sessions = parse_sessions(data)
+    if not whole and sessions:
+        sessions = sessions[1:]     # its date may have been cut by the first block
+    return sessions[-count:]
+
+
+def parse_sessions(data):
+    """Split stamp.csv text into (date, time in, time out, note) tuples, fragments before the first date are skipped."""
+    sessions = []
+    current = None
+    for token in data.replace(b'\r', b',').replace(b'\n', b',').split(b','):
+        token = token.strip()
+        if b'/' in token:
+            if current is not None:
+                sessions.append(tuple(current))
+            current = [token.decode(), None, None, False]
+        elif current is None:
+            continue
+        elif b':' in token:
+            if current[1] is None:
+                current[1] = token.decode()
+            elif current[2] is None:
+                current[2] = token.decode()
+        elif token == NOTE:
+            current[3] = True
+    if current is not None:
+        sessions.append(tuple(current))
+    return sessions
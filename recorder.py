@@ -0,0 +1,426 @@
+# Record and replay a whole device run
+# Field bugs that depend on timing (README issue 3, the screen lost at the 180 second refresh) take minutes of
+# real time and the physical buttons to reproduce. RecordingHAL sits between the machine and its HAL
+# (RECORD_TRACE in code.py) and writes everything that goes in or comes out to a compact trace file:
+#
+#   header      "RPL1", the code.py settings as JSON, the first bytes of NVM (the checkpoint ring)
+#   records     time in ms since the recording started (u32), kind (u8), a (u8), value (u32) = 10 bytes
+#       KEY     a keypad event: key number, pressed
+#       SCAN    the raw switch bitmask of the polled scanner, when it changed
+#       RTC     an RTC read that gave another second than the read before: the epoch
+#       SERIAL  a letter typed on the serial monitor
+#       PIN     an output pin write: pin number in PINS, level
+#       OPEN    a file opened for writing: file number, 1 when truncated, then a length byte and the name
+#       LOG     bytes written to that file: file number, length, then the bytes
+#
+# replay() builds the machine again on the simulator through the boot code.py runs (startup.boot), feeds it
+# the recorded edges, RTC readings and letters at their recorded times and records what comes out the same
+# way. By default it runs the tickless loop on the virtual clock, which jumps from one deadline or edge to the
+# next, so hours of device time replay in milliseconds; exact=True runs the loop code.py ran (event or polled)
+# tick by tick.
+# diff() then compares the pin writes (order, levels, times within a tolerance) and the bytes written to each
+# file against the recording.
+#
+#   python3 recorder.py replay.rec [--exact] [--tolerance 0.05]     replay a trace, exit status 1 on a difference
+#   python3 recorder.py --demo out.rec [HOURS]                      record a simulated run to try it on
+
+import json
+import struct
+import time
+
+from hal import SCAN_INTERVAL, SCAN_SAMPLES, SCREENS, from_epoch, to_epoch
+
+MAGIC = b'RPL1'
+RECORD = '<IBBI'
+RECORD_SIZE = struct.calcsize(RECORD)
+NVM_BYTES = 512                             # the start of NVM kept in the header, the checkpoint ring lives there
+
+KEY = 1
+SCAN = 2
+RTC = 3
+SERIAL = 4
+PIN = 5
+OPEN = 6
+LOG = 7
+
+PINS = ('led',) + tuple([name for name, _ in SCREENS])     # output pins recorded, PIN records number them in this order
+
+_PASSED = ('monotonic', 'monotonic_ns', 'sleep', 'wait', 'sleep_until', 'get_event_due', 'next_edge',
+           'size', 'remove', 'rename', 'scan', 'display_port')      # bound once, not looked up on every call
+
+
+################################################################################
+# Recording
+
+class RecordingHAL(object):
+    """Stands in for "hal" and writes every input and output to "sink" (anything with write(bytes), a
+    BufferedLog on the board: give it the real HAL so the trace doesn't record itself)."""
+
+    def __init__(self, hal, sink, config=None):
+        self._hal = hal
+        self._sink = sink
+        self._t0 = hal.monotonic()
+        self._rtc = None
+        self._files = {}                        # file name -> file number
+        self._bits = 0
+        for name in _PASSED:
+            if hasattr(hal, name):
+                setattr(self, name, getattr(hal, name))
+        for number, name in enumerate(PINS):
+            setattr(self, name, _RecordedPin(self, number, getattr(hal, name)))
+        scanner = getattr(hal, 'scanner', None)
+        if scanner is not None:                 # polled mode reads the raw pins through the scanner
+            read = scanner.read
+
+            def recorded_read():
+                bits = read()
+                if bits != self._bits:
+                    self._bits = bits
+                    self.record(SCAN, 0, bits)
+                return bits
+            scanner.read = recorded_read
+        settings = json.dumps(config or {}).encode()
+        nvm = getattr(hal, 'nvm', None)
+        nvm = bytes(nvm[:NVM_BYTES]) if nvm is not None else b''
+        sink.write(MAGIC + struct.pack('<H', len(settings)) + settings + struct.pack('<H', len(nvm)) + nvm)
+
+    def __getattr__(self, name):                # everything not recorded goes straight to the HAL
+        return getattr(self._hal, name)
+
+    def record(self, kind, a, value, payload=None):
+        at = int((self._hal.monotonic() - self._t0) * 1000) & 0xffffffff
+        self._sink.write(struct.pack(RECORD, at, kind, a, value))
+        if payload:
+            self._sink.write(payload)
+
+    def attach(self, machine):
+        """Flush the trace from the machine's poll(), needed when the sink is a BufferedLog."""
+        poll = machine.poll
+        sink = self._sink
+
+        def recorded_poll():
+            poll()
+            sink.poll()
+        if hasattr(sink, 'poll'):
+            machine.poll = recorded_poll
+
+    def get_event(self):
+        event = self._hal.get_event()
+        if event is not None:
+            self.record(KEY, event.key_number, 1 if event.pressed else 0)
+        return event
+
+    def serial_command(self):
+        letter = self._hal.serial_command()
+        if letter is not None:
+            self.record(SERIAL, 0, ord(letter))
+        return letter
+
+    @property
+    def rtc(self):
+        if self._rtc is None:
+            self._rtc = _RecordedRTC(self, self._hal.rtc)
+        return self._rtc
+
+    def open(self, name, mode="r"):
+        f = self._hal.open(name, mode)
+        if 'w' not in mode and 'a' not in mode:
+            return f
+        number = self._files.get(name)
+        if number is None:
+            number = self._files[name] = len(self._files) & 0xff
+        encoded = name.encode()
+        self.record(OPEN, number, 1 if 'w' in mode else 0, bytes([len(encoded)]) + encoded)
+        return _RecordedFile(self, number, f)
+
+
+class _RecordedPin(object):
+
+    def __init__(self, owner, number, pin):
+        self._owner = owner
+        self._number = number
+        self._pin = pin
+
+    @property
+    def value(self):
+        return self._pin.value
+
+    @value.setter
+    def value(self, level):
+        self._pin.value = level
+        self._owner.record(PIN, self._number, 1 if level else 0)
+
+
+class _RecordedRTC(object):
+
+    def __init__(self, owner, rtc):
+        self._owner = owner
+        self._rtc = rtc
+        self._last = None
+
+    @property
+    def datetime(self):
+        t = self._rtc.datetime
+        epoch = to_epoch(t) & 0xffffffff            # the same conversion TimeSource makes
+        if epoch != self._last:                     # a replay only needs the ticks, not the boot alignment's polling
+            self._last = epoch
+            self._owner.record(RTC, 0, epoch)
+        return t
+
+    @datetime.setter
+    def datetime(self, t):
+        self._rtc.datetime = t
+
+
+class _RecordedFile(object):
+
+    def __init__(self, owner, number, f):
+        self._owner = owner
+        self._number = number
+        self._f = f
+
+    def write(self, data):
+        encoded = data.encode() if isinstance(data, str) else bytes(data)
+        self._owner.record(LOG, self._number, len(encoded), encoded)
+        return self._f.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+################################################################################
+# Reading a trace
+
+class Trace(object):
+
+    def __init__(self, data):
+        if data[:4] != MAGIC:
+            raise ValueError("not a replay trace")
+        at = 4
+        length = struct.unpack_from('<H', data, at)[0]
+        self.config = json.loads(data[at + 2:at + 2 + length].decode())
+        at += 2 + length
+        length = struct.unpack_from('<H', data, at)[0]
+        self.nvm = data[at + 2:at + 2 + length]
+        at += 2 + length
+        self.records = []                       # (seconds, kind, a, value, payload)
+        while at + RECORD_SIZE <= len(data):
+            ms, kind, a, value = struct.unpack_from(RECORD, data, at)
+            at += RECORD_SIZE
+            payload = None
+            if kind == OPEN:
+                payload = data[at + 1:at + 1 + data[at]]
+                at += 1 + data[at]
+            elif kind == LOG:
+                payload = data[at:at + value]
+                at += value
+            self.records.append((ms / 1000.0, kind, a, value, payload))
+
+    @property
+    def duration(self):
+        return self.records[-1][0] if self.records else 0.0
+
+    def kind(self, kind):
+        return [record for record in self.records if record[1] == kind]
+
+    def pins(self):
+        """Output pin writes as (seconds, pin name, level)."""
+        return [(at, PINS[a], value) for at, _, a, value, _ in self.kind(PIN)]
+
+    def files(self):
+        """Everything written to each file, name -> bytes, in the order it was written."""
+        names = {}
+        written = {}
+        for _, kind, a, _, payload in self.records:
+            if kind == OPEN:
+                names[a] = payload.decode()
+                written.setdefault(names[a], [])
+            elif kind == LOG:
+                written[names[a]].append(payload)
+        return dict((name, b''.join(parts)) for name, parts in written.items())
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        return Trace(f.read())
+
+
+################################################################################
+# Replay
+
+class _ReplayRTC(object):
+    """The RTC as recorded: every reading that differs from the one before marks a second tick, in between
+    the time counts on from the latest tick."""
+
+    def __init__(self, clock, readings):
+        self._clock = clock
+        self._ticks = []
+        last = None
+        for at, epoch in readings:
+            if epoch != last:
+                self._ticks.append((at, epoch))
+                last = epoch
+
+    @property
+    def datetime(self):
+        now = self._clock.now
+        at, epoch = self._ticks[0]
+        for tick in self._ticks:                # readings are few, a scan is fine
+            if tick[0] > now:
+                break
+            at, epoch = tick
+        return from_epoch(epoch + int(now - at) if now >= at else epoch)
+
+    @datetime.setter
+    def datetime(self, t):
+        pass                                    # the recording already holds what the RTC read afterwards
+
+
+def replay(trace, exact=False, until=None):
+    """Run the recorded inputs through a new machine on the simulator. Returns (the new recording as a
+    Trace, virtual seconds replayed, wall clock seconds it took)."""
+    import io
+    from hal_sim import SimHAL
+    from startup import boot
+    from tracing import NONE, SERIAL
+
+    config = dict(trace.config)
+    if config.get('trace_sink') == SERIAL:
+        config['trace_sink'] = NONE             # nothing printed on the board is compared
+    nvm = bytearray(b'\xff' * 1024)
+    nvm[:len(trace.nvm)] = trace.nvm
+    hw = SimHAL(nvm=nvm)
+    hw.rtc = _ReplayRTC(hw.clock, [(at, value) for at, _, _, value, _ in trace.kind(RTC)] or [(0.0, 0)])
+    # the tickless loop takes edges straight from the pins, a scanned recording saw them after its debounce scans
+    lag = 0.0 if exact else (SCAN_SAMPLES - 1) * SCAN_INTERVAL
+    for at, kind, a, value, _ in trace.records:
+        if kind == KEY:
+            hw.switches[a].set(not value, at)   # pulled up, pressed reads low
+        elif kind == SCAN:
+            for key, switch in enumerate(hw.switches):
+                switch.set(not value & (1 << key), at + lag)
+    letters = [(at, chr(value)) for at, kind, _, value, _ in trace.kind(SERIAL)]
+
+    def serial_command():
+        if letters and letters[0][0] <= hw.clock.now:
+            return letters.pop(0)[1]
+        return None
+    hw.serial_command = serial_command
+
+    out = io.BytesIO()
+    recording = RecordingHAL(hw, out, config)
+    began = time.time()
+    machine = boot(recording, config)
+    end = trace.duration if until is None else until
+    tick = config.get('tick', 0.005)
+    if not exact:
+        while hw.clock.now < end:
+            machine.run_tickless(min(config.get('longest', 60.0), max(end - hw.clock.now, tick)))
+            machine.poll()
+    elif config.get('events', True):
+        while hw.clock.now < end:
+            machine.run_events(tick)
+            machine.poll()
+    else:
+        while hw.clock.now < end:
+            recording.scan()
+            machine.pressed()
+            machine.poll()
+    return Trace(out.getvalue()), hw.clock.now, time.time() - began
+
+
+def diff(recorded, replayed, tolerance=0.05, until=None):
+    """Compare the pin writes and the file contents of two traces. Returns (True when they match, report lines);
+    "until" leaves out what the recording holds after that many seconds (a replay that stopped early)."""
+    lines = []
+    same = True
+    expected = [pin for pin in recorded.pins() if until is None or pin[0] <= until]
+    got = [pin for pin in replayed.pins() if until is None or pin[0] <= until]
+    skew = 0.0
+    for i in range(min(len(expected), len(got))):
+        (at, pin, level), (other_at, other_pin, other_level) = expected[i], got[i]
+        if pin != other_pin or level != other_level or abs(at - other_at) > tolerance:
+            lines.append('pin write %d differs: recorded %s=%d at %.3f s, replayed %s=%d at %.3f s' % (
+                i, pin, level, at, other_pin, other_level, other_at))
+            same = False
+            break
+        skew = max(skew, abs(at - other_at))
+    else:
+        if len(expected) != len(got):
+            lines.append('pin writes: %d recorded, %d replayed' % (len(expected), len(got)))
+            same = False
+    if same:
+        lines.append('pin writes: %d match, largest time difference %.1f ms' % (len(expected), skew * 1000))
+    files = replayed.files()
+    for name, data in sorted(recorded.files().items()):
+        other = files.get(name, b'')
+        if data == other:
+            lines.append('%s: %d bytes match' % (name, len(data)))
+            continue
+        at = 0
+        while at < min(len(data), len(other)) and data[at] == other[at]:
+            at += 1
+        lines.append('%s: differs at byte %d (%d recorded, %d replayed): %r / %r' % (
+            name, at, len(data), len(other), data[at:at + 24], other[at:at + 24]))
+        same = False
+    return same, lines
+
+
+################################################################################
+# A simulated recording to try the replay on
+
+def demo(path, hours=1.0, reassert=180.0):
+    """Record "hours" of random use on the simulator with the event loop, screen reassert on (issue 3)."""
+    import random
+    from hal_sim import SimHAL
+    from bench import PATHS
+    from startup import boot
+
+    config = {'events': True, 'tick': 0.005, 'pulse': 0.05, 'settle': 0.25, 'reassert': reassert, 'flush': 10.0}
+    hw = SimHAL(epoch=1700000000)
+    rng = random.Random(1)
+    at = 1.0
+    while at < hours * 3600:
+        for key in PATHS[rng.choice(sorted(PATHS))]:
+            at += rng.uniform(0.5, 60.0)
+            hw.switches[key].tap(at, rng.uniform(0.08, 0.3))
+        at += rng.uniform(60.0, 1800.0)
+    out = open(path, 'wb')
+    recording = RecordingHAL(hw, out, config)
+    machine = boot(recording, config)
+    while hw.clock.now < hours * 3600:
+        machine.run_events(config['tick'])
+        machine.poll()
+    out.close()
+
+
+if __name__ == '__main__':
+    import sys
+
+    args = sys.argv[1:]
+    if args and args[0] == '--demo':
+        demo(args[1], float(args[2]) if len(args) > 2 else 1.0)
+        sys.exit(0)
+    tolerance = 0.05
+    if '--tolerance' in args:
+        tolerance = float(args.pop(args.index('--tolerance') + 1))
+        args.remove('--tolerance')
+    exact = '--exact' in args
+    if exact:
+        args.remove('--exact')
+    if len(args) != 1:
+        print('python3 recorder.py replay.rec [--exact] [--tolerance 0.05] | --demo out.rec [HOURS]')
+        sys.exit(2)
+    recorded = load(args[0])
+    replayed, seconds, took = replay(recorded, exact)
+    same, lines = diff(recorded, replayed, tolerance, recorded.duration)
+    print('replayed %.1f s of device time in %.0f ms%s' % (seconds, took * 1000, ' (exact loop)' if exact else ''))
+    for line in lines:
+        print(line)
+    sys.exit(0 if same else 1)
@@ -0,0 +1,260 @@
+# asyncio runtime for the state machine
+# The plain loops in code.py run everything in turn, so a slow flush to the SD card or a screen strobe holds
+# up the switches. Runtime splits the work into cooperative tasks joined by small bounded queues:
+#
+#   input     scans the switches (or drains the keypad queue) every "tick" and queues the presses
+#   dispatch  takes presses (and timer events) off the queue and runs machine.dispatch()
+#   poll      runs machine.poll() every "tick": timers, the queued log text and screen requests, trace output
+#             and serial monitor commands
+#
+# The dispatch and poll tasks go through the machine's own methods (dispatch(), poll()), so whatever wraps
+# them (the tracer's records, instrument.py, heap.py, the recorder's flush) works the same as in the plain
+# loops. While Runtime runs, machine.stamp_log and machine.display are queue fronts (LogQueue, DisplayQueue)
+# so the states keep calling write() and show() as before, and timers fire into the press queue. enter/exit
+# callbacks and transition hooks may be coroutines ("async def"): the machine collects them in
+# machine.awaiting and the dispatch task awaits them in call order as soon as the transition is done, before
+# the next press. Their body so runs with the machine already in the new state. The plain loops in code.py
+# stay as the sync mode and need plain functions.
+#
+# Writing to the card still blocks while it runs (file I/O is synchronous on CircuitPython), but only for the
+# poll task's turn: keypad keeps queueing presses meanwhile and the transitions never wait for a flush.
+#
+# On the simulator (hal.virtual_time) the clock only moves when the input task ticks, the other tasks
+# wait in virtual time, so a scripted run takes no real time at all.
+
+try:
+    import asyncio
+except ImportError:         # CircuitPython before asyncio was bundled
+    import uasyncio as asyncio
+
+from tracing import PRESS
+
+INPUT_QUEUE = 8             # presses waiting for dispatch, the keypad queue holds more while this is full
+LOG_QUEUE = 16              # log writes waiting for the poll task, a full queue writes straight through
+DISPLAY_QUEUE = 4           # screen requests waiting, only the newest matters so the oldest is dropped
+
+
+################################################################################
+# Bounded queue, asyncio on CircuitPython has none
+
+class BoundedQueue(object):
+
+    def __init__(self, size):
+        self._items = [None] * size
+        self._head = 0
+        self._count = 0
+        self._changed = asyncio.Event()
+        self.dropped = 0
+
+    def __len__(self):
+        return self._count
+
+    def put_nowait(self, item, drop_oldest=False):
+        """Queue "item", returns False when the queue is full (or drops the oldest item with drop_oldest)."""
+        size = len(self._items)
+        if self._count == size:
+            if not drop_oldest:
+                return False
+            self._head = (self._head + 1) % size
+            self._count -= 1
+            self.dropped += 1
+        self._items[(self._head + self._count) % size] = item
+        self._count += 1
+        self._changed.set()
+        return True
+
+    def get_nowait(self):
+        """Oldest item, None when the queue is empty."""
+        if not self._count:
+            return None
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head = (self._head + 1) % len(self._items)
+        self._count -= 1
+        self._changed.set()
+        return item
+
+    async def put(self, item):
+        while not self.put_nowait(item):
+            await self._wait()
+
+    async def get(self):
+        while not self._count:
+            await self._wait()
+        return self.get_nowait()
+
+    async def _wait(self):
+        self._changed.clear()
+        await self._changed.wait()
+
+
+################################################################################
+# Queue fronts the states talk to while the runtime runs
+
+class LogQueue(object):
+    """Stands in for the machine's BufferedLog, write() only queues, everything else goes to the log after what
+    is queued. The stamps (write_date/write_clock) are formatted from the machine's reused clock array, so they
+    are written straight away once the queue ahead of them is drained."""
+
+    def __init__(self, log, size=LOG_QUEUE):
+        self.log = log
+        self.queue = BoundedQueue(size)
+
+    def write(self, text):
+        if not self.queue.put_nowait(text):
+            self.drain()                            # never lose an entry, catch up right here instead
+            self.log.write(text)
+
+    def write_date(self, t):
+        self.drain()
+        self.log.write_date(t)
+
+    def write_clock(self, t):
+        self.drain()
+        self.log.write_clock(t)
+
+    def drain(self):
+        text = self.queue.get_nowait()
+        while text is not None:
+            self.log.write(text)
+            text = self.queue.get_nowait()
+
+    def flush(self):
+        self.drain()
+        self.log.flush()
+
+    def poll(self):
+        self.drain()
+        self.log.poll()
+
+    def __getattr__(self, name):
+        return getattr(self.log, name)
+
+
+class DisplayQueue(object):
+    """Stands in for the machine's ScreenDriver, show() only queues the request."""
+
+    def __init__(self, driver, size=DISPLAY_QUEUE):
+        self.driver = driver
+        self.queue = BoundedQueue(size)
+
+    def show(self, pin):
+        self.queue.put_nowait((pin,), drop_oldest=True)     # wrapped, None is a valid request
+
+    def poll(self):
+        request = self.queue.get_nowait()
+        while request is not None:
+            self.driver.show(request[0])
+            request = self.queue.get_nowait()
+        self.driver.poll()
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+
+################################################################################
+# The runtime
+
+class Runtime(object):
+
+    def __init__(self, machine, tick=0.005, event_driven=True):
+        self.machine = machine
+        self.hal = machine.hal
+        self.tick = tick
+        self.event_driven = event_driven
+        self.virtual = getattr(self.hal, 'virtual_time', False)
+        self.presses = BoundedQueue(INPUT_QUEUE)
+        self._busy = False              # a transition is running in the dispatch task
+        self._stop = None               # hal.monotonic() to stop at, None runs forever
+
+    async def run(self, duration=None):
+        """Start the machine if needed and run the tasks, for "duration" seconds or forever."""
+        machine = self.machine
+        log, display = machine.stamp_log, machine.display
+        machine.stamp_log = LogQueue(log)
+        machine.display = DisplayQueue(display)
+        machine.awaiting = []
+        machine.fire = self._fire                   # timer events queue up behind the presses
+        self._stop = None if duration is None else self.hal.monotonic() + duration
+        try:
+            if machine.state is None:
+                machine.start()
+                await self._settle()
+            tasks = [asyncio.create_task(task) for task in (self._dispatch(), self._poll())]
+            await self._input()
+            for task in tasks:
+                task.cancel()
+        finally:
+            machine.stamp_log.drain()
+            machine.display.poll()
+            machine.stamp_log = log
+            machine.display = display
+            machine.awaiting = None
+            del machine.fire                        # back to the class method
+
+    def running(self):
+        return self._stop is None or self.hal.monotonic() < self._stop
+
+    async def sleep(self, seconds):
+        """asyncio.sleep, or on the simulator a wait until the input task has moved the clock that far."""
+        if not self.virtual:
+            await asyncio.sleep(seconds)
+            return
+        wake = self.hal.monotonic() + seconds
+        while self.hal.monotonic() < wake:
+            await asyncio.sleep(0)
+
+    async def _settle(self):                    # Await the coroutines the last transition's callbacks returned, in order
+        awaiting = self.machine.awaiting
+        while awaiting:
+            await awaiting.pop(0)
+
+    async def _input(self):
+        hal = self.hal
+        machine = self.machine
+        while self.running():
+            if self.event_driven:
+                event = hal.get_event()
+                while event is not None:
+                    if event.pressed:
+                        await self.presses.put(event.key_number)
+                    event = hal.get_event()
+            else:
+                hal.scan()
+                fell = hal.scanner.fell
+                key = 0
+                while fell:
+                    if fell & 1:
+                        machine.tracer.emit(PRESS, key, machine.index)      # like StateMachine.pressed()
+                        await self.presses.put(key)
+                    fell >>= 1
+                    key += 1
+            if self.virtual:
+                while len(self.presses) or self._busy:
+                    await asyncio.sleep(0)      # transitions take no virtual time, like on the sync simulator
+                hal.sleep(self.tick)            # the only place the virtual clock moves
+                await asyncio.sleep(0)
+            else:
+                await asyncio.sleep(self.tick)
+        while len(self.presses) or self._busy:  # let dispatch finish what was pressed
+            await asyncio.sleep(0)
+
+    def _fire(self, timer):                     # StateMachine.fire while the runtime runs, timer events queue up behind the presses
+        if timer.callback is not None:
+            timer.callback()
+        elif not self.presses.put_nowait(timer.event):
+            self.presses.dropped += 1
+
+    async def _dispatch(self):
+        machine = self.machine
+        while True:
+            key = await self.presses.get()
+            self._busy = True
+            machine.dispatch(key, True)
+            await self._settle()
+            self._busy = False
+
+    async def _poll(self):
+        while True:
+            self.machine.poll()
+            await self.sleep(self.tick)
@@ -0,0 +1,79 @@
+# Bit-parallel switch scanner for the polled loop
+# Every switch is sampled in one pass into one integer (bit n set while switch n is pressed) and all of them
+# are debounced together with a vertical counter: the per-switch counters are stored bit-sliced in two
+# integers, so an update is the same handful of integer operations for 2 switches or 16. A switch only
+# changes state after it read the other level on "samples" (1, 2 or 4) scans in a row.
+#
+# After update(), "fell" and "rose" hold the switches pressed and released on that scan as bitmasks, the
+# state machine walks the set bits of "fell" instead of asking every switch. "read" is any callable that
+# returns the raw bitmask: pin_reader() for a list of DigitalInOut inputs, or a port register read on
+# boards that expose one.
+
+class SwitchScanner(object):
+
+    def __init__(self, read, count, samples=4):
+        if samples not in (1, 2, 4):
+            raise ValueError("samples must be 1, 2 or 4")
+        self.read = read
+        self.count = count
+        self.mask = (1 << count) - 1
+        self.samples = samples
+        self.state = 0              # debounced levels, bit set while the switch is held down
+        self.fell = 0               # switches pressed on the last scan
+        self.rose = 0               # switches released on the last scan
+        self._c0 = 0                # low and high bits of every switch's counter, bit-sliced
+        self._c1 = 0
+
+    def update(self):
+        """Sample and debounce every switch at once, sets state, fell and rose."""
+        delta = (self.read() & self.mask) ^ self.state     # switches reading the other level
+        if self.samples == 4:
+            toggle = delta & self._c0 & self._c1            # fourth scan in a row that differs
+            self._c1 = (self._c1 ^ self._c0) & delta        # count up where it differs, reset where it agrees
+            self._c0 = ~self._c0 & delta
+        elif self.samples == 2:
+            toggle = delta & self._c0
+            self._c0 = ~self._c0 & delta
+        else:
+            toggle = delta
+        self.state ^= toggle
+        self.fell = toggle & self.state
+        self.rose = toggle & ~self.state
+
+
+def pin_reader(pins):
+    """Read callable for pulled up DigitalInOut inputs, bit n is set while pins[n] reads low."""
+    def read():
+        bits = 0
+        bit = 1
+        for pin in pins:
+            if not pin.value:
+                bits |= bit
+            bit <<= 1
+        return bits
+    return read
+
+
+################################################################################
+# One switch of a scanner, same surface as adafruit_debouncer.Debouncer (update, value, fell, rose)
+
+class ScannedSwitch(object):
+
+    def __init__(self, scanner, key):
+        self.scanner = scanner
+        self.bit = 1 << key
+
+    def update(self):                           # The scanner samples every switch, see SwitchScanner.update
+        pass
+
+    @property
+    def value(self):
+        return not self.scanner.state & self.bit
+
+    @property
+    def fell(self):
+        return bool(self.scanner.fell & self.bit)
+
+    @property
+    def rose(self):
+        return bool(self.scanner.rose & self.bit)
@@ -0,0 +1,367 @@
+# Framed serial link to the e-paper controller
+# The select lines (screens.py) can only say which of seven screens to show and take a pin per screen. ScreenLink
+# has the same surface as ScreenDriver (show, flush, poll) but talks to the controller over one UART with
+# framed messages, so a screen can carry live data: the date and time, the tracked time counter, the focus
+# timer countdown, the text lines of a spec-only screen.
+#
+# Frame, both directions:
+#
+#   0xA5, kind (u8), sequence (u8), screen (u8), payload length (u8), payload, CRC-16/CCITT (u16, little endian)
+#
+#   SHOW    screen id (state_machine.compile_spec: 1..7 in hal.SCREENS order, spec-only screens after that,
+#           0 blanks) and every field: the controller does a full refresh
+#   UPDATE  only the fields that changed since the last frame: the controller redraws just their regions
+#   ACK     controller -> machine, the frame with that sequence number was applied
+#   NAK     controller -> machine, a frame was corrupt or missed, the next frame is a SHOW that resyncs
+#
+# Payload fields: field id (u8, see fields.py), length (u8), UTF-8 text. The live fields come from "source", a
+# callable returning (field, text) pairs for the current state (StateMachine.screen_fields), checked every
+# "interval" seconds; text at minute resolution means an UPDATE at most once a minute.
+#
+# A frame without an ACK after "retry" seconds is followed by a SHOW; after "retries" failures in a row the
+# link only tries again every "backoff" seconds (or at the next screen change) until the controller answers. Loopback and the pty ports stand in for the UART on Linux:
+#
+#   python3 screenlink.py        runs a scripted session over a pseudo terminal pair and prints what went over
+
+import os
+
+from crc import crc16
+
+SYNC = 0xA5
+SHOW = 0x01
+UPDATE = 0x02
+ACK = 0x81
+NAK = 0x82
+
+HEADER_SIZE = 5
+PAYLOAD_MAX = 255
+FRAME_MAX = HEADER_SIZE + PAYLOAD_MAX + 2
+
+def build_frame(buf, kind, seq, screen, fields=()):
+    """Write one frame into the bytearray "buf" (FRAME_MAX long), returns its length. Fields that don't fit
+    into the payload are cut, on a character boundary."""
+    i = HEADER_SIZE
+    for field, text in fields:
+        data = text.encode() if isinstance(text, str) else text
+        room = HEADER_SIZE + PAYLOAD_MAX - i - 2
+        if room <= 0:
+            break
+        if len(data) > room:
+            while room and data[room] & 0xc0 == 0x80:      # not in the middle of a UTF-8 sequence
+                room -= 1
+            data = data[:room]
+        buf[i] = field
+        buf[i + 1] = len(data)
+        buf[i + 2:i + 2 + len(data)] = data
+        i += 2 + len(data)
+    buf[0] = SYNC
+    buf[1] = kind
+    buf[2] = seq
+    buf[3] = screen
+    buf[4] = i - HEADER_SIZE
+    crc = crc16(memoryview(buf)[1:i])
+    buf[i] = crc & 0xff
+    buf[i + 1] = crc >> 8
+    return i + 2
+
+
+def parse_fields(payload):
+    """The (field, text) pairs of a frame payload."""
+    fields = []
+    i = 0
+    while i + 2 <= len(payload):
+        end = i + 2 + payload[i + 1]
+        fields.append((payload[i], bytes(payload[i + 2:end]).decode()))
+        i = end
+    return fields
+
+
+class FrameReader(object):
+    """Splits a byte stream into frames, skipping noise and frames with a bad CRC."""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self.errors = 0             # frames dropped for a bad CRC
+
+    def feed(self, data):
+        if data:
+            self._buf.extend(data)
+
+    def next(self):
+        """The next whole frame as (kind, sequence, screen, payload), None when none is complete."""
+        buf = self._buf
+        while True:
+            start = buf.find(bytes((SYNC,)))
+            if start < 0:
+                del buf[:]
+                return None
+            if start:
+                del buf[:start]
+            if len(buf) < HEADER_SIZE:
+                return None
+            end = HEADER_SIZE + buf[4]
+            if len(buf) < end + 2:
+                return None
+            if crc16(memoryview(buf)[1:end]) == buf[end] | buf[end + 1] << 8:
+                frame = (buf[1], buf[2], buf[3], bytes(buf[HEADER_SIZE:end]))
+                del buf[:end + 2]
+                return frame
+            self.errors += 1
+            del buf[:1]             # hunt for the next sync byte
+
+
+################################################################################
+# Machine side
+
+class ScreenLink(object):
+
+    by_id = True                    # show() takes the state's screen id instead of its select pin (StateMachine.shown)
+
+    def __init__(self, hal, port, settle=0.25, interval=1.0, retry=0.5, retries=3, backoff=30.0):
+        self.hal = hal
+        self.port = port            # busio.UART, or a stand-in with write(), read(n) and in_waiting
+        self.settle = settle
+        self.interval = interval
+        self.retry = retry
+        self.retries = retries
+        self.backoff = backoff
+        self.source = None          # callable returning the live (field, text) pairs of the current screen
+        self.current = None         # screen id the controller was last told to show
+        self.requested = None
+        self._due = None            # hal.monotonic() when the request gets sent, None when nothing waits
+        self._check_at = 0.0        # next look at the live fields
+        self._fields = {}           # field -> text as last sent to the controller
+        self._synced = True         # the controller applied every frame so far, UPDATE is enough
+        self._sent_at = None        # hal.monotonic() of the frame waiting for its ACK, None when none waits
+        self._seq = 0
+        self._failures = 0          # NAKs and timeouts in a row
+        self._frame = bytearray(FRAME_MAX)
+        self._reader = FrameReader()
+        self.writes = 0             # frames sent
+        self.refreshes = 0          # SHOW frames, full refreshes on the controller
+        self.updates = 0            # UPDATE frames, partial refreshes
+        self.resyncs = 0            # SHOW frames sent after a NAK or a missing ACK
+        self.sent_bytes = 0
+
+    def show(self, screen):
+        """Request the screen with id "screen" (0 or None blanks), it is sent from poll() once requests settle."""
+        self.requested = screen
+        self._due = self.hal.monotonic() + self.settle
+        if self.settle <= 0:
+            self.poll()
+
+    def flush(self):
+        """Send the requested screen now without waiting for it to settle (the first screen at boot)."""
+        if self._due is not None:
+            self._due = self.hal.monotonic()
+            self.poll()
+
+    def poll(self):
+        """Call from the main loop: reads ACKs, sends a settled screen or the live fields that changed."""
+        now = self.hal.monotonic()
+        self._receive(now)
+        if self._due is not None and now >= self._due:
+            self._due = None
+            if self.requested != self.current or not self._synced:
+                self.current = self.requested
+                self._failures = 0
+                self._send_show()
+                return
+        if self._sent_at is not None:
+            if now < self._sent_at + self.retry:
+                return
+            self._sent_at = None                # no ACK, resync below
+            self._fail(now)
+        if now < self._check_at:
+            return
+        self._check_at = now + self.interval
+        if not self._synced:
+            self.resyncs += 1
+            self._send_show()
+        elif self.source is not None:
+            changed = [(field, text) for field, text in self.source() if self._fields.get(field) != text]
+            if changed:
+                for field, text in changed:
+                    self._fields[field] = text
+                self._send(UPDATE, changed)
+                self.updates += 1
+
+    def next_due(self):
+        """hal.monotonic() of the next thing poll() has to do, None when nothing waits."""
+        due = self._due
+        if self._sent_at is not None:
+            retry = self._sent_at + self.retry
+            if due is None or retry < due:
+                due = retry
+        elif self.source is not None or not self._synced:
+            if due is None or self._check_at < due:
+                due = self._check_at
+        return due
+
+    def _send_show(self):
+        fields = self.source() if self.source is not None and self.current else ()
+        self._fields = dict(fields)
+        self._synced = True                     # UPDATEs may follow right away, a NAK clears it again
+        self._send(SHOW, fields)
+        self.refreshes += 1
+
+    def _send(self, kind, fields):
+        self._seq = (self._seq + 1) & 0xff
+        length = build_frame(self._frame, kind, self._seq, self.current or 0, fields)
+        self.port.write(memoryview(self._frame)[:length])
+        self._sent_at = self.hal.monotonic()     # after source(), the first clock read can block a second
+        self.writes += 1
+        self.sent_bytes += length
+
+    def _receive(self, now):
+        waiting = self.port.in_waiting
+        if not waiting:
+            return
+        self._reader.feed(self.port.read(waiting))
+        frame = self._reader.next()
+        while frame is not None:
+            kind, seq = frame[0], frame[1]
+            if seq == self._seq and self._sent_at is not None:
+                self._sent_at = None
+                if kind == ACK:
+                    self._failures = 0
+                elif kind == NAK:
+                    self._fail(now)
+            frame = self._reader.next()
+
+    def _fail(self, now):
+        self._synced = False
+        self._failures += 1
+        self._check_at = now if self._failures <= self.retries else now + self.backoff     # when to resync
+
+
+################################################################################
+# Controller stand-in and ports for Linux
+
+class SimController(object):
+    """What the e-paper controller does with the frames, counts full and partial refreshes."""
+
+    def __init__(self):
+        self.reader = FrameReader()
+        self.screen = 0
+        self.fields = {}
+        self.full = 0               # full refreshes (SHOW)
+        self.partial = 0            # partial refreshes (UPDATE), one per frame
+        self.regions = 0            # fields redrawn by partial refreshes
+        self.online = True          # False ignores every frame, like an unplugged controller
+        self._seq = None
+        self._reply = bytearray(FRAME_MAX)
+
+    def receive(self, data):
+        """Feed bytes from the machine, returns the reply bytes."""
+        self.reader.feed(data)
+        replies = b''
+        frame = self.reader.next()
+        while frame is not None:
+            if self.online:
+                replies += self._apply(*frame)
+            frame = self.reader.next()
+        return replies
+
+    def _apply(self, kind, seq, screen, payload):
+        missed = self._seq is None or seq != (self._seq + 1) & 0xff or self.reader.errors
+        self.reader.errors = 0
+        self._seq = seq
+        if kind == SHOW:
+            self.screen = screen
+            self.fields = dict(parse_fields(payload))
+            self.full += 1
+        elif kind == UPDATE and not missed and screen == self.screen:
+            fields = parse_fields(payload)
+            self.fields.update(fields)
+            self.partial += 1
+            self.regions += len(fields)
+        else:
+            return self._answer(NAK, seq)
+        return self._answer(ACK, seq)
+
+    def _answer(self, kind, seq):
+        return bytes(self._reply[:build_frame(self._reply, kind, seq, self.screen)])
+
+
+class Loopback(object):
+    """UART stand-in wired straight to a SimController."""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self._rx = bytearray()
+
+    def write(self, data):
+        self._rx.extend(self.controller.receive(bytes(data)))
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        return len(self._rx)
+
+    def read(self, count):
+        data = bytes(self._rx[:count])
+        del self._rx[:count]
+        return data or None
+
+
+class FdPort(object):
+    """UART stand-in on a file descriptor (one end of a pseudo terminal), non-blocking reads."""
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def write(self, data):
+        return os.write(self.fd, bytes(data))
+
+    @property
+    def in_waiting(self):
+        import select
+        return FRAME_MAX if select.select([self.fd], [], [], 0)[0] else 0
+
+    def read(self, count):
+        return os.read(self.fd, count) or None
+
+
+def open_pty():
+    """A connected pair of raw pseudo terminal ports (machine end, controller end) and the controller end's path."""
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    return FdPort(master), FdPort(slave), os.ttyname(slave)
+
+
+def _demo():
+    import select
+    from hal_sim import SimHAL
+    from state_machine import build_machine
+
+    machine_port, controller_port, path = open_pty()
+    print("machine -> controller over %s" % path)
+    hw = SimHAL(epoch=1700000000)
+    link = ScreenLink(hw, machine_port)
+    machine = build_machine(hw, display=link)
+    link.source = machine.screen_fields
+    controller = SimController()
+    machine.start()
+    link.flush()
+    # Home -> Profile 1 -> Tracking1 for 10 minutes -> Voice Note -> Record -> Home
+    for at in (1.0, 3.0, 603.0, 605.0, 607.0):
+        hw.switch_1.tap(at, 0.2)
+    writes = 0
+    while hw.monotonic() < 700.0:
+        machine.run_events(0.005)
+        machine.poll()
+        if link.writes != writes:               # the virtual clock outruns the pty, wait for the frame and its reply
+            writes = link.writes
+            select.select([controller_port.fd], [], [], 1.0)
+            controller_port.write(controller.receive(controller_port.read(FRAME_MAX)))
+            select.select([machine_port.fd], [], [], 1.0)
+    print("frames %d (%d bytes): %d full refreshes, %d partial refreshes redrawing %d fields, %d resyncs"
+          % (link.writes, link.sent_bytes, controller.full, controller.partial, controller.regions, link.resyncs))
+    print("controller shows screen %d with %r" % (controller.screen, controller.fields))
+
+
+if __name__ == '__main__':
+    _demo()
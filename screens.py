@@ -0,0 +1,102 @@
+# Output driver for the e-paper screen select lines
+# The states used to hold one of the seven select pins high for as long as they were active. The M4
+# e-paper controller refreshes over and over while a line is held high (README issue 1) and an e-paper
+# refresh takes seconds, so every redundant one costs time and power. ScreenDriver sits between the
+# state machine and the pins:
+#   - a pin is only written when the requested screen differs from the one already shown
+#   - requests are held for "settle" seconds and only the last one is sent, so back-to-back
+#     transitions (Tracking1 -> Voice Note) cost one refresh instead of two
+#   - with "pulse" set the line is strobed high for that many seconds instead of held (level mode
+#     otherwise), the controller sees one rising edge per screen change
+#   - in pulse mode with "reassert" set, the current screen is strobed again every that many seconds
+#     so a controller that lost it during its periodic refresh (README issue 3) gets it back
+# Deadlines are kept in hal.monotonic_ns(), the board's float monotonic() is too coarse after a few hours
+# for a 50 ms strobe.
+
+NS = 1000000000
+
+
+def _ns(seconds):
+    return None if seconds is None else int(seconds * NS)
+
+
+class ScreenDriver(object):
+
+    def __init__(self, hal, pulse=None, settle=0.25, reassert=None):
+        self.hal = hal
+        self.pulse = pulse
+        self.settle = settle
+        self.reassert = reassert
+        self._pulse_ns = _ns(pulse)
+        self._settle_ns = _ns(settle)
+        self._reassert_ns = _ns(reassert)
+        self.current = None         # select pin of the screen the controller was last told to show
+        self.requested = None       # select pin of the screen the machine wants, None for no screen
+        self._due = None            # hal.monotonic_ns() when the request gets sent, None when nothing waits
+        self._pulse_end = None      # hal.monotonic_ns() when the strobed line goes low again
+        self._shown_at = 0
+        self.writes = 0             # pin writes so far
+        self.refreshes = 0          # screen changes actually sent to the controller
+
+    def show(self, pin):
+        """Request the screen selected by "pin" (or None), it is sent from poll() once requests settle."""
+        self.requested = pin
+        self._due = self.hal.monotonic_ns() + self._settle_ns
+        if self.settle <= 0:
+            self.poll()
+
+    def flush(self):
+        """Send the requested screen now without waiting for it to settle (the first screen at boot)."""
+        if self._due is not None:
+            self._due = self.hal.monotonic_ns()
+            self.poll()
+
+    def poll(self):
+        """Call from the main loop, sends a settled request and ends strobes."""
+        now = self.hal.monotonic_ns()
+        if self._pulse_end is not None and now >= self._pulse_end:
+            self._write(self.current, False)
+            self._pulse_end = None
+        if self._due is not None and now >= self._due:
+            self._due = None
+            if self.requested is not self.current:
+                self._send(self.requested, now)
+        elif (self.pulse is not None and self.reassert is not None and self.current is not None
+              and self._pulse_end is None and now >= self._shown_at + self._reassert_ns):
+            self._strobe(self.current, now)
+
+    def next_due(self):
+        """hal.monotonic() of the next thing poll() has to do, None when nothing waits."""
+        due = self._due
+        if self._pulse_end is not None and (due is None or self._pulse_end < due):
+            due = self._pulse_end
+        if (self.pulse is not None and self.reassert is not None and self.current is not None
+                and self._pulse_end is None):
+            reassert = self._shown_at + self._reassert_ns
+            if due is None or reassert < due:
+                due = reassert
+        return None if due is None else due / NS
+
+    def _send(self, pin, now):
+        if self.current is not None and (self.pulse is None or self._pulse_end is not None):
+            self._write(self.current, False)    # level mode, or a strobe still running
+            self._pulse_end = None
+        self.current = pin
+        self.refreshes += 1
+        if pin is None:
+            return
+        if self.pulse is None:
+            self._write(pin, True)
+            self._shown_at = now
+        else:
+            self._strobe(pin, now)
+
+    def _strobe(self, pin, now):
+        self._write(pin, True)
+        self._pulse_end = now + self._pulse_ns
+        self._shown_at = now
+
+    def _write(self, pin, level):
+        if pin is not None:
+            pin.value = level
+            self.writes += 1
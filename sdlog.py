@@ -0,0 +1,198 @@
+# Buffered SD card logger
+# The states used to open "/sd/stamp.csv", write a few fragments and close it again on every transition,
+# each of those costs a FAT open/seek/close over SPI while the buttons wait. BufferedLog collects the text
+# in a preallocated RAM buffer and appends it to the card in sector sized batches, when the buffer fills
+# up or when poll() finds the oldest unwritten byte older than the flush interval.
+#
+# Every batch goes through a small write-ahead journal first:
+#   1. the journal file gets the batch, the length the log had before it and a CRC
+#   2. the batch is appended to the log
+#   3. the journal is removed
+# A power cut during 1 leaves a torn journal that recover() throws away (the log is untouched),
+# a cut during 2 leaves a good journal that recover() replays over the half written tail.
+# Either way at most the unflushed tail is lost and the log never holds a partial batch.
+#
+# The states write their stamps with write_date() and write_clock(): civil() splits the epoch into the
+# fields of a preallocated array (no struct_time) and the digits go straight into the buffer (no "%" string,
+# no encode), so logging a stamp formats no strings. The rest of a transition (method calls, the tracer, the
+# screen request) can still allocate, heap.py measures how much.
+
+import binascii
+import struct
+
+SECTOR = 512                # FAT sector size, the buffer is a multiple of it: a full buffer writes whole sectors, timed and explicit flushes write whatever is buffered
+JOURNAL_MAGIC = b'SJN1'
+_HEADER = '<4sII'           # magic, log length before the batch, batch length
+_HEADER_SIZE = struct.calcsize(_HEADER)
+STAMP_BYTES = 16            # longest stamp text: "12/31/2099, " or "23:59:59, "
+DAY = 86400
+
+
+def civil(epoch, out):
+    """Fill out[0:6] with month, day, year, hour, minute and second of "epoch", like time.localtime() on the
+    board (no time zone) but into a preallocated array instead of a new struct_time."""
+    days = epoch // DAY
+    second = epoch - days * DAY
+    out[3] = second // 3600
+    out[4] = second // 60 % 60
+    out[5] = second % 60
+    days += 719468                  # days since 0000-03-01, the year then ends with the leap day
+    era = days // 146097
+    day = days - era * 146097
+    year = (day - day // 1460 + day // 36524 - day // 146096) // 365
+    day -= 365 * year + year // 4 - year // 100
+    month = (5 * day + 2) // 153
+    out[1] = day - (153 * month + 2) // 5 + 1
+    out[0] = month + 3 if month < 10 else month - 9
+    out[2] = year + era * 400 + (1 if month >= 10 else 0)
+
+
+def put_number(buf, at, value, width=1):
+    """Write "value" as ASCII digits, zero padded to "width", into "buf" at "at". Returns the end offset."""
+    digits = 1
+    power = 10
+    while value >= power:
+        digits += 1
+        power *= 10
+    if digits < width:
+        digits = width
+    end = at + digits
+    while digits:
+        digits -= 1
+        buf[at + digits] = 48 + value % 10
+        value //= 10
+    return end
+
+
+class BufferedLog(object):
+
+    def __init__(self, hal, name="stamp.csv", journal="stamp.jnl", sectors=2, flush_interval=10.0):
+        self.hal = hal
+        self.name = name
+        self.journal = journal
+        self.flush_interval = flush_interval
+        self._buf = bytearray(SECTOR * sectors)     # preallocated once, never grows
+        self._view = memoryview(self._buf)
+        self._used = 0
+        self._since = None                          # hal.monotonic() of the oldest byte not on the card yet
+        self._size = None                           # length of the log on the card, read once then tracked
+
+    def write(self, text):
+        """Queue text (or bytes) for the log, flushing whenever the buffer fills up."""
+        data = text.encode() if isinstance(text, str) else text
+        if len(data) <= len(self._buf) - self._used:   # fits: one slice store, "data" is not cut into copies
+            self._reserve(0)
+            self._buf[self._used:self._used + len(data)] = data
+            self._used += len(data)
+            if self._used == len(self._buf):
+                self.flush()
+            return
+        start = 0
+        while start < len(data):
+            if self._since is None:                 # also after a flush in the middle of this write
+                self._since = self.hal.monotonic()
+            room = len(self._buf) - self._used
+            chunk = min(room, len(data) - start)
+            self._view[self._used:self._used + chunk] = data[start:start + chunk]
+            self._used += chunk
+            start += chunk
+            if self._used == len(self._buf):
+                self.flush()
+
+    def write_date(self, t):                        # "month/day/year, " of civil() fields, formatted in the buffer
+        buf = self._reserve(STAMP_BYTES)
+        at = put_number(buf, self._used, t[0])
+        buf[at] = 47                                # '/'
+        at = put_number(buf, at + 1, t[1])
+        buf[at] = 47
+        self._used = self._separator(put_number(buf, at + 1, t[2]))
+
+    def write_clock(self, t):                       # "hour:MM:SS, " of civil() fields, formatted in the buffer
+        buf = self._reserve(STAMP_BYTES)
+        at = put_number(buf, self._used, t[3])
+        buf[at] = 58                                # ':'
+        at = put_number(buf, at + 1, t[4], 2)
+        buf[at] = 58
+        self._used = self._separator(put_number(buf, at + 1, t[5], 2))
+
+    def _separator(self, at):                       # ", " after a stamp, returns the end
+        self._buf[at] = 44
+        self._buf[at + 1] = 32
+        return at + 2
+
+    def _reserve(self, size):                       # Make room for "size" more bytes, returns the buffer
+        if len(self._buf) - self._used < size:
+            self.flush()
+        if self._since is None:
+            self._since = self.hal.monotonic()
+        return self._buf
+
+    def pending(self):                              # Bytes waiting in RAM
+        return self._used
+
+    def poll(self):
+        """Call from the main loop, flushes once the oldest buffered byte is flush_interval seconds old."""
+        if self._used and self.hal.monotonic() >= self._since + self.flush_interval:    # same sum as next_due()
+            self.flush()
+
+    def next_due(self):
+        """hal.monotonic() of the next flush poll() does, None while nothing is buffered."""
+        return self._since + self.flush_interval if self._used else None
+
+    def flush(self):
+        if not self._used:
+            return
+        batch = self._view[:self._used]
+        if self._size is None:
+            self._size = self.hal.size(self.name) or 0
+        self.hal.led.value = True                   # turn on LED to indicate writing entries
+
+        # 1. journal the batch
+        with self.hal.open(self.journal, "wb") as f:
+            f.write(struct.pack(_HEADER, JOURNAL_MAGIC, self._size, self._used))
+            f.write(batch)
+            f.write(struct.pack('<I', binascii.crc32(batch)))
+
+        # 2. append it to the log
+        with self.hal.open(self.name, "ab") as f:
+            f.write(batch)
+        self._size += self._used
+
+        # 3. the batch is safe, drop the journal
+        self.hal.remove(self.journal)
+        self.hal.led.value = False                  # turn off LED to indicate we're done
+
+        self._used = 0
+        self._since = None
+
+    def recover(self):
+        """Replay a journal left behind by a power cut, call once at boot before writing.
+
+        Returns the number of bytes replayed, 0 when there was nothing (or nothing usable) to replay.
+        """
+        try:
+            f = self.hal.open(self.journal, "rb")
+        except OSError:
+            return 0
+        with f:
+            header = f.read(_HEADER_SIZE)
+            batch = None
+            if len(header) == _HEADER_SIZE:
+                magic, offset, length = struct.unpack(_HEADER, header)
+                batch = f.read(length)
+                crc = f.read(4)
+                if (magic != JOURNAL_MAGIC or len(batch) != length or len(crc) != 4
+                        or struct.unpack('<I', crc)[0] != binascii.crc32(batch)):
+                    batch = None                    # torn journal, the log was never touched
+
+        replayed = 0
+        if batch is not None:
+            size = self.hal.size(self.name) or 0
+            if offset <= size < offset + length:    # the append was cut short, write the whole batch again
+                with self.hal.open(self.name, "r+b" if size else "wb") as f:
+                    f.seek(offset)
+                    f.write(batch)
+                replayed = length
+        self.hal.remove(self.journal)
+        self._size = None
+        return replayed
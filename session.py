@@ -0,0 +1,95 @@
+# Session store shared by the states
+# Each tracking state used to keep its own copy of the stamps as twelve fields (month_in ... sec_out), so the
+# states after Tracking1 couldn't see its stamp and nothing could subtract one stamp from the other.
+# StateMachine.session is the one place a session lives now: start and stop as epoch seconds, the ended
+# sessions in a fixed ring of typed arrays and the tracked seconds per day, added up as each session stops
+# (a session past midnight is split over the days it covers). The tracked time counter and today's total are
+# then a subtraction and an array read, whatever the history holds.
+
+import array
+
+DAY = 86400
+
+
+class SessionStore(object):
+
+    def __init__(self, history=32, days=8):
+        self.start = 0              # epoch of the current session's START and STOP stamps, 0 when not taken
+        self.stop = 0
+        self.task = 0
+        self.count = 0              # sessions ended since boot
+        self._starts = array.array('L', [0] * history)     # ring of the last "history" ended sessions
+        self._stops = array.array('L', [0] * history)
+        self._tasks = array.array('B', [0] * history)
+        self._notes = array.array('B', [0] * history)
+        self._days = array.array('l', [-1] * days)         # ring of the last "days" days: day number
+        self._totals = array.array('L', [0] * days)        # and seconds tracked on it
+
+    def begin(self, epoch, task):
+        """The START stamp, a new session for "task" is open."""
+        self.start = epoch
+        self.stop = 0
+        self.task = task
+
+    def end(self, epoch):
+        """The STOP stamp: the session goes into the history and its seconds into the daily totals."""
+        self.stop = epoch
+        slot = self.count % len(self._starts)
+        self._starts[slot] = self.start
+        self._stops[slot] = epoch
+        self._tasks[slot] = self.task
+        self._notes[slot] = 0
+        self.count += 1
+        start = self.start
+        while start < epoch:                # one pass, or one per midnight crossed
+            day = start // DAY
+            end = min(epoch, (day + 1) * DAY)
+            self._add(day, end - start)
+            start = end
+
+    def noted(self):                        # The session that just ended got a voice note
+        if self.count:
+            self._notes[(self.count - 1) % len(self._notes)] = 1
+
+    def resume(self, start, stop, task):
+        """Back from a checkpoint (see checkpoint.py): the open session, or the ended one when "stop" is set."""
+        self.begin(start, task)
+        if stop:
+            self.end(stop)
+
+    def _add(self, day, seconds):
+        slot = day % len(self._days)
+        if self._days[slot] != day:         # the slot still holds an older day
+            self._days[slot] = day
+            self._totals[slot] = 0
+        self._totals[slot] += seconds
+
+    @property
+    def open(self):                         # A START stamp without its STOP
+        return self.start != 0 and self.stop == 0
+
+    def elapsed(self, now):
+        """Seconds of the current session, up to "now" while it is open."""
+        if not self.start:
+            return 0
+        return (now if self.stop == 0 else self.stop) - self.start
+
+    def total(self, day):
+        """Seconds of the ended sessions on day number "day" (epoch // 86400), 0 once it left the ring."""
+        slot = day % len(self._days)
+        return self._totals[slot] if self._days[slot] == day else 0
+
+    def today(self, now):
+        """Seconds tracked on the day of "now", the open session's part of it included."""
+        day = now // DAY
+        seconds = self.total(day)
+        if self.open:
+            seconds += max(0, now - max(self.start, day * DAY))
+        return seconds
+
+    def history(self, back=0):
+        """(start, stop, task, note) of the ended session "back" places before the last one, None past the ring."""
+        if back >= min(self.count, len(self._starts)):
+            return None
+        slot = (self.count - 1 - back) % len(self._starts)
+        return self._starts[slot], self._stops[slot], self._tasks[slot], self._notes[slot] != 0
@@ -0,0 +1,179 @@
+# Binary session log
+# Optional replacement for the comma text in "stamp.csv". Every tracked session is one fixed width
+# record, written once when the session ends instead of as fragments from three states:
+#
+#   epoch start (u32), epoch stop (u32), task id (u16), note flag (u8), padding (u8)   = 12 bytes
+#
+# A sidecar index holds, for every day since the first logged one, the number of the first record of
+# that day. Finding a day's sessions is two seeks (index entry, then records), no matter how many
+# years of logs are on the card. export_csv() turns the records back into the spreadsheet layout.
+#
+#   python3 sessionlog.py sessions.bin > stamp.csv
+
+import struct
+import time
+
+from sdlog import BufferedLog
+
+RECORD = '<IIHBx'
+RECORD_SIZE = struct.calcsize(RECORD)
+INDEX_MAGIC = b'SIX1'
+_INDEX_HEADER = '<4sI'      # magic, first day (epoch // 86400)
+_INDEX_HEADER_SIZE = struct.calcsize(_INDEX_HEADER)
+_ENTRY = '<I'
+_ENTRY_SIZE = 4
+DAY = 86400
+
+CSV_HEADER = "Date, Time In, Time Out , Total, Voice Note\r\n"
+
+
+################################################################################
+# Writer, used on the device through the HAL
+
+class SessionLog(object):
+
+    def __init__(self, hal, name="sessions.bin", index="sessions.idx", flush_interval=10.0):
+        self.hal = hal
+        self.name = name
+        self.index = index
+        self.records = BufferedLog(hal, name, name[:name.rfind('.')] + ".jnl", sectors=1, flush_interval=flush_interval)
+        self._count = 0             # records on the card plus the ones still buffered
+        self._base_day = None       # day of index entry 0, None until the first session
+        self._days = 0              # index entries written
+
+    def open(self):
+        """Replay the journal and load the index position, call once at boot."""
+        self.records.recover()
+        self._count = (self.hal.size(self.name) or 0) // RECORD_SIZE
+        size = self.hal.size(self.index)
+        self._base_day = None
+        self._days = 0
+        if size is not None and size >= _INDEX_HEADER_SIZE:
+            with self.hal.open(self.index, "rb") as f:
+                magic, base_day = struct.unpack(_INDEX_HEADER, f.read(_INDEX_HEADER_SIZE))
+                days = (size - _INDEX_HEADER_SIZE) // _ENTRY_SIZE
+                last = None
+                if days:
+                    f.seek(_INDEX_HEADER_SIZE + (days - 1) * _ENTRY_SIZE)
+                    last = struct.unpack(_ENTRY, f.read(_ENTRY_SIZE))[0]
+            if magic == INDEX_MAGIC and (last is None or last <= self._count):
+                self._base_day = base_day
+                self._days = days
+        if self._count and not self._index_covers_tail():
+            self._rebuild_index()   # a power cut left the index behind or ahead of the records
+
+    def append(self, start, stop, task, note):
+        """Queue one finished session, start and stop are epoch seconds."""
+        day = start // DAY
+        if self._base_day is None:
+            with self.hal.open(self.index, "wb") as f:
+                f.write(struct.pack(_INDEX_HEADER, INDEX_MAGIC, day))
+            self._base_day = day
+            self._days = 0
+        if day >= self._base_day + self._days:     # first session of a new day, days without sessions point at it too
+            missing = day - self._base_day - self._days + 1
+            with self.hal.open(self.index, "ab") as f:
+                f.write(struct.pack(_ENTRY, self._count) * missing)
+            self._days += missing
+        self.records.write(struct.pack(RECORD, start, stop, task, 1 if note else 0))
+        self._count += 1
+
+    def poll(self):
+        self.records.poll()
+
+    def next_due(self):
+        return self.records.next_due()
+
+    def flush(self):
+        self.records.flush()
+
+    def day(self, epoch):
+        """Sessions that started on the same day as "epoch", as (start, stop, task, note) tuples."""
+        self.flush()
+        with self.hal.open(self.name, "rb") as records, self.hal.open(self.index, "rb") as index:
+            return read_day(records, index, epoch)
+
+    def _index_covers_tail(self):
+        if self._base_day is None:
+            return False
+        with self.hal.open(self.name, "rb") as f:
+            f.seek((self._count - 1) * RECORD_SIZE)
+            start = struct.unpack(RECORD, f.read(RECORD_SIZE))[0]
+        return start // DAY < self._base_day + self._days
+
+    def _rebuild_index(self):
+        with self.hal.open(self.name, "rb") as records, self.hal.open(self.index, "wb") as index:
+            build_index(records, index)
+        self.open()
+
+
+################################################################################
+# Readers, work on any pair of open binary files (the card through the HAL or copies on a PC)
+
+def read_day(records, index, epoch):
+    """Return the sessions of the day containing "epoch" with two seeks, [] when there are none."""
+    magic, base_day = struct.unpack(_INDEX_HEADER, index.read(_INDEX_HEADER_SIZE))
+    if magic != INDEX_MAGIC:
+        raise ValueError("not a session index")
+    offset = epoch // DAY - base_day
+    if offset < 0:
+        return []
+    index.seek(_INDEX_HEADER_SIZE + offset * _ENTRY_SIZE)
+    raw = index.read(2 * _ENTRY_SIZE)
+    if len(raw) < _ENTRY_SIZE:
+        return []
+    first = struct.unpack_from(_ENTRY, raw)[0]
+    records.seek(first * RECORD_SIZE)
+    if len(raw) == 2 * _ENTRY_SIZE:
+        data = records.read((struct.unpack_from(_ENTRY, raw, _ENTRY_SIZE)[0] - first) * RECORD_SIZE)
+    else:
+        data = records.read()       # the last indexed day runs to the end of the file
+    whole = len(data) - len(data) % RECORD_SIZE
+    return [struct.unpack_from(RECORD, data, at) for at in range(0, whole, RECORD_SIZE)]
+
+
+def iter_records(records, chunk=64):
+    """Stream every record of a session file, "chunk" records per read."""
+    while True:
+        data = records.read(chunk * RECORD_SIZE)
+        whole = len(data) - len(data) % RECORD_SIZE
+        for at in range(0, whole, RECORD_SIZE):
+            yield struct.unpack_from(RECORD, data, at)
+        if len(data) < chunk * RECORD_SIZE:
+            return
+
+
+def build_index(records, index):
+    """Write a fresh day index for a session file, records must be in start order."""
+    base_day = None
+    days = 0
+    for count, record in enumerate(iter_records(records)):
+        day = record[0] // DAY
+        if base_day is None:
+            base_day = day
+            index.write(struct.pack(_INDEX_HEADER, INDEX_MAGIC, day))
+        if day >= base_day + days:
+            index.write(struct.pack(_ENTRY, count) * (day - base_day - days + 1))
+            days = day - base_day + 1
+
+
+def export_csv(records, out, header=True):
+    """Stream a session file into "out" in the stamp.csv layout, one row per session."""
+    if header:
+        out.write(CSV_HEADER)
+    for start, stop, _, note in iter_records(records):
+        t_in = time.gmtime(start)       # the board's epochs have no time zone, the PC's must not add its own
+        t_out = time.gmtime(stop)
+        total = max(stop - start, 0)
+        out.write("%d/%d/%d, %d:%02d:%02d, %d:%02d:%02d, %d:%02d:%02d, %s\r\n" % (
+            t_in.tm_mon, t_in.tm_mday, t_in.tm_year,
+            t_in.tm_hour, t_in.tm_min, t_in.tm_sec,
+            t_out.tm_hour, t_out.tm_min, t_out.tm_sec,
+            total // 3600, total // 60 % 60, total % 60,
+            "Speech to text voice note" if note else ""))
+
+
+if __name__ == '__main__':
+    import sys
+    with open(sys.argv[1], "rb") as f:
+        export_csv(f, sys.stdout)
@@ -0,0 +1,92 @@
+# Boot sequence, shared by code.py and the recorder's replay
+# code.py collects its settings into a dict (the one RECORD_TRACE stores with the recording) and calls boot();
+# recorder.replay() calls it with the recorded dict, so a replay comes up the way the board did.
+# Order: the state machine and its first screen, then the SD card, then the RTC. Presses made while those come
+# up wait in the keypad queue. Optional features are only imported when their setting turns them on.
+#
+# Settings, a missing one takes the default after it:
+#   'pulse' 0.05, 'settle' 0.25, 'reassert' None         screen select lines (screens.py)
+#   'screen_link' False                                   framed UART to the e-paper controller instead (screenlink.py)
+#   'flush' 10.0                                          seconds log entries wait in RAM
+#   'rotate_bytes' 256 KB, 'rotate_daily' False, 'compact_keep' None      stamp.csv segments (logrotate.py)
+#   'binary' False                                        sessions.bin instead of stamp.csv rows (sessionlog.py)
+#   'resume' True                                         NVM checkpoint (checkpoint.py)
+#   'instrument' False, 'heap' False, 'heap_low' 16 KB    instrument.py, heap.py
+#   'trace_level' INFO, 'trace_sink' NONE                 tracing.py
+
+from logrotate import RotatingLog
+from state_machine import build_machine
+from timesource import TimeSource
+from tracing import INFO, NONE, RECOVERED, Tracer
+
+HEADER = "Date, Time In, Time Out , Total, Voice Note\r\n"     # column names of a new stamp.csv
+
+
+def boot(hw, config, clock=None, phase=None):
+    """Build the machine on "hw", show its first screen, bring up the SD card and the clock, returns the machine.
+    "clock" (a time.struct_time) is written to the RTC instead of reading it, "phase" is called with the name of
+    each boot phase as it finishes."""
+    flush = config.get('flush', 10.0)
+    if config.get('screen_link'):
+        from screenlink import ScreenLink
+        display = ScreenLink(hw, hw.display_port(), settle=config.get('settle', 0.25))
+    else:
+        from screens import ScreenDriver
+        display = ScreenDriver(hw, pulse=config.get('pulse', 0.05), settle=config.get('settle', 0.25),
+                               reassert=config.get('reassert'))
+    time_source = TimeSource(hw)        # reads the RTC once (on the first sync), then counts from time.monotonic_ns()
+    stamp_log = RotatingLog(hw, "stamp.csv", flush_interval=flush, max_bytes=config.get('rotate_bytes', 256 * 1024),
+                            day=(lambda: time_source.now() // 86400) if config.get('rotate_daily') else None,
+                            header=config.get('header', HEADER))     # nothing touches the card before the first flush
+    tracer = Tracer(hw, level=config.get('trace_level', INFO), sink=config.get('trace_sink', NONE))
+    machine = build_machine(hw, stamp_log, display=display, time_source=time_source, tracer=tracer)
+    if config.get('binary'):
+        from sessionlog import SessionLog
+        machine.session_log = SessionLog(hw, flush_interval=flush)    # opened once the card is up
+
+    if config.get('instrument'):
+        from instrument import Instruments
+        Instruments(machine).attach()
+    if config.get('heap'):
+        from heap import HeapMonitor
+        HeapMonitor(machine, low=config.get('heap_low', 16 * 1024)).attach()
+    if hasattr(hw, 'attach'):
+        hw.attach(machine)              # recorder.RecordingHAL, the trace is flushed from poll() like the other logs
+
+    resumed = False
+    if config.get('resume', True):
+        from checkpoint import Checkpoint
+        checkpoint = Checkpoint(hw)
+        resumed = checkpoint.restore(machine)       # back in the state a reset interrupted, with its session
+        machine.checkpoint = checkpoint
+    if not resumed:
+        machine.start()                 # the spec's start state, "Home"
+    display.flush()                     # the first screen now instead of after the settle time (the screen link without its live fields, the clock isn't read yet)
+    _phase(phase, "home screen")
+
+    # SD card, mounted by the HAL on first use. A journal left by a power cut is replayed first
+    replayed = stamp_log.recover()
+    if replayed:
+        tracer.emit(RECOVERED, replayed)
+    if config.get('compact_keep') is not None and stamp_log.compact(config['compact_keep']):
+        print("Merged the old log segments\n")
+    if config.get('binary'):
+        machine.session_log.open()
+    if resumed:
+        machine.state.restore(machine)  # writes again what the reset kept off the card
+    _phase(phase, "sd card")
+
+    # The RTC keeps its time on battery, it is only written when asked to
+    if clock is not None:
+        time_source.set(clock)
+    else:
+        time_source.sync()              # first read up front, so no transition waits for the RTC to tick
+    if config.get('screen_link'):
+        display.source = machine.screen_fields      # live data for the partial refreshes, sent once the clock is synced
+    _phase(phase, "clock")
+    return machine
+
+
+def _phase(phase, name):
+    if phase is not None:
+        phase(name)
@@ -0,0 +1,762 @@
+# State Machine and State Classes rev 5
+# Split out of code.py so the same states run on the M4 express and on a Linux box.
+# The states never touch board/digitalio directly, every pin, switch, the RTC and the
+# SD card are reached through "machine.hal" (see hal.py and hal_sim.py)
+
+# pylint: disable=global-statement,stop-iteration-return,no-self-use,useless-super-delegation
+
+import array
+import json
+
+from fields import DATE_TIME, ELAPSED, REMAINING, TEXT, TODAY, date_time, duration
+from hal import SCREENS
+from screens import ScreenDriver
+from sdlog import BufferedLog, civil
+from session import SessionStore
+from timers import TimerWheel
+from timesource import TimeSource
+from tracing import (AH_AH_AH, DATE_AND_TIME, ENTER, EXIT, FOCUS_COUNTDOWN, HEADER, NO_NOTE, NOTE, PLACEHOLDER, PRESS,
+                     PROFILE2_SCREEN, RESUMED, SCREEN_TEXT, SECOND_SEMESTER, SESSION, STAMP_IN, STAMP_OUT, TRACKED_COUNTER,
+                     YES_OR_NO, Tracer)
+
+# Tracing replaced print() and the TESTING flag: the states emit numeric events into machine.tracer, a ring
+# buffer that is only decoded to text on its way to the serial monitor or the SD card (see tracing.py)
+
+# What a state does to the session, named by State.on_enter, State.on_exit and State.hook_actions. StateMachine
+# runs them through act(), fleet.Fleet reads the same attributes into its columns, so there is one definition.
+BEGIN = 1                   # take the START stamp, a session of State.task opens
+END = 2                     # take the STOP stamp
+LOG_NOTE = 3                # the session is logged with a voice note
+LOG_NO_NOTE = 4             # the session is logged without one
+
+
+################################################################################
+# State Machine, Manages states
+
+class StateMachine(object):
+
+    def __init__(self, hal, stamp_log=None, spec=None, display=None, time_source=None, tracer=None):   # Needed constructor, "hal" is the hardware the states talk to
+        self.hal = hal
+        self.tracer = tracer if tracer is not None else Tracer(hal)     # trace records of the transitions, see tracing.py
+        self.tracer.machine = self
+        self.commands = self.tracer.commands()      # letter typed on the serial monitor -> function to run
+        self.display = display if display is not None else ScreenDriver(hal)    # writes the screen select pins
+        self.time_source = time_source if time_source is not None else TimeSource(hal)    # timestamps without reading the RTC every time
+        self.stamp_log = stamp_log if stamp_log is not None else BufferedLog(hal)    # "stamp.csv", buffered in RAM
+        self.session_log = None                     # set to a sessionlog.SessionLog to log binary records instead of csv text
+        self.session = SessionStore()               # the current session's START and STOP stamps, the last ones and daily totals
+        self.timer_start = 0                        # epoch the focus timer started at
+        self.focus_timer = None                     # its "focus_done" timer, kept here so the state objects hold no per machine data
+        self.clock = array.array('H', [0] * 6)      # month, day, year, hour, minute, second of the last stamp (sdlog.civil)
+        self.checkpoint = None                      # set to a checkpoint.Checkpoint to save the state after every transition
+        self.timers = TimerWheel(hal)               # timeouts, see after() and every()
+        self.awaiting = None                        # coroutines returned by "async def" callbacks, a list while runtime.Runtime runs
+        self.state = None
+        self.index = -1                             # index of the current state in the tables below
+
+        # Dispatch tables compiled from the spec (see compile_spec), everything is looked up by state index
+        tables = compile_spec(MACHINE_SPEC if spec is None else spec, hal)
+        self.names = tables['names']
+        self.index_of = tables['index_of']
+        self.states = tables['states']              # name -> state object
+        self.objects = tables['objects']
+        self.enters = tables['enters']              # bound enter/exit methods, resolved once
+        self.exits = tables['exits']
+        self.screens = tables['screens']            # screen select output of each state, or None
+        self.screen_ids = tables['screen_ids']      # screen id of each state, what the screen link sends (0 blanks)
+        self.shown = self.screen_ids if getattr(self.display, 'by_id', False) else self.screens     # what display.show() gets
+        self.events = tables['events']              # number of events, row width of the transition table
+        self.event_of = tables['event_of']          # event name -> number, switches first, then the spec's timers
+        self.table = tables['table']                # target index for [state * events + event], -1 for none
+        self.hooks = tables['hooks']                # method of the current state to call before that transition, or None
+        self.hook_actions = tables['hook_actions']  # session action after that hook (see BEGIN), 0 for none
+        self.start_index = tables['start']
+
+    def start(self):                                # Enters the start state of the spec
+        self.go_to_index(self.start_index)
+
+    def go_to_state(self, state_name):              # "go to state" attribute, facilittes transition to other states. Traces the transition at DEBUG level
+        self.go_to_index(self.index_of[state_name])
+
+    def go_to_index(self, target):                  # Transition by table index, no name lookups on the way
+        if self.state:
+            self.tracer.emit(EXIT, self.index)
+            done = self.exits[self.index](self)
+            if done is not None:
+                self.later(done)
+        self.index = target
+        self.state = self.objects[target]
+        self.display.show(self.shown[target])       # the driver signals the epaper microcontroller once requests settle
+        self.tracer.emit(ENTER, target)
+        done = self.enters[target](self)
+        if done is not None:
+            self.later(done)
+        if self.checkpoint is not None:
+            self.checkpoint.save(self)
+
+    def later(self, coroutine):                     # A callback was "async def": the runtime awaits it once the transition is done
+        if self.awaiting is None:
+            coroutine.close()
+            raise TypeError('async callbacks need runtime.Runtime (ASYNC_RUNTIME in code.py)')
+        self.awaiting.append(coroutine)
+
+    def resume(self, target):                       # Boot back into state "target" from a checkpoint, its screen without enter()
+        self.index = target
+        self.state = self.objects[target]
+        self.display.show(self.shown[target])
+        self.tracer.emit(RESUMED, target)
+
+    def pressed(self):                              # "button pressed" attribute. Accessed at the end of each loop after hal.scan(), applies a pause between scans
+        if self.state:
+            fell = self.hal.scanner.fell            # every switch pressed on this scan, one bit each
+            key = 0
+            while fell:                             # nothing to do on a scan without presses, however many switches
+                if fell & 1:
+                    self.tracer.emit(PRESS, key, self.index)
+                    self.dispatch(key, True)
+                fell >>= 1
+                key += 1
+            #print("'StateMachine' Class occurrence")  # Use this print statement to understand how the states transition here to update the state in the serial monitor
+            self.hal.sleep(self.hal.scan_interval)  # Pause between scans, the scanner's debounce counts in scans
+
+    # Event driven mode: instead of scanning the switches and sleeping between scans,
+    # edges come out of the HAL's event queue (keypad on the board) and go straight to the table.
+
+    def dispatch(self, key_number, pressed):        # One switch edge, one lookup in the transition table
+        if not pressed or self.state is None:
+            return
+        at = self.index * self.events + key_number
+        target = self.table[at]
+        if target >= 0:
+            hook = self.hooks[at]
+            if hook is not None:
+                done = hook(self)
+                if done is not None:
+                    self.later(done)
+                if self.hook_actions[at]:
+                    self.act(self.hook_actions[at])
+            self.go_to_index(target)
+
+    def run_events(self, timeout):
+        """Dispatch every queued input event, idling up to "timeout" seconds first when none is waiting."""
+        event = self.hal.get_event()
+        if event is None:
+            due = self.timers.next_due()
+            if due is not None:
+                timeout = max(0.0, min(timeout, due - self.hal.monotonic()))
+            self.hal.wait(timeout)
+            event = self.hal.get_event()
+        while event is not None:
+            self.dispatch(event.key_number, event.pressed)
+            event = self.hal.get_event()
+
+    def run_tickless(self, longest=60.0):
+        """run_events() for battery life: sleeps until the next deadline (timers, screen lines, log flush, trace
+        output) or a switch press, at most "longest" seconds, so the wakeups follow the activity, not a tick."""
+        event = self.hal.get_event()
+        if event is None:
+            now = self.hal.monotonic()
+            due = self.next_due()
+            self.hal.sleep_until(now + longest if due is None else min(due, now + longest))
+            event = self.hal.get_event()
+        while event is not None:
+            self.dispatch(event.key_number, event.pressed)
+            event = self.hal.get_event()
+
+    def next_due(self):                             # hal.monotonic() of the earliest thing poll() has to do, None when nothing waits
+        due = None
+        for part in (self.timers, self.display, self.stamp_log, self.session_log, self.tracer):
+            when = part.next_due() if part is not None else None
+            if when is not None and (due is None or when < due):
+                due = when
+        return due
+
+    def after(self, seconds, event):                # One shot timer, the spec's timer "event" is dispatched like a switch press
+        return self.timers.add(seconds, self.event_of[event])
+
+    def every(self, seconds, callback):             # Periodic timer calling "callback"
+        return self.timers.add(seconds, callback=callback, period=seconds)
+
+    def cancel(self, timer):
+        self.timers.cancel(timer)
+
+    def fire(self, timer):                          # A timer came due
+        if timer.callback is not None:
+            timer.callback()
+        else:
+            self.dispatch(timer.event, True)
+
+    def poll(self):                                 # Call once per loop: timers, screen output and the buffered logs
+        self.timers.expire(self.fire)
+        self.display.poll()
+        self.stamp_log.poll()
+        if self.session_log is not None:
+            self.session_log.poll()
+        self.service()
+
+    def service(self):                              # Trace output and serial monitor commands, part of poll()
+        self.tracer.poll()
+        letter = self.hal.serial_command()
+        if letter is not None:
+            command = self.commands.get(letter)
+            if command is not None:
+                command()
+
+    def screen_fields(self):                        # Live data of the current screen for screenlink.ScreenLink
+        return self.state.fields(self) if self.state is not None else ()
+
+    def act(self, action):                          # One session action (BEGIN, END, LOG_NOTE, LOG_NO_NOTE) of the current state
+        session = self.session
+        if action == BEGIN:
+            session.begin(self.time_source.now(), self.state.task)
+        elif action == END:
+            session.end(self.time_source.now())     # the session goes into the history and today's total
+        else:
+            if action == LOG_NOTE:
+                session.noted()
+            self.log_session(session.task, action == LOG_NOTE)
+
+    def log_session(self, task, note):              # Binary log mode: one record per finished session
+        if self.session_log is not None:
+            self.session_log.append(self.session.start, self.session.stop, task, note)
+
+
+
+################################################################################
+# States
+
+# Abstract parent state class: I'm not 100% sure that this state is the "parent class" for the states below.
+# So far "StateMachine" appears to be the parent class, some clarification is needed to indentify how a class is called by "super().__init__()" (aka "Inheritance")
+
+class State(object):
+
+    # Session bookkeeping, run by enter()/exit() here and read by fleet.py which runs many machines without them.
+    # A state holds no per machine data, that lives on the machine (or in fleet.py's columns)
+    on_enter = 0                # session action on entry (BEGIN, END ...), 0 for none
+    on_exit = 0                 # session action on exit
+    hook_actions = {}           # hook name -> session action after that hook
+    task = 0                    # task id a session started in this state is logged under
+    resumable = False           # a reset in this state comes back up in it (checkpoint.py), see restore()
+
+    @property
+    def name(self):             # Attribute. Only the name is returned in states below. The State object shouldn't be called and returns nothing
+        return ''
+
+    def enter(self, machine):   # Class Attribute. Does what is commanded when the state is entered
+        if self.on_enter:
+            machine.act(self.on_enter)
+
+    def exit(self, machine):    # Class Attribute. Does what is commanded when exiting the state
+        if self.on_exit:
+            machine.act(self.on_exit)
+
+    def fields(self, machine):  # Live data for the screen as (field, text) pairs, sent over the screen link (see screenlink.py)
+        return ()
+
+    def restore(self, machine): # The machine resumed in this state after a reset (see checkpoint.py), called once the SD card is up
+        pass
+
+
+########################################
+# This state is active when powered on and other states return here
+class Home(State):
+
+    def __init__(self):
+        super().__init__()          # Child class inheritance
+
+    @property
+    def name(self):
+        return 'Home'
+
+    def enter(self, machine):
+        State.enter(self, machine)
+        # Display a screen for the "Home" State, or enable a pin that displays the "Home" screen
+        machine.tracer.emit(HEADER, machine.index)
+        machine.tracer.emit(PLACEHOLDER, DATE_AND_TIME)
+
+    def exit(self, machine):
+        State.exit(self, machine)
+
+    def fields(self, machine):
+        return ((DATE_TIME, date_time(machine.time_source.now())),)
+
+
+########################################
+# The "Profile 1" state. Either choose to track a task or use a focus timer.
+class Profile1(State):
+
+    def __init__(self):
+        super().__init__()
+
+
+    @property
+    def name(self):
+        return 'Profile 1'
+
+    def enter(self, machine):
+        State.enter(self, machine)
+        machine.tracer.emit(HEADER, machine.index)
+        machine.tracer.emit(PLACEHOLDER, DATE_AND_TIME)
+
+    def exit(self, machine):
+        State.exit(self, machine)
+
+    def fields(self, machine):
+        return ((DATE_TIME, date_time(machine.time_source.now())),)
+
+
+########################################
+# The "Tracking 1" state. Begin tracking task 1 in this state
+class Tracking1(State):
+
+    on_enter = BEGIN
+    task = 1
+    resumable = True
+
+    def __init__(self):
+        super().__init__()
+
+
+    @property
+    def name(self):
+        return 'Tracking1'
+
+    def enter(self, machine):
+        State.enter(self, machine)      # the tracking START time-stamp, in the machine's session store so the states after this one see it
+        machine.tracer.emit(HEADER, machine.index)
+        machine.tracer.emit(PLACEHOLDER, DATE_AND_TIME)
+        machine.tracer.emit(PLACEHOLDER, TRACKED_COUNTER)
+
+        now = machine.session.start
+        machine.tracer.stamp(STAMP_IN, now)
+        t = machine.clock               # split into the machine's preallocated fields for the log text
+        civil(now, t)
+
+        if machine.session_log is None:
+            # queue the entry for the SD card, formatted straight into the log's buffer (see sdlog.py)
+            f = machine.stamp_log
+            f.write_date(t)             # Common U.S. date format
+            f.write_clock(t)            # "Time in" written to file
+
+        # To verify the last entries, a RotatingLog reads them back from the end of the file (see logrotate.py)
+        #print(machine.stamp_log.tail(3))
+
+    def exit(self, machine):
+        State.exit(self, machine)
+        # Experiment clearing the Epaper Screen in this 'exit' attribute
+
+    def restore(self, machine):
+        _relog(machine, False)
+
+    def fields(self, machine):                      # the tracked time counter
+        now = machine.time_source.now()
+        return ((DATE_TIME, date_time(now)), (ELAPSED, duration(machine.session.elapsed(now))),
+                (TODAY, duration(machine.session.today(now))))
+
+
+########################################
+# The "Focus Timer 1" state. Begin the focus timer here
+class FocusTimer1(State):
+
+    length = 25 * 60            # focus timer length, seconds
+    resumable = True
+
+    def __init__(self):
+        super().__init__()
+
+
+    @property
+    def name(self):
+        return 'Focus Timer 1'
+
+
+    def enter(self, machine):
+        State.enter(self, machine)
+        machine.tracer.emit(HEADER, machine.index)
+        machine.tracer.emit(PLACEHOLDER, FOCUS_COUNTDOWN)
+        machine.tracer.emit(PLACEHOLDER, DATE_AND_TIME)
+        machine.tracer.emit(PLACEHOLDER, AH_AH_AH)
+        # Display a screen for "Focus Timer 1" state, or enable a pin that displays the "Focus Timer 1" screen
+        machine.timer_start = machine.time_source.now()     # on the machine so a checkpoint keeps it
+        machine.focus_timer = machine.after(self.length, 'focus_done')
+
+    def exit(self, machine):
+        State.exit(self, machine)
+        machine.cancel(machine.focus_timer)
+
+    def restore(self, machine):                     # the time left after the reset
+        machine.focus_timer = machine.after(max(0, self.length - (machine.time_source.now() - machine.timer_start)), 'focus_done')
+
+    def fields(self, machine):                      # the countdown
+        now = machine.time_source.now()
+        return ((DATE_TIME, date_time(now)), (REMAINING, duration(self.length - (now - machine.timer_start) + 59)))   # whole minutes left, rounded up
+
+
+
+########################################
+# The "Profile 2" state. Implement at a later date. Any button press in this state causes a transition to the "Home" state.
+class Profile2(State):
+
+    def __init__(self):
+        super().__init__()
+
+
+    @property
+    def name(self):
+        return 'Profile 2'
+
+    def enter(self, machine):
+        State.enter(self, machine)
+        machine.tracer.emit(HEADER, machine.index)
+        machine.tracer.emit(PLACEHOLDER, PROFILE2_SCREEN)
+        machine.tracer.emit(PLACEHOLDER, AH_AH_AH)
+
+    def exit(self, machine):
+        State.exit(self, machine)
+
+
+
+########################################
+# The "Voice Note" state. A placeholder state that has an option to record a voice note or return to the "home" state
+class VoiceNote(State):
+
+    on_enter = END
+    hook_actions = {'no_note': LOG_NO_NOTE}
+    resumable = True
+
+    def __init__(self):
+        super().__init__()
+
+
+    @property
+    def name(self):
+        return 'Voice Note'
+
+    def enter(self, machine):
+        State.enter(self, machine)      # Tracking1 has ended, the time out stamp is taken upon entry
+
+        #Screen Placeholders
+        machine.tracer.emit(HEADER, machine.index)
+        machine.tracer.emit(PLACEHOLDER, YES_OR_NO)
+
+        now = machine.session.stop
+        machine.tracer.stamp(STAMP_OUT, now)
+        t = machine.clock
+        civil(now, t)
+
+        if machine.session_log is None:
+            # queue the entry for the SD card, formatted straight into the log's buffer (see sdlog.py)
+            f = machine.stamp_log
+            #f.write_date(t)            # Common U.S. date format
+
+            f.write_clock(t)            # "Time out" written to file
+
+        # To verify the last entries, a RotatingLog reads them back from the end of the file (see logrotate.py)
+        #print(machine.stamp_log.tail(3))
+
+
+
+    def exit(self, machine):
+        State.exit(self, machine)
+        # Trace the time stamps upon exit
+        machine.tracer.stamp(SESSION, machine.session.start, machine.session.stop)
+
+    def restore(self, machine):
+        _relog(machine, True)
+
+    def no_note(self, machine):                     # "No" was pressed, the session ends without a note (LOG_NO_NOTE)
+        machine.tracer.emit(NO_NOTE)
+
+
+########################################
+# The "Record Note" state. A placeholder state that will record a note then transition to the "home" state
+# Constains an easter egg photo
+class Record(State):
+
+    on_exit = LOG_NOTE
+    resumable = True
+
+    def __init__(self):
+        super().__init__()
+
+
+    @property
+    def name(self):
+        return 'Record'
+
+    def enter(self, machine):
+        State.enter(self, machine)
+        machine.tracer.emit(HEADER, machine.index)
+        machine.tracer.emit(PLACEHOLDER, SECOND_SEMESTER)
+
+        # Trace the time stamps about to be recorded
+        machine.tracer.stamp(SESSION, machine.session.start, machine.session.stop)
+
+    def restore(self, machine):
+        _relog(machine, True)
+
+    def exit(self, machine):
+        State.exit(self, machine)       # the session ends with a voice note (LOG_NOTE)
+
+        machine.tracer.emit(NOTE)
+        if machine.session_log is not None:
+            return                      # logged as a binary record
+
+        # queue the entry for the SD card, the buffered log writes it out in batches (see sdlog.py)
+        f = machine.stamp_log
+        f.write(b"Delta Formula, Speech to text voice note\r\n")     # a bytes constant, written without encoding a copy
+        #f.write(None, None, None, "sum(d2:d)\r\n",None)    #THERE IS PROBABLY AN ERROR HERE, In Excel you can't really sum items separated by ":"
+
+        # To verify the last entries, a RotatingLog reads them back from the end of the file (see logrotate.py)
+        #print(machine.stamp_log.tail(3))
+
+
+        #The time difference is machine.session.elapsed(0) now (stop minus start, across midnight too) and
+        #machine.session.today(now) the day's sum, the spreadsheet's Total column can stay a formula
+
+
+
+def _relog(machine, stopped):
+    """After a resume, queue again the parts of the open session's stamp.csv row that never reached the card
+    (the time in, and the time out once "stopped"). The log's tail tells what is there, nothing is rescanned."""
+    if machine.session_log is not None or not hasattr(machine.stamp_log, 'tail'):
+        return
+    t = machine.clock                               # the same calendar the stamps were written with
+    civil(machine.session.start, t)
+    date = "%d/%d/%d" % (t[0], t[1], t[2])
+    time_in = "%d:%02d:%02d" % (t[3], t[4], t[5])
+    sessions = machine.stamp_log.tail(1)
+    last = sessions[-1] if sessions else None
+    if last is None or last[0] != date or last[1] != time_in:
+        machine.stamp_log.write_date(t)
+        machine.stamp_log.write_clock(t)
+        last = None
+    if stopped and (last is None or last[2] is None):
+        civil(machine.session.stop, t)
+        machine.stamp_log.write_clock(t)
+
+
+########################################
+# A state with no behaviour of its own, it only shows its screen. Used for spec entries without a "class",
+# so more profiles can be added to MACHINE_SPEC without writing new classes.
+class ScreenState(State):
+
+    def __init__(self, name, lines=()):
+        super().__init__()
+        self._name = name
+        self.lines = tuple(lines)                   # traced on entry
+
+    @property
+    def name(self):
+        return self._name
+
+    def enter(self, machine):
+        State.enter(self, machine)
+        machine.tracer.emit(HEADER, machine.index)
+        if self.lines:
+            machine.tracer.emit(SCREEN_TEXT, machine.index)
+
+    def fields(self, machine):
+        return ((TEXT, '\n'.join(self.lines)),) if self.lines else ()
+
+
+# Classes a spec can name in its "class" field
+STATE_CLASSES = {
+    'Home': Home,
+    'Profile1': Profile1,
+    'Tracking1': Tracking1,
+    'FocusTimer1': FocusTimer1,
+    'Profile2': Profile2,
+    'VoiceNote': VoiceNote,
+    'Record': Record,
+}
+
+
+################################################################################
+# Declarative machine spec
+# Every state lists the screen output it asserts and, for each event, the state it goes to. A target can also be
+# [target, hook] to call a method of the current state just before the transition. The same layout can be kept
+# in a JSON file and read with load_spec().
+
+MACHINE_SPEC = {
+    'start': 'Home',
+    'events': ['switch_1', 'switch_2'],             # in the order of hal.switches
+    'timers': ['focus_done'],                       # timeout events, fired by StateMachine.after()
+    'states': {
+        'Home':          {'class': 'Home',        'screen': 'home_scrn',
+                          'on': {'switch_1': 'Profile 1', 'switch_2': 'Profile 2'}},
+        'Profile 1':     {'class': 'Profile1',    'screen': 'profile1_scrn',
+                          'on': {'switch_1': 'Tracking1', 'switch_2': 'Focus Timer 1'}},
+        'Tracking1':     {'class': 'Tracking1',   'screen': 'track1_scrn',
+                          'on': {'switch_1': 'Voice Note', 'switch_2': 'Voice Note'}},
+        'Focus Timer 1': {'class': 'FocusTimer1', 'screen': 'focus1_scrn',
+                          'on': {'switch_1': 'Home', 'switch_2': 'Home', 'focus_done': 'Home'}},     # Question: Perhaps a transition to "Profile1" is more appropriate?
+        'Profile 2':     {'class': 'Profile2',    'screen': 'profile2_scrn',
+                          'on': {'switch_1': 'Home', 'switch_2': 'Home'}},     # further profiles will be implemented in the future
+        'Voice Note':    {'class': 'VoiceNote',   'screen': 'voicenote_scrn',
+                          'on': {'switch_1': 'Record', 'switch_2': ['Home', 'no_note']}},
+        'Record':        {'class': 'Record',      'screen': 'record_scrn',
+                          'on': {'switch_1': 'Home', 'switch_2': 'Home'}},
+    },
+}
+
+
+def load_spec(path):
+    """Read a machine spec from a JSON file laid out like MACHINE_SPEC. A name given twice (a state, an event
+    in "on") raises ValueError instead of the last one silently winning."""
+    with open(path, "r") as f:
+        text = f.read()
+    try:
+        return json.loads(text, object_pairs_hook=_unique)
+    except TypeError:                               # CircuitPython's json takes no hooks, checked on the PC only
+        return json.loads(text)
+
+
+def _unique(pairs):
+    spec = {}
+    for key, value in pairs:
+        if key in spec:
+            raise ValueError('bad state machine spec:\n  "%s" is defined twice' % key)
+        spec[key] = value
+    return spec
+
+
+def compile_spec(spec, hal, classes=None):
+    """Validate a machine spec and build the integer indexed tables StateMachine runs on.
+
+    Every problem found (unknown targets, events, classes, hooks or screen outputs, events named
+    twice, bad screen ids, states that can't be reached from the start state) is collected and
+    raised together as one ValueError.
+    With hal=None the screen outputs and switch count are not checked.
+
+    Screen ids (for the screen link) are the state's "screen_id" if it has one, else 1..7 for the
+    outputs in hal.SCREENS order, else the next free id for a spec-only screen, 0 for no screen.
+    """
+    classes = STATE_CLASSES if classes is None else classes
+    errors = []
+    events = list(spec.get('events', ()))
+    if hal is not None and len(events) > len(hal.switches):
+        errors.append('%d events but the hardware has %d switches' % (len(events), len(hal.switches)))
+    events += spec.get('timers', ())              # timer events are numbered after the switches
+    event_index = dict((event, i) for i, event in enumerate(events))
+    for event in event_index:
+        if events.count(event) > 1:
+            errors.append('event "%s" is defined %d times' % (event, events.count(event)))
+    names = list(spec.get('states', {}))
+    index_of = dict((name, i) for i, name in enumerate(names))
+    start = spec.get('start')
+    if start not in index_of:
+        errors.append('start state "%s" is not defined' % start)
+
+    objects = []
+    screens = []
+    screen_ids = array.array('B', [0] * len(names))
+    outputs = [output for output, _ in SCREENS]
+    taken = set()
+    for i, name in enumerate(names):
+        screen_id = spec['states'][name].get('screen_id')
+        if screen_id is not None:
+            if not isinstance(screen_id, int) or not 0 < screen_id < 256:
+                errors.append('%s: screen id %r is not 1..255' % (name, screen_id))
+            else:
+                screen_ids[i] = screen_id
+                taken.add(screen_id)
+    next_id = len(outputs) + 1
+    for i, name in enumerate(names):
+        entry = spec['states'][name]
+        class_name = entry.get('class')
+        if class_name is None:
+            state = ScreenState(name, entry.get('print', ()))
+        elif class_name in classes:
+            state = classes[class_name]()
+            if state.name != name:
+                errors.append('%s: class %s is named "%s"' % (name, class_name, state.name))
+        else:
+            errors.append('%s: unknown class %s' % (name, class_name))
+            state = ScreenState(name)
+        objects.append(state)
+        screen = entry.get('screen')
+        if hal is None:                             # compiling without hardware (fleet.py), nothing to check the outputs against
+            screen = None
+        elif screen is not None and not hasattr(hal, screen):
+            errors.append('%s: no screen output "%s"' % (name, screen))
+            screen = None
+        screens.append(None if screen is None else getattr(hal, screen))
+        if screen_ids[i]:
+            continue
+        if entry.get('screen') in outputs:
+            screen_ids[i] = outputs.index(entry['screen']) + 1
+        elif class_name is None:                    # spec-only screen, drawn by the controller from its TEXT field
+            while next_id in taken:
+                next_id += 1
+            if next_id > 255:
+                errors.append('%s: no screen id left' % name)
+                continue
+            screen_ids[i] = next_id
+            taken.add(next_id)
+
+    width = len(events)
+    table = array.array('h', [-1] * (len(names) * width))
+    hooks = [None] * (len(names) * width)
+    hook_names = [None] * (len(names) * width)
+    hook_actions = array.array('B', [0] * (len(names) * width))
+    for i, name in enumerate(names):
+        for event, target in spec['states'][name].get('on', {}).items():
+            hook = None
+            if isinstance(target, (list, tuple)):
+                target, hook = target
+            if event not in event_index:
+                errors.append('%s: unknown event "%s"' % (name, event))
+                continue
+            if target not in index_of:
+                errors.append('%s: %s goes to unknown state "%s"' % (name, event, target))
+                continue
+            at = i * width + event_index[event]
+            table[at] = index_of[target]
+            if hook is not None:
+                if not callable(getattr(objects[i], hook, None)):
+                    errors.append('%s: unknown hook "%s"' % (name, hook))
+                else:
+                    hooks[at] = getattr(objects[i], hook)
+                    hook_names[at] = hook
+                    hook_actions[at] = objects[i].hook_actions.get(hook, 0)
+
+    if start in index_of:
+        seen = [False] * len(names)
+        todo = [index_of[start]]
+        while todo:
+            i = todo.pop()
+            if not seen[i]:
+                seen[i] = True
+                todo.extend(t for t in table[i * width:(i + 1) * width] if t >= 0)
+        for i, name in enumerate(names):
+            if not seen[i]:
+                errors.append('%s: unreachable from %s' % (name, start))
+
+    if errors:
+        raise ValueError('bad state machine spec:\n  ' + '\n  '.join(errors))
+    return {
+        'names': names,
+        'index_of': index_of,
+        'states': dict(zip(names, objects)),
+        'objects': objects,
+        'enters': [state.enter for state in objects],
+        'exits': [state.exit for state in objects],
+        'screens': screens,
+        'screen_ids': screen_ids,
+        'events': width,
+        'event_of': event_index,
+        'table': table,
+        'hooks': hooks,
+        'hook_names': hook_names,
+        'hook_actions': hook_actions,
+        'start': index_of.get(start, -1),
+    }
+
+
+################################################################################
+# Create the state machine
+
+def build_machine(hal, stamp_log=None, spec=None, display=None, time_source=None, tracer=None):
+    """Create the LTB state machine from the spec (MACHINE_SPEC by default), wired to the given hardware."""
+    return StateMachine(hal, stamp_log, spec, display, time_source, tracer)
@@ -0,0 +1,18 @@
+import os
+import time
+
+import pytest
+
+
+@pytest.fixture
+def new_york():
+    """Run the test with the PC in a time zone behind UTC, nothing the board writes may depend on it."""
+    old = os.environ.get('TZ')
+    os.environ['TZ'] = 'America/New_York'
+    time.tzset()
+    yield
+    if old is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = old
+    time.tzset()
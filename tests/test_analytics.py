@@ -0,0 +1,60 @@
+# Analytics over stamp.csv: sessions past midnight, a session cut by a rotation, lines longer than a read
+
+import numpy as np
+
+import analytics
+from analytics import DAY, daily_totals, read_rotated, read_stamp_csv
+
+HEADER = "Date, Time In, Time Out , Total, Voice Note\r\n"
+NOTE = "Delta Formula, Speech to text voice note\r\n"
+
+NOV_14 = int(np.datetime64('2023-11-14', 'D').astype(int))
+
+
+def write(path, text):
+    with open(str(path), 'w', newline='') as f:
+        f.write(text)
+    return str(path)
+
+
+def test_session_past_midnight_counts_towards_both_days(tmp_path):
+    log = write(tmp_path / 'stamp.csv', HEADER + "11/14/2023, 9:00:00, 10:00:00, " + NOTE +
+                "11/14/2023, 23:30:00, 0:45:00, 11/15/2023, 8:00:00, 8:30:00, ")
+    sessions = read_stamp_csv(log)
+    assert len(sessions) == 3
+    assert sessions.stop[1] - sessions.start[1] == 75 * 60
+    assert list(sessions.note) == [True, False, False]
+    days, seconds = daily_totals(sessions)
+    assert list(days) == [NOV_14, NOV_14 + 1]
+    assert list(seconds) == [3600 + 30 * 60, 45 * 60 + 30 * 60]
+
+
+def test_session_over_several_days():
+    sessions = analytics.Sessions([NOV_14 * DAY + 22 * 3600], [(NOV_14 + 2) * DAY + 3600], [1], [False], [0])
+    days, seconds = daily_totals(sessions)
+    assert list(days) == [NOV_14, NOV_14 + 1, NOV_14 + 2]
+    assert list(seconds) == [2 * 3600, DAY, 3600]
+
+
+def test_session_split_by_a_rotation(tmp_path):
+    # the batch closing off stamp.0001.csv ended after the time in, the time out went to the new active file
+    write(tmp_path / 'stamp.0001.csv', HEADER + "11/14/2023, 9:00:00, 10:00:00, " + NOTE + "11/14/2023, 23:30:00, ")
+    write(tmp_path / 'stamp.csv', HEADER + "0:45:00, " + NOTE + "11/15/2023, 8:00:00, 8:30:00, ")
+    manifest = write(tmp_path / 'stamp.man', "stamp.0001.csv,120,%d\n" % NOV_14)
+    sessions = read_rotated(manifest)
+    assert len(sessions) == 3
+    assert sessions.start[1] == NOV_14 * DAY + 23 * 3600 + 30 * 60
+    assert sessions.stop[1] == (NOV_14 + 1) * DAY + 45 * 60
+    assert bool(sessions.note[1])
+    assert list(daily_totals(sessions)[1]) == [3600 + 30 * 60, 45 * 60 + 30 * 60]
+
+
+def test_chunks_without_a_line_break(tmp_path, monkeypatch):
+    rows = "".join("11/%d/2023, 9:00:00, 9:%02d:00, " % (day, day) for day in range(1, 29))     # no notes, no line breaks
+    log = write(tmp_path / 'stamp.csv', HEADER + rows + "11/29/2023, 9:00:00, 10:00:00, " + NOTE + rows)
+    whole = read_stamp_csv(log)
+    monkeypatch.setattr(analytics, 'CHUNK', 7)
+    pieces = read_stamp_csv(log)
+    assert len(whole) == 57
+    for column in ('start', 'stop', 'note'):
+        assert list(getattr(pieces, column)) == list(getattr(whole, column))
@@ -0,0 +1,86 @@
+# NVM checkpoint ring: which transitions write, resume after a reset, torn and corrupt slots, sequence wrap
+
+from checkpoint import SLOT_SIZE, Checkpoint
+from hal_sim import SimHAL
+from state_machine import build_machine
+
+EPOCH = 1700000000
+
+
+def boot(nvm=None):
+    hw = SimHAL(epoch=EPOCH, nvm=nvm)
+    machine = build_machine(hw)
+    checkpoint = Checkpoint(hw)
+    resumed = checkpoint.restore(machine)
+    machine.checkpoint = checkpoint
+    if not resumed:
+        machine.start()
+    return hw, machine, checkpoint, resumed
+
+
+def walk(hw, machine, *states):
+    for name in states:
+        hw.clock.advance_to(hw.monotonic() + 60.0)
+        machine.go_to_state(name)
+
+
+def test_navigation_writes_nothing():
+    hw, machine, checkpoint, _ = boot()
+    walk(hw, machine, 'Profile 1', 'Home', 'Profile 2', 'Home', 'Profile 1')
+    assert checkpoint.saves == 0
+
+
+def test_one_write_per_session_state():
+    hw, machine, checkpoint, _ = boot()
+    walk(hw, machine, 'Profile 1', 'Tracking1', 'Voice Note', 'Record', 'Home')
+    assert checkpoint.saves == 4
+    walk(hw, machine, 'Profile 1', 'Focus Timer 1', 'Home', 'Profile 2', 'Home')
+    assert checkpoint.saves == 6
+
+
+def test_resume_in_tracking():
+    hw, machine, _, _ = boot()
+    walk(hw, machine, 'Profile 1', 'Tracking1')
+    start = machine.session.start
+    _, again, _, resumed = boot(hw.nvm)
+    assert resumed and again.state.name == 'Tracking1' and again.session.start == start
+
+
+def test_no_resume_after_the_session_ended():
+    hw, machine, _, _ = boot()
+    walk(hw, machine, 'Profile 1', 'Tracking1', 'Voice Note', 'Record', 'Home', 'Profile 1')
+    _, again, _, resumed = boot(hw.nvm)
+    assert not resumed and again.state.name == 'Home'
+
+
+def test_torn_slot_falls_back_to_the_previous_record():
+    hw, machine, checkpoint, _ = boot()
+    walk(hw, machine, 'Profile 1', 'Tracking1')
+    before = bytes(hw.nvm)
+    slot = checkpoint._slot
+    walk(hw, machine, 'Voice Note')
+    at = slot * SLOT_SIZE + SLOT_SIZE // 2
+    hw.nvm[at:(slot + 1) * SLOT_SIZE] = before[at:(slot + 1) * SLOT_SIZE]     # the cut came halfway through the write
+    _, again, _, resumed = boot(hw.nvm)
+    assert resumed and again.state.name == 'Tracking1'
+
+
+def test_corrupt_slots_are_skipped():
+    hw, machine, checkpoint, _ = boot()
+    walk(hw, machine, 'Profile 1', 'Tracking1', 'Voice Note')
+    newest = (checkpoint._slot - 1) % checkpoint.slots
+    hw.nvm[newest * SLOT_SIZE + 3] ^= 0x40
+    assert boot(bytearray(hw.nvm))[1].state.name == 'Tracking1'
+    for slot in range(checkpoint.slots):
+        hw.nvm[slot * SLOT_SIZE] ^= 0x01
+    _, again, _, resumed = boot(hw.nvm)
+    assert not resumed and again.state.name == 'Home'
+
+
+def test_sequence_wraps():
+    hw, machine, checkpoint, _ = boot()
+    checkpoint._seq = 0xfffe
+    walk(hw, machine, 'Profile 1', 'Tracking1', 'Voice Note', 'Record')
+    assert checkpoint._seq == 1
+    _, again, _, resumed = boot(hw.nvm)
+    assert resumed and again.state.name == 'Record'
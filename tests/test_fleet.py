@@ -0,0 +1,68 @@
+# Fleet against StateMachine: the same keys give the same states and the same logged sessions
+
+from fleet import Fleet
+from hal_sim import SimHAL
+from state_machine import build_machine
+
+EPOCH = 1700000000
+SW1, SW2, FOCUS_DONE = 0, 1, 2
+
+# (seconds after the previous key, key): a session with a voice note, one without, a focus timer that runs
+# out, one cut short, and a session across midnight
+KEYS = [
+    (5, SW1), (10, SW1), (1500, SW1), (20, SW1), (30, SW1),
+    (60, SW1), (3, SW1), (900, SW1), (4, SW2),
+    (7, SW1), (8, SW2), (1500, FOCUS_DONE),
+    (2, SW1), (2, SW2), (60, SW1),
+    (9, SW2), (6, SW2),
+    (40000, SW1), (2, SW1), (50000, SW2), (1, SW2),
+]
+
+
+class Sessions(object):
+    """Stands in for sessionlog.SessionLog, keeps the records in a list."""
+
+    def __init__(self):
+        self.records = []
+
+    def append(self, start, stop, task, note):
+        self.records.append((start, stop, task, note))
+
+    def poll(self):
+        pass
+
+    def next_due(self):
+        return None
+
+
+def test_fleet_logs_the_sessions_the_state_machine_logs():
+    hw = SimHAL(epoch=EPOCH)
+    machine = build_machine(hw)
+    machine.session_log = Sessions()
+    machine.start()
+    fleet_sessions = []
+    fleet = Fleet(3, sink=lambda m, start, stop, task, note: fleet_sessions.append((m, start, stop, task, note)))
+
+    for wait, key in KEYS:
+        hw.clock.advance_to(hw.monotonic() + wait)
+        now = machine.time_source.now()
+        machine.dispatch(key, True)
+        fleet.dispatch(1, key, now)
+        assert fleet.state_name(1) == machine.state.name
+
+    assert [record[3] for record in machine.session_log.records] == [True, False, False]
+    assert fleet_sessions == [(1,) + record for record in machine.session_log.records]
+    assert fleet.state_name(0) == fleet.state_name(2) == 'Home'
+
+
+def test_batch_dispatch_matches_single_dispatch():
+    one, batch = [], []
+    single = Fleet(2, sink=lambda *session: one.append(session))
+    batched = Fleet(2, sink=lambda *session: batch.append(session))
+    now = EPOCH
+    for wait, key in KEYS:
+        now += wait
+        single.dispatch(0, key, now)
+        single.dispatch(1, key, now)
+        batched.dispatch_batch([0, 1], [key, key], now)
+    assert one == batch and len(one) == 6
@@ -0,0 +1,53 @@
+# ingest.py: sessions a log rotation cut in two, read in one run and across two runs
+
+import os
+
+import numpy as np
+
+from analytics import DAY
+from ingest import Store, ingest
+
+HEADER = "Date, Time In, Time Out , Total, Voice Note\r\n"
+NOTE = "Delta Formula, Speech to text voice note\r\n"
+
+NOV_14 = int(np.datetime64('2023-11-14', 'D').astype(int))
+LATE = NOV_14 * DAY + 23 * 3600 + 30 * 60           # 11/14/2023 23:30:00
+
+
+def write(folder, name, text):
+    if not os.path.isdir(str(folder)):
+        os.makedirs(str(folder))
+    with open(os.path.join(str(folder), name), 'w', newline='') as f:
+        f.write(text)
+
+
+def sessions(store):
+    s = Store(str(store)).sessions()
+    return [(int(start), int(stop), bool(note)) for start, stop, note in zip(s.start, s.stop, s.note)]
+
+
+def test_session_split_across_segments(tmp_path):
+    device = tmp_path / 'logs' / 'desk1'
+    write(device, 'stamp.0001.csv', HEADER + "11/14/2023, 9:00:00, 10:00:00, " + NOTE + "11/14/2023, 23:30:00, ")
+    write(device, 'stamp.0002.csv', HEADER + "0:45:00, " + NOTE + "11/15/2023, 8:00:00, 8:30:00, ")
+    write(device, 'stamp.csv', HEADER + NOTE + "11/15/2023, 9:00:00, ")    # the note of the last segment's session
+    ingest(str(tmp_path / 'store'), [str(tmp_path / 'logs')], workers=1)
+    assert sessions(tmp_path / 'store') == [
+        (NOV_14 * DAY + 9 * 3600, NOV_14 * DAY + 10 * 3600, True),
+        (LATE, (NOV_14 + 1) * DAY + 45 * 60, True),
+        ((NOV_14 + 1) * DAY + 8 * 3600, (NOV_14 + 1) * DAY + 8 * 3600 + 30 * 60, True),
+    ]
+
+
+def test_session_split_by_a_rotation_between_runs(tmp_path):
+    device = tmp_path / 'logs' / 'desk1'
+    store = str(tmp_path / 'store')
+    write(device, 'stamp.csv', HEADER + "11/14/2023, 9:00:00, 10:00:00, " + NOTE + "11/14/2023, 23:30:00, ")
+    ingest(store, [str(tmp_path / 'logs')], workers=1)
+    assert len(sessions(tmp_path / 'store')) == 1
+
+    os.rename(str(device / 'stamp.csv'), str(device / 'stamp.0001.csv'))    # rotated with nothing added
+    write(device, 'stamp.csv', HEADER + "0:45:00, ")
+    parsed, _, skipped = ingest(store, [str(tmp_path / 'logs')], workers=1)
+    assert (parsed, skipped) == (1, 1)
+    assert sessions(tmp_path / 'store')[1] == (LATE, (NOV_14 + 1) * DAY + 45 * 60, False)
@@ -0,0 +1,135 @@
+# RotatingLog: rotation, the manifest, recovery of a rotation or compaction a power cut stopped, tail reads
+
+import pytest
+
+from hal_sim import SimHAL
+from logrotate import RotatingLog
+
+HEADER = b"Date, Time In, Time Out , Total, Voice Note\r\n"
+
+
+class PowerCut(Exception):
+    pass
+
+
+def session(n):                             # one whole stamp.csv row, 72 bytes
+    return "1/%d/2024, 9:00:00, 10:00:00, Delta Formula, Speech to text voice note\r\n" % (n % 28 + 1)
+
+
+def new_log(hw, max_bytes=256):
+    log = RotatingLog(hw, max_bytes=max_bytes, header=HEADER)
+    log.recover()
+    return log
+
+
+def fill(log, first, count):
+    for n in range(first, first + count):
+        log.write(session(n))
+        log.flush()
+
+
+def test_rotation_lists_segments_in_the_manifest():
+    hw = SimHAL()
+    log = new_log(hw)
+    fill(log, 0, 10)
+    segments = log.segments()
+    assert [name for name, _, _ in segments] == ['stamp.%04d.csv' % n for n in range(1, len(segments) + 1)]
+    for name, size, _ in segments:
+        assert hw.size(name) == size <= 256
+        assert hw.fs.files[name].startswith(HEADER)
+    assert log.names()[-1] == 'stamp.csv'
+    assert hw.fs.files['stamp.csv'].startswith(HEADER)
+
+
+def test_cut_between_manifest_and_rename():
+    hw = SimHAL()
+    log = new_log(hw)
+    fill(log, 0, 2)
+    before = hw.fs.files['stamp.csv']
+    rename = hw.rename
+
+    def cut(old, new):
+        raise PowerCut(old)
+    hw.rename = cut
+    log.write(session(2))                   # the third row doesn't fit in 256 bytes
+    with pytest.raises(PowerCut):
+        log.flush()                         # the manifest lists the segment, stamp.csv still holds it
+    hw.rename = rename
+
+    log = new_log(hw)                       # next boot
+    name, size, _ = log.segments()[-1]
+    assert hw.fs.files[name] == before and size == len(before)
+    assert hw.fs.files['stamp.csv'] == HEADER
+    log.write(session(2))
+    log.flush()
+    assert hw.fs.files['stamp.csv'] == HEADER + session(2).encode()
+
+
+def test_manifest_line_without_a_file_is_forgotten():
+    hw = SimHAL()
+    log = new_log(hw)
+    fill(log, 0, 6)
+    segments = log.segments()
+    del hw.fs.files['stamp.csv']
+    hw.fs.files['stamp.man'] += b'stamp.%04d.csv,100,-1\n' % (len(segments) + 1)
+
+    log = new_log(hw)
+    assert log.segments() == segments
+
+
+def test_compaction_cut_before_the_manifest_swap():
+    hw = SimHAL()
+    log = new_log(hw)
+    fill(log, 0, 20)
+    segments = log.segments()
+    remove = hw.remove
+
+    def cut(name):
+        raise PowerCut(name)
+    hw.remove = cut
+    with pytest.raises(PowerCut):
+        log.compact(keep=1)                 # the new manifest is written under its temporary name
+    hw.remove = remove
+
+    log = new_log(hw)
+    assert log.segments() == segments       # the old manifest still stands, the temporary one is dropped
+    assert hw.size('stamp.man.tmp') is None
+
+
+def test_compaction_cut_after_the_old_manifest_went():
+    hw = SimHAL()
+    log = new_log(hw)
+    fill(log, 0, 20)
+    rename = hw.rename
+
+    def cut(old, new):
+        raise PowerCut(old)
+    hw.rename = cut
+    with pytest.raises(PowerCut):
+        log.compact(keep=1)
+    hw.rename = rename
+    assert hw.size('stamp.man') is None
+
+    log = new_log(hw)
+    segments = log.segments()
+    assert len(segments) == 2 and '-' in segments[0][0]
+    assert b''.join(hw.fs.files[name] for name in log.names()).count(b'/2024') == 20
+
+
+def test_tail_reads_across_segments():
+    hw = SimHAL()
+    log = new_log(hw)
+    fill(log, 0, 12)
+    log.write(session(12))                  # still in RAM
+    assert [s[0] for s in log.tail(5)] == ['1/%d/2024' % (n + 1) for n in range(8, 13)]
+
+
+def test_read_rotated(tmp_path):
+    np = pytest.importorskip('numpy')
+    from analytics import read_rotated
+    hw = SimHAL(sd_path=str(tmp_path))
+    log = new_log(hw)
+    fill(log, 0, 12)
+    sessions = read_rotated(str(tmp_path / 'stamp.man'))
+    assert len(sessions.start) == 12
+    assert np.all(sessions.stop - sessions.start == 3600)
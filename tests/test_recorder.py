@@ -0,0 +1,50 @@
+# Recorder round trip: a scripted run recorded through RecordingHAL replays with the same pins and files
+
+import io
+
+from hal_sim import SimHAL
+from recorder import RecordingHAL, Trace, diff, replay
+from startup import boot
+
+CONFIG = {'events': True, 'tick': 0.005, 'pulse': 0.05, 'settle': 0.25, 'reassert': 180.0, 'flush': 10.0}
+
+# (seconds, switch): a session with a voice note, one without, a focus timer cut short and Profile 2, then
+# idle past two screen reasserts
+TAPS = [
+    (2.0, 0), (5.0, 0), (40.0, 0), (45.0, 0), (50.0, 0),
+    (60.0, 0), (63.0, 0), (150.0, 0), (154.0, 1),
+    (160.0, 0), (170.0, 1), (230.0, 0),
+    (240.0, 1), (246.0, 1),
+]
+
+
+def record(until=650.0):
+    hw = SimHAL(epoch=1700000000)
+    for at, key in TAPS:
+        hw.switches[key].tap(at, 0.12)
+    out = io.BytesIO()
+    machine = boot(RecordingHAL(hw, out, CONFIG), CONFIG)
+    while hw.clock.now < until:
+        machine.run_events(CONFIG['tick'])
+        machine.poll()
+    return Trace(out.getvalue())
+
+
+def test_replay_matches_the_recording():
+    recorded = record()
+    assert len(recorded.pins()) > 20 and recorded.files()['stamp.csv'].count(b'\r\n') >= 2
+    for exact in (False, True):
+        replayed, _, _ = replay(recorded, exact)
+        same, lines = diff(recorded, replayed, until=recorded.duration)
+        assert same, lines
+
+
+def test_diff_reports_a_changed_file():
+    recorded = record()
+    replayed, _, _ = replay(recorded)
+    for i, (at, kind, a, value, payload) in enumerate(replayed.records):
+        if payload and b'voice note' in payload:
+            replayed.records[i] = (at, kind, a, value, payload.replace(b'voice note', b'voice memo'))
+            break
+    same, lines = diff(recorded, replayed, until=recorded.duration)
+    assert not same and any('differs at byte' in line for line in lines)
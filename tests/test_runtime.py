@@ -0,0 +1,103 @@
+# The asyncio runtime runs the same transitions, records and wrappers as the plain loops
+
+import asyncio
+
+import pytest
+
+from hal_sim import SimHAL
+from instrument import Instruments
+from runtime import Runtime
+from state_machine import build_machine
+from tracing import DEBUG, Tracer
+
+TICK = 0.005
+# Profile 1, Tracking1, Voice Note, Record, Home, then Profile 2 and back
+TAPS = [(1.0, 0), (3.0, 0), (10.0, 0), (12.0, 0), (14.0, 0), (16.0, 1), (18.0, 0)]
+# Three voice note sessions and one without a note, pressed as fast as the switches allow
+BURST = [(1.0 + 0.05 * i, 0) for i in range(15)] + [(2.0, 0), (2.05, 0), (2.1, 0), (2.15, 1)]
+
+
+def new_machine(taps=TAPS, hold=0.1):
+    hw = SimHAL(epoch=1700000000)
+    for at, key in taps:
+        hw.switches[key].tap(at, hold)
+    return hw, build_machine(hw, tracer=Tracer(hw, level=DEBUG))
+
+
+def run_sync(machine, hw, until, polled=False):
+    machine.start()
+    while hw.monotonic() < until:
+        if polled:
+            hw.scan()
+            machine.pressed()
+        else:
+            machine.run_events(TICK)
+        machine.poll()
+    machine.stamp_log.flush()
+
+
+def run_async(machine, hw, until, polled=False):
+    asyncio.run(Runtime(machine, tick=hw.scan_interval if polled else TICK, event_driven=not polled).run(until))
+    machine.stamp_log.flush()
+
+
+def trace(machine):                         # the records without their times
+    return [record[1:] for record in machine.tracer.records()]
+
+
+def test_same_records_and_log_as_the_plain_loop():
+    for polled in (False, True):
+        hw, machine = new_machine()
+        run_sync(machine, hw, 20.0, polled)
+        other_hw, other = new_machine()
+        run_async(other, other_hw, 20.0, polled)
+        assert trace(other) == trace(machine)
+        assert other.index == machine.index == machine.start_index
+        assert other_hw.fs.files['stamp.csv'] == hw.fs.files['stamp.csv']
+
+
+def test_stamps_in_order_during_a_burst():
+    hw, machine = new_machine(BURST, 0.02)
+    run_sync(machine, hw, 3.0)
+    other_hw, other = new_machine(BURST, 0.02)
+    run_async(other, other_hw, 3.0)
+    assert trace(other) == trace(machine)
+    assert hw.fs.files['stamp.csv'].count(b'Speech to text') == 3
+    assert other_hw.fs.files['stamp.csv'] == hw.fs.files['stamp.csv']
+
+
+def test_wrappers_see_async_transitions():
+    hw, machine = new_machine()
+    instruments = Instruments(machine)
+    instruments.attach()
+    run_async(machine, hw, 20.0)
+    assert instruments.transition.count == len(TAPS) + 1      # the start included
+    assert instruments.loops > 0
+
+
+def test_async_callbacks_are_awaited_in_order():
+    hw, machine = new_machine()
+    calls = []
+
+    async def exit_home(machine):
+        await asyncio.sleep(0)
+        calls.append(('exit', machine.names[machine.index]))
+
+    async def enter_profile(machine):
+        calls.append(('enter', machine.names[machine.index]))
+    machine.exits[machine.index_of['Home']] = exit_home
+    machine.enters[machine.index_of['Profile 1']] = enter_profile
+    run_async(machine, hw, 2.0)
+    assert calls == [('exit', 'Profile 1'), ('enter', 'Profile 1')]
+    assert machine.awaiting is None
+
+
+def test_async_callbacks_need_the_runtime():
+    hw, machine = new_machine()
+
+    async def enter(machine):
+        pass
+    machine.enters[machine.index_of['Profile 1']] = enter
+    machine.start()
+    with pytest.raises(TypeError):
+        machine.go_to_state('Profile 1')
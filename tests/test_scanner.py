@@ -0,0 +1,61 @@
+# SwitchScanner: debounce count, bouncing contacts and switches changing on the same scan, driven through SimHAL
+
+import pytest
+
+from hal import SCAN_INTERVAL
+from hal_sim import SimHAL
+from scanner import SwitchScanner
+
+
+def scan(hw, scans):
+    """Run "scans" scans one scan_interval apart, returns (scan number, fell, rose) for every scan with an edge."""
+    edges = []
+    first = int(round(hw.monotonic() / hw.scan_interval)) + 1
+    for n in range(first, first + scans):
+        hw.clock.advance_to(n * hw.scan_interval)
+        hw.scan()
+        if hw.scanner.fell or hw.scanner.rose:
+            edges.append((n, hw.scanner.fell, hw.scanner.rose))
+    return edges
+
+
+def at(n):                                  # half way between scan n - 1 and scan n, seen first on scan n
+    return (n - 0.5) * SCAN_INTERVAL
+
+
+@pytest.mark.parametrize('samples', [1, 2, 4])
+def test_change_after_samples_scans_in_a_row(samples):
+    hw = SimHAL()
+    hw.scanner.samples = samples
+    hw.switches[0].set(False, at(10))
+    hw.switches[0].set(True, at(30))
+    assert scan(hw, 50) == [(9 + samples, 0b01, 0), (29 + samples, 0, 0b01)]
+
+
+def test_bouncing_contacts_restart_the_count():
+    hw = SimHAL()                           # 4 samples, as on the board
+    switch = hw.switches[0]
+    for n, level in ((10, False), (12, True), (13, False), (14, True), (15, False)):    # bounces on the press
+        switch.set(level, at(n))
+    for n, level in ((40, True), (41, False), (43, True)):                              # and on the release
+        switch.set(level, at(n))
+    switch.set(False, at(70))               # one scan long glitch, filtered out
+    switch.set(True, at(71))
+    assert scan(hw, 90) == [(18, 0b01, 0), (46, 0, 0b01)]
+    assert hw.scanner.state == 0
+
+
+def test_two_switches_on_the_same_scan():
+    hw = SimHAL()
+    for switch in hw.switches:
+        switch.set(False, at(10))
+    hw.switches[0].set(True, at(30))        # one released while the other is pressed again
+    hw.switches[1].set(True, at(20))
+    hw.switches[1].set(False, at(30))
+    hw.switches[1].set(True, at(50))
+    assert scan(hw, 60) == [(13, 0b11, 0), (23, 0, 0b10), (33, 0b10, 0b01), (53, 0, 0b10)]
+
+
+def test_samples_must_be_a_power_of_two_up_to_4():
+    with pytest.raises(ValueError):
+        SwitchScanner(lambda: 0, 2, samples=3)
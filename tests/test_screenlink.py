@@ -0,0 +1,108 @@
+# Screen link frames: parsing through noise and bad CRCs, truncation, screen ids, resync after a lost frame
+
+import pytest
+
+from fields import DATE_TIME, TEXT
+from hal_sim import SimHAL
+from screenlink import (ACK, FRAME_MAX, PAYLOAD_MAX, SHOW, UPDATE, FrameReader, ScreenLink, build_frame,
+                        parse_fields)
+from state_machine import build_machine, compile_spec
+
+MENU_SPEC = {
+    'start': 'Home',
+    'events': ['switch_1'],
+    'states': {
+        'Home': {'class': 'Home', 'screen': 'home_scrn', 'on': {'switch_1': 'Menu'}},
+        'Menu': {'print': ['Menu', 'Pick a task'], 'on': {'switch_1': 'Home'}},
+    },
+}
+
+
+def frame(kind, seq, screen, fields=()):
+    buf = bytearray(FRAME_MAX)
+    return bytes(buf[:build_frame(buf, kind, seq, screen, fields)])
+
+
+def parse_one(data):
+    reader = FrameReader()
+    reader.feed(data)
+    return reader.next()
+
+
+def test_reader_skips_noise_and_bad_crc():
+    good = frame(SHOW, 1, 3, [(DATE_TIME, '11/14/2023 22:13')])
+    bad = bytearray(frame(UPDATE, 2, 3, [(DATE_TIME, '11/14/2023 22:14')]))
+    bad[-3] ^= 0xff
+    reader = FrameReader()
+    stream = b'\x00\x13' + good + bytes(bad) + frame(ACK, 3, 3)
+    for at in range(0, len(stream), 7):          # arrives in pieces, like a UART read
+        reader.feed(stream[at:at + 7])
+    frames = []
+    item = reader.next()
+    while item is not None:
+        frames.append(item)
+        item = reader.next()
+    assert [(kind, seq) for kind, seq, _, _ in frames] == [(SHOW, 1), (ACK, 3)]
+    assert parse_fields(frames[0][3]) == [(DATE_TIME, '11/14/2023 22:13')]
+    assert reader.errors == 1
+
+
+def test_long_field_cut_on_character_boundary():
+    text = u'é' * PAYLOAD_MAX                  # two bytes each, the payload can't end on a whole one
+    kind, _, _, payload = parse_one(frame(SHOW, 1, 1, [(TEXT, text)]))
+    (field, cut), = parse_fields(payload)
+    assert kind == SHOW and field == TEXT
+    assert text.startswith(cut) and len(cut.encode()) <= PAYLOAD_MAX - 2
+
+
+def test_spec_only_screen_gets_its_own_id():
+    tables = compile_spec(MENU_SPEC, SimHAL())
+    assert list(tables['screen_ids']) == [1, 8]
+
+    hw = SimHAL(epoch=1700000000)
+    link = ScreenLink(hw, hw.display_port(), settle=0)
+    machine = build_machine(hw, spec=MENU_SPEC, display=link)
+    link.source = machine.screen_fields
+    machine.start()
+    machine.go_to_state('Menu')
+    assert hw.controller.screen == 8
+    assert hw.controller.fields == {TEXT: 'Menu\nPick a task'}
+
+
+def test_screen_id_from_spec():
+    spec = dict(MENU_SPEC, states=dict(MENU_SPEC['states']))
+    spec['states']['Menu'] = dict(spec['states']['Menu'], screen_id=42)
+    assert list(compile_spec(spec, SimHAL())['screen_ids']) == [1, 42]
+    spec['states']['Menu'] = dict(spec['states']['Menu'], screen_id=300)
+    with pytest.raises(ValueError):
+        compile_spec(spec, SimHAL())
+
+
+def test_first_frame_without_live_fields():
+    hw = SimHAL(epoch=1700000000)
+    link = ScreenLink(hw, hw.display_port())
+    machine = build_machine(hw, display=link)
+    machine.start()
+    link.flush()                                    # the boot screen, before the clock is read
+    assert hw.controller.screen == 1 and hw.controller.fields == {}
+    assert machine.time_source.syncs == 0
+    link.source = machine.screen_fields
+    hw.clock.advance_to(hw.monotonic() + 1.0)
+    link.poll()
+    assert hw.controller.partial == 1 and DATE_TIME in hw.controller.fields
+
+
+def test_resync_after_lost_frames():
+    hw = SimHAL(epoch=1700000000)
+    link = ScreenLink(hw, hw.display_port(), settle=0, retry=0.5)
+    machine = build_machine(hw, display=link)
+    link.source = machine.screen_fields
+    machine.start()
+    hw.controller.online = False
+    machine.go_to_state('Profile 1')                # lost, no ACK comes back
+    assert hw.controller.screen == 1
+    hw.controller.online = True
+    hw.clock.advance_to(hw.monotonic() + 0.6)
+    link.poll()
+    assert link.resyncs == 1
+    assert hw.controller.screen == 2 and hw.controller.fields
@@ -0,0 +1,100 @@
+# ScreenDriver: select pin edges and their times for strobes, settling and reasserts
+
+from hal_sim import SimHAL
+from screens import ScreenDriver
+
+
+class Pin(object):
+    """Output pin that notes every write as (virtual time, name, level)."""
+
+    def __init__(self, hw, name, edges):
+        self.hw = hw
+        self.name = name
+        self.edges = edges
+        self._value = False
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, level):
+        self._value = level
+        self.edges.append((round(self.hw.monotonic(), 6), self.name, level))
+
+
+def setup(**settings):
+    hw = SimHAL()
+    edges = []
+    pins = dict((name, Pin(hw, name, edges)) for name in ('home', 'profile1', 'track1'))
+    return hw, ScreenDriver(hw, **settings), pins, edges
+
+
+def run(hw, driver, until):
+    """Poll the driver at each of its deadlines up to "until", like the tickless loop."""
+    while hw.monotonic() < until:
+        due = driver.next_due()
+        hw.clock.advance_to(until if due is None else min(due, until))
+        driver.poll()
+
+
+def test_strobe_length():
+    hw, driver, pins, edges = setup(pulse=0.05, settle=0.25)
+    driver.show(pins['home'])
+    run(hw, driver, 1.0)
+    assert edges == [(0.25, 'home', True), (0.3, 'home', False)]
+
+
+def test_strobe_length_after_days_of_uptime():
+    hw, driver, pins, edges = setup(pulse=0.05, settle=0.25)
+    hw.clock.advance_to(3 * 86400.0)
+    driver.show(pins['home'])
+    run(hw, driver, hw.monotonic() + 1.0)
+    (up, _, _), (down, _, _) = edges
+    assert abs(down - up - 0.05) < 1e-6
+
+
+def test_requests_inside_the_settle_time_coalesce():
+    hw, driver, pins, edges = setup(pulse=0.05, settle=0.25)
+    driver.show(pins['home'])
+    run(hw, driver, 1.0)
+    del edges[:]
+    driver.show(pins['profile1'])
+    run(hw, driver, 1.1)
+    driver.show(pins['track1'])                     # 0.1 s later, restarts the settle time
+    run(hw, driver, 2.0)
+    assert edges == [(1.35, 'track1', True), (1.4, 'track1', False)]
+    assert driver.refreshes == 2
+
+
+def test_back_to_the_same_screen_writes_nothing():
+    hw, driver, pins, edges = setup(pulse=0.05, settle=0.25)
+    driver.show(pins['home'])
+    run(hw, driver, 1.0)
+    driver.show(pins['profile1'])
+    run(hw, driver, 1.1)
+    driver.show(pins['home'])
+    run(hw, driver, 2.0)
+    assert edges == [(0.25, 'home', True), (0.3, 'home', False)]
+
+
+def test_level_mode_holds_the_line():
+    hw, driver, pins, edges = setup(pulse=None, settle=0.25)
+    driver.show(pins['home'])
+    run(hw, driver, 1.0)
+    driver.show(pins['profile1'])
+    run(hw, driver, 2.0)
+    assert edges == [(0.25, 'home', True), (1.25, 'home', False), (1.25, 'profile1', True)]
+
+
+def test_reassert_interval():
+    hw, driver, pins, edges = setup(pulse=0.05, settle=0.25, reassert=180.0)
+    driver.show(pins['home'])
+    run(hw, driver, 400.0)
+    rises = [at for at, name, level in edges if level]
+    falls = [at for at, name, level in edges if not level]
+    assert rises == [0.25, 180.25, 360.25]
+    assert falls == [0.3, 180.3, 360.3]
+    driver.show(pins['profile1'])                   # a new screen restarts the interval
+    run(hw, driver, 700.0)
+    assert [at for at, name, level in edges if level and name == 'profile1'] == [400.25, 580.25]
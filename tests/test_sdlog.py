@@ -0,0 +1,107 @@
+# BufferedLog and its journal on the simulator, power cuts at each step of a flush
+
+import pytest
+
+from hal_sim import SimHAL
+from sdlog import BufferedLog
+
+
+class PowerCut(Exception):
+    pass
+
+
+def cut_before_remove(hw, log):
+    """Flush "log" with the power going away after the append, before the journal is removed."""
+    remove = hw.remove
+
+    def cut(name):
+        raise PowerCut(name)
+    hw.remove = cut
+    with pytest.raises(PowerCut):
+        log.flush()
+    hw.remove = remove
+
+
+def test_flush_leaves_no_journal():
+    hw = SimHAL()
+    log = BufferedLog(hw)
+    log.write("one, ")
+    log.flush()
+    assert hw.fs.files['stamp.csv'] == b"one, "
+    assert hw.size('stamp.jnl') is None
+
+
+def test_nothing_to_recover():
+    hw = SimHAL()
+    assert BufferedLog(hw).recover() == 0
+
+
+def test_journal_present_at_boot():
+    hw = SimHAL()
+    log = BufferedLog(hw)
+    log.write("before\r\n")
+    log.flush()
+    log.write("11/14/2023, 22:13:23, ")
+    cut_before_remove(hw, log)
+    hw.fs.files['stamp.csv'] = hw.fs.files['stamp.csv'][:12]      # the append only got partly to the card
+
+    log = BufferedLog(hw)                   # next boot
+    assert log.recover() == len("11/14/2023, 22:13:23, ")
+    assert hw.size('stamp.jnl') is None
+    log.write("22:13:26, ")
+    log.flush()
+    assert hw.fs.files['stamp.csv'] == b"before\r\n11/14/2023, 22:13:23, 22:13:26, "
+
+
+def test_torn_journal_is_dropped():
+    hw = SimHAL()
+    log = BufferedLog(hw)
+    log.write("before\r\n")
+    log.flush()
+    log.write("lost, ")
+    cut_before_remove(hw, log)
+    hw.fs.files['stamp.jnl'] = hw.fs.files['stamp.jnl'][:-3]        # cut while the journal was written
+    hw.fs.files['stamp.csv'] = b"before\r\n"                         # so the append never started
+
+    log = BufferedLog(hw)
+    assert log.recover() == 0
+    assert hw.size('stamp.jnl') is None
+    assert hw.fs.files['stamp.csv'] == b"before\r\n"
+
+
+def test_corrupt_journal_is_dropped():
+    hw = SimHAL()
+    log = BufferedLog(hw)
+    log.write("lost, ")
+    cut_before_remove(hw, log)
+    journal = bytearray(hw.fs.files['stamp.jnl'])
+    journal[-6] ^= 0xff                     # a flipped bit in the batch, the CRC no longer matches
+    hw.fs.files['stamp.jnl'] = bytes(journal)
+    del hw.fs.files['stamp.csv']
+
+    assert BufferedLog(hw).recover() == 0
+    assert hw.size('stamp.csv') is None
+
+
+def test_cut_between_append_and_remove():
+    hw = SimHAL()
+    log = BufferedLog(hw)
+    log.write("a, ")
+    log.flush()
+    log.write("b, ")
+    cut_before_remove(hw, log)
+    assert hw.size('stamp.jnl') is not None
+
+    log = BufferedLog(hw)
+    assert log.recover() == 0               # the batch is on the card already, not written twice
+    assert hw.size('stamp.jnl') is None
+    assert hw.fs.files['stamp.csv'] == b"a, b, "
+
+
+def test_write_larger_than_buffer():
+    hw = SimHAL()
+    log = BufferedLog(hw, sectors=1)
+    data = bytes(range(256)) * 5
+    log.write(data)
+    log.flush()
+    assert hw.fs.files['stamp.csv'] == data
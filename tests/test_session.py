@@ -0,0 +1,67 @@
+# SessionStore: a session past midnight split over its days, today() after the clock was set
+
+from hal import from_epoch
+from hal_sim import SimHAL
+from session import DAY, SessionStore
+from state_machine import build_machine
+
+DAY_1 = 19675                               # 2023-11-14
+MIDNIGHT = (DAY_1 + 1) * DAY                # the RTC's midnight, a naive local time kept as epoch seconds
+
+
+def walk(hw, machine, *steps):
+    for seconds, name in steps:
+        hw.clock.advance_to(hw.monotonic() + seconds)
+        machine.go_to_state(name)
+
+
+def test_session_past_midnight_is_split_over_both_days():
+    session = SessionStore()
+    session.begin(MIDNIGHT - 1800, 1)
+    session.end(MIDNIGHT + 2700)
+    assert session.total(DAY_1) == 1800
+    assert session.total(DAY_1 + 1) == 2700
+    assert session.history() == (MIDNIGHT - 1800, MIDNIGHT + 2700, 1, False)
+    assert session.today(MIDNIGHT + 3600) == 2700
+
+
+def test_session_over_two_midnights():
+    session = SessionStore()
+    session.begin(MIDNIGHT - 60, 1)
+    session.end(MIDNIGHT + DAY + 60)
+    assert [session.total(day) for day in (DAY_1, DAY_1 + 1, DAY_1 + 2)] == [60, DAY, 60]
+
+
+def test_machine_splits_at_the_rtc_midnight(new_york):
+    hw = SimHAL(epoch=MIDNIGHT - 1000)
+    machine = build_machine(hw)
+    machine.start()
+    walk(hw, machine, (100, 'Profile 1'), (100, 'Tracking1'))
+    start = machine.session.start
+    assert machine.session.today(start + 300) == 300
+    walk(hw, machine, (3000, 'Voice Note'))
+    stop = machine.session.stop
+    assert stop - start == 3000
+    assert machine.session.total(DAY_1) == MIDNIGHT - start
+    assert machine.session.total(DAY_1 + 1) == stop - MIDNIGHT
+    assert from_epoch(stop).tm_mday == 15 and from_epoch(start).tm_mday == 14    # not the PC's New York dates
+
+
+def test_today_after_the_clock_is_set(new_york):
+    hw = SimHAL(epoch=MIDNIGHT + 10 * 3600)
+    machine = build_machine(hw)
+    machine.start()
+    walk(hw, machine, (60, 'Profile 1'), (60, 'Tracking1'))
+    start = machine.session.start
+    hw.clock.advance_to(hw.monotonic() + 3600)
+    assert machine.session.today(machine.time_source.now()) == 3600
+
+    machine.time_source.set(from_epoch(MIDNIGHT + DAY + 9 * 3600))     # set a day ahead, the session still open
+    now = machine.time_source.now()                 # set() lines up with the RTC's next tick
+    assert 0 <= now - (MIDNIGHT + DAY + 9 * 3600) <= 1
+    assert machine.session.today(now) == now % DAY  # only the open session's part since the new day began
+
+    machine.time_source.set(from_epoch(start - 600))     # set back before the START stamp
+    assert machine.session.today(machine.time_source.now()) == 0
+    walk(hw, machine, (0, 'Voice Note'))
+    assert machine.session.total(DAY_1 + 1) == 0    # stop before start: nothing is added
@@ -0,0 +1,24 @@
+# Binary session log: records, day index and the CSV export
+
+import io
+import struct
+
+from hal_sim import SimHAL
+from sessionlog import RECORD, SessionLog, export_csv
+
+
+def test_export_ignores_the_pc_time_zone(new_york):
+    out = io.StringIO()
+    export_csv(io.BytesIO(struct.pack(RECORD, 1700000002, 1700000100, 1, 1)), out, header=False)
+    assert out.getvalue() == "11/14/2023, 22:13:22, 22:15:00, 0:01:38, Speech to text voice note\r\n"
+
+
+def test_day_reads_one_day():
+    hw = SimHAL()
+    log = SessionLog(hw)
+    log.open()
+    for day in range(3):
+        start = 1700000000 + day * 86400
+        log.append(start, start + 60, 1, False)
+        log.append(start + 120, start + 180, 1, True)
+    assert [record[0] for record in log.day(1700000000 + 86400)] == [1700086400, 1700086520]
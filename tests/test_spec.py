@@ -0,0 +1,96 @@
+# compile_spec() and load_spec() reject malformed machine specs, naming every problem in one ValueError
+
+import copy
+import json
+
+import pytest
+
+from hal_sim import SimHAL
+from state_machine import MACHINE_SPEC, compile_spec, load_spec
+
+
+def broken(change):
+    spec = copy.deepcopy(MACHINE_SPEC)
+    change(spec)
+    return spec
+
+
+def problems(spec):
+    with pytest.raises(ValueError) as error:
+        compile_spec(spec, SimHAL())
+    return str(error.value)
+
+
+def test_the_shipped_spec_compiles():
+    tables = compile_spec(MACHINE_SPEC, SimHAL())
+    assert tables['names'][tables['start']] == 'Home'
+
+
+def test_unknown_target_state():
+    spec = broken(lambda s: s['states']['Home']['on'].update(switch_1='Profile 9'))
+    assert 'Home: switch_1 goes to unknown state "Profile 9"' in problems(spec)
+
+
+def test_unknown_event():
+    spec = broken(lambda s: s['states']['Home']['on'].update(switch_9='Profile 1'))
+    assert 'Home: unknown event "switch_9"' in problems(spec)
+
+
+def test_event_named_twice():
+    spec = broken(lambda s: s['timers'].append('switch_1'))
+    assert 'event "switch_1" is defined 2 times' in problems(spec)
+
+
+def test_more_events_than_switches():
+    spec = broken(lambda s: s['events'].append('switch_3'))
+    assert '3 events but the hardware has 2 switches' in problems(spec)
+
+
+def test_unknown_class_and_misnamed_class():
+    spec = broken(lambda s: s['states']['Profile 2'].update({'class': 'Profile9'}))
+    assert 'Profile 2: unknown class Profile9' in problems(spec)
+    spec = broken(lambda s: s['states']['Profile 2'].update({'class': 'Profile1'}))
+    assert 'Profile 2: class Profile1 is named "Profile 1"' in problems(spec)
+
+
+def test_unknown_hook():
+    spec = broken(lambda s: s['states']['Voice Note']['on'].update(switch_2=['Home', 'no_such_hook']))
+    assert 'Voice Note: unknown hook "no_such_hook"' in problems(spec)
+
+
+def test_unknown_screen_output():
+    spec = broken(lambda s: s['states']['Home'].update(screen='missing_scrn'))
+    assert 'Home: no screen output "missing_scrn"' in problems(spec)
+
+
+@pytest.mark.parametrize('screen_id', [0, 256, -1, 'home'])
+def test_screen_id_out_of_range(screen_id):
+    spec = broken(lambda s: s['states']['Home'].update(screen_id=screen_id))
+    assert 'Home: screen id %r is not 1..255' % screen_id in problems(spec)
+
+
+def test_bad_start_and_unreachable_state():
+    spec = broken(lambda s: s.update(start='Nowhere'))
+    assert 'start state "Nowhere" is not defined' in problems(spec)
+    spec = broken(lambda s: s['states'].update({'Profile 3': {'print': ['Profile 3']}}))
+    assert 'Profile 3: unreachable from Home' in problems(spec)
+
+
+def test_every_problem_is_reported_together():
+    def change(spec):
+        spec['states']['Home']['on']['switch_1'] = 'Profile 9'
+        spec['states']['Profile 2']['class'] = 'Profile9'
+    report = problems(broken(change))
+    assert 'unknown state "Profile 9"' in report and 'unknown class Profile9' in report
+
+
+def test_duplicate_names_in_a_spec_file(tmp_path):
+    text = json.dumps(MACHINE_SPEC, indent=1)
+    path = tmp_path / 'spec.json'
+    path.write_text(text)
+    assert load_spec(str(path)) == json.loads(text)
+    entry = '"Profile 2": {"class": "Profile2", "screen": "profile2_scrn", "on": {"switch_1": "Home"}},\n'
+    path.write_text(text.replace('"Profile 2": {', entry + ' "Profile 2": {', 1))
+    with pytest.raises(ValueError) as error:
+        load_spec(str(path))
+    assert '"Profile 2" is defined twice' in str(error.value)
@@ -0,0 +1,78 @@
+# Timer wheel: firing on the right tick across the level cascades, far timers, next_due, periodic and cancelled timers
+
+from hal_sim import SimHAL
+from timers import SLOTS, TimerWheel
+
+TICK = 0.01
+
+
+def run(hw, wheel, until, step=None):
+    """Advance the virtual clock to "until" (in "step" seconds, or from deadline to deadline) and expire the wheel."""
+    fired = []
+
+    def fire(timer):
+        fired.append((timer.event, wheel._now))
+        if timer.callback is not None:
+            timer.callback()
+
+    while hw.monotonic() < until:
+        due = wheel.next_due() if step is None else hw.monotonic() + step
+        hw.clock.advance_to(until if due is None else min(due, until))
+        wheel.expire(fire)
+    return fired
+
+
+def test_cascade_fires_on_the_right_tick():
+    hw = SimHAL()
+    hw.clock.advance_to(12.345)
+    wheel = TimerWheel(hw, TICK)
+    start = wheel._now
+    delays = (1, SLOTS - 1, SLOTS, SLOTS + 1, SLOTS ** 2 + 5, SLOTS ** 3 + 7, 3 * SLOTS ** 3 + 11)
+    for n, ticks in enumerate(delays):
+        wheel.add(ticks * TICK, event=n)
+    fired = run(hw, wheel, (start + delays[-1] + 2) * TICK)
+    assert fired == [(n, start + ticks) for n, ticks in enumerate(delays)]
+
+
+def test_same_result_when_stepping_every_tick():
+    hw = SimHAL()
+    wheel = TimerWheel(hw, TICK)
+    for n, ticks in enumerate((3, 70, 200, 4100, 4097)):
+        wheel.add(ticks * TICK, event=n)
+    fired = run(hw, wheel, 50.0, step=TICK)
+    assert sorted(fired, key=lambda item: item[1]) == [(0, 3), (1, 70), (2, 200), (4, 4097), (3, 4100)]
+
+
+def test_far_timer_does_not_hide_a_nearer_one():
+    hw = SimHAL()
+    wheel = TimerWheel(hw, TICK)
+    days = 86400.0
+    far = wheel.add(3 * days, event=0)              # beyond 64^4 ticks, about 1.94 days
+    near = wheel.add(1.5 * days, event=1)
+    assert abs(wheel.next_due() - 1.5 * days) < TICK
+    fired = run(hw, wheel, 4 * days)
+    assert fired == [(1, near.due), (0, far.due)]
+    assert far.due == int(3 * days / TICK)
+
+
+def test_deadline_stays_exact_after_days_of_uptime():
+    hw = SimHAL()
+    hw.clock.advance_to(5 * 86400.0 + 0.003)
+    wheel = TimerWheel(hw, TICK)
+    timer = wheel.add(0.05, event=0)
+    assert timer.due - wheel._now == 5
+    assert run(hw, wheel, hw.monotonic() + 1.0) == [(0, timer.due)]
+
+
+def test_periodic_and_cancel():
+    hw = SimHAL()
+    wheel = TimerWheel(hw, TICK)
+    ticks = []
+    periodic = wheel.add(1.0, callback=lambda: ticks.append(hw.monotonic()), period=1.0)
+    dropped = wheel.add(2.5, event=9)
+    wheel.cancel(dropped)
+    fired = run(hw, wheel, 5.5)
+    assert len(fired) == 5 and all(event is None for event, _ in fired)
+    assert [round(t, 2) for t in ticks] == [1.0, 2.0, 3.0, 4.0, 5.0]
+    wheel.cancel(periodic)
+    assert wheel.next_due() is None and wheel.active == 0
@@ -0,0 +1,43 @@
+# Cached RTC time on the simulator's virtual clock
+
+from hal import from_epoch, to_epoch
+from hal_sim import SimHAL
+from state_machine import build_machine
+from timesource import NS, TimeSource
+
+
+def test_conversion_is_utc(new_york):
+    assert to_epoch(from_epoch(1700000002)) == 1700000002
+    assert from_epoch(1700000002).tm_hour == 22
+
+
+def test_first_sync_lines_up_with_the_tick():
+    hw = SimHAL(epoch=1700000000)
+    hw.sleep(0.4)                           # the RTC's second ticks over 0.6 s from now
+    source = TimeSource(hw)
+    source.sync()                           # waits for it on the virtual clock
+    assert abs(hw.monotonic() - 1.0) < 1e-6
+    assert abs(source.now_ns() - 1700000001 * NS) < 1000
+
+
+def test_resync_corrects_drift():
+    hw = SimHAL(epoch=1700000000)
+    source = TimeSource(hw, resync=10.0)
+    source.sync()
+    source._offset_ns += 3 * NS             # the interpolated time ran ahead
+    hw.sleep(10.0)
+    assert source.now() == 1700000011     # the RTC's second, the sync took one
+    assert abs(source.drift - 2.0) < 1e-6   # corrected to the end of that second
+
+
+def test_stamps_ignore_the_pc_time_zone(new_york):
+    hw = SimHAL(epoch=1700000000)
+    machine = build_machine(hw)
+    machine.start()
+    for at in (1.0, 3.0, 10.0, 12.0, 14.0):     # Profile 1, Tracking1, Voice Note, Record, Home
+        hw.switch_1.tap(at, 0.1)
+    while hw.monotonic() < 20.0:            # the first stamp waits for the RTC's tick at 4 s
+        machine.run_events(0.005)
+        machine.poll()
+    machine.stamp_log.flush()
+    assert hw.fs.files['stamp.csv'] == b'11/14/2023, 22:13:24, 22:13:30, Delta Formula, Speech to text voice note\r\n'
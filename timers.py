@@ -0,0 +1,145 @@
+# Timer wheel for the state machine
+# Timeouts (the focus timer, periodic jobs) are kept in a hierarchical timing wheel instead of being checked on
+# every loop. Time is counted in ticks of "tick" seconds. Level 0 has one slot per tick for the next 64 ticks,
+# level 1 one slot per 64 ticks for the next 64 * 64, and so on ("levels" deep, 4 levels of 10 ms cover 64^4
+# ticks, about 1.94 days). A timer goes into the slot of the lowest level whose window holds its deadline, when
+# the wheel reaches a higher level slot its timers are spread over the level below. A timer further out than
+# the top level reaches is parked in its farthest slot and placed again each time that slot comes up. Adding
+# is a list append, cancelling only marks the timer (it is dropped when its slot comes up), both O(1).
+#
+# Ticks are counted from hal.monotonic_ns(): the board's float monotonic() loses milliseconds after a few hours
+# of uptime, the integer nanoseconds don't.
+#
+# expire() walks the ticks up to hal.monotonic_ns() and hands every due timer to "fire"; it jumps over stretches
+# with no timer in the lower levels, so a wake after a long sleep costs a few steps, not one per tick.
+# next_due() gives the earliest deadline, the event loop sleeps until then (see StateMachine.run_tickless). It is
+# kept between calls and only searched for again after the earliest timer fired or was cancelled.
+
+BITS = 6
+SLOTS = 1 << BITS
+MASK = SLOTS - 1
+NS = 1000000000
+
+
+class Timer(object):
+
+    def __init__(self, due, event, callback, period):
+        self.due = due              # tick the timer fires on
+        self.event = event          # event number dispatched like a switch press, or None
+        self.callback = callback    # called without arguments instead, or None
+        self.period = period        # ticks between firings of a periodic timer, None for one shot
+        self.active = True
+
+
+class TimerWheel(object):
+
+    def __init__(self, hal, tick=0.01, levels=4):
+        self.hal = hal
+        self.tick = tick
+        self.tick_ns = int(tick * NS)
+        self.levels = levels
+        self._wheels = [[[] for _ in range(SLOTS)] for _ in range(levels)]
+        self._counts = [0] * levels         # timers placed on each level, cancelled ones included
+        self._now = self._ticks()
+        self.active = 0                     # timers waiting to fire
+        self._earliest = None               # tick of the earliest deadline, None when it has to be searched for
+
+    def _ticks(self, ns=0):                 # Tick "ns" nanoseconds from now
+        return (self.hal.monotonic_ns() + ns) // self.tick_ns
+
+    def add(self, seconds, event=None, callback=None, period=None):
+        """Fire "event" (or call "callback") in "seconds", and every "period" seconds after that when given."""
+        timer = Timer(max(self._now + 1, self._ticks(int(seconds * NS))), event, callback,
+                      None if period is None else max(1, int(period * NS) // self.tick_ns))     # already due fires on the next tick
+        self._place(timer)
+        if self._earliest is not None and timer.due < self._earliest:
+            self._earliest = timer.due
+        elif not self.active:
+            self._earliest = timer.due
+        self.active += 1
+        return timer
+
+    def cancel(self, timer):
+        if timer is not None and timer.active:
+            timer.active = False
+            self.active -= 1
+            if timer.due == self._earliest:
+                self._earliest = None
+
+    def _place(self, timer):                # A cascade places timers due on this very tick, they fire right after
+        due = timer.due
+        level = 0
+        while level < self.levels - 1 and due >> (BITS * (level + 1)) != self._now >> (BITS * (level + 1)):
+            level += 1
+        shift = BITS * level
+        if (due >> shift) - (self._now >> shift) >= SLOTS:     # beyond the top level, park it in its farthest slot
+            self._wheels[level][((self._now >> shift) - 1) & MASK].append(timer)
+        else:
+            self._wheels[level][(due >> shift) & MASK].append(timer)
+        self._counts[level] += 1
+
+    def expire(self, fire):
+        """Pass every timer that is due by now to "fire", oldest deadline first."""
+        end = self._ticks()
+        while self._now < end:
+            if not self.active:
+                self._now = end             # nothing waits, nothing to cascade
+                break
+            level = 0
+            while level < self.levels and not self._counts[level]:
+                level += 1
+            if level:                       # no timer below "level", skip to the end of its current slot
+                self._now = min(end - 1, self._now | ((1 << (BITS * level)) - 1))
+            self._now += 1
+            now = self._now
+            for level in range(self.levels - 1, 0, -1):     # cascade the higher levels that turned over, top first
+                if now & ((1 << (BITS * level)) - 1) == 0:
+                    self._cascade(level, (now >> (BITS * level)) & MASK)
+            slot = self._wheels[0][now & MASK]
+            if slot:
+                self._wheels[0][now & MASK] = []
+                self._counts[0] -= len(slot)
+                self._earliest = None
+                for timer in slot:
+                    if timer.active:
+                        if timer.period is None:
+                            timer.active = False
+                            self.active -= 1
+                        else:
+                            timer.due = now + timer.period
+                            self._place(timer)
+                        fire(timer)
+
+    def _cascade(self, level, index):
+        slot = self._wheels[level][index]
+        if not slot:
+            return
+        self._wheels[level][index] = []
+        self._counts[level] -= len(slot)
+        for timer in slot:
+            if timer.active:
+                self._place(timer)
+
+    def next_due(self):
+        """hal.monotonic() of the earliest deadline, None when no timer waits."""
+        if not self.active:
+            return None
+        if self._earliest is None:
+            self._earliest = self._search()
+        return self._earliest * self.tick
+
+    def _search(self):
+        for level in range(self.levels):
+            if not self._counts[level]:
+                continue
+            shift = BITS * level
+            start = self._now >> shift
+            for step in range(SLOTS):
+                slot = self._wheels[level][(start + step) & MASK]
+                due = None
+                for timer in slot:
+                    if timer.active and (due is None or timer.due < due):
+                        due = timer.due
+                if due is not None:
+                    return due
+        return self._now + 1                # only reached with a stale count, look again on the next tick
@@ -0,0 +1,77 @@
+# Cached RTC time source
+# Reading the PCF8523 is an I2C round trip and only gives whole seconds. TimeSource reads it once, lines the
+# reading up with the moment the RTC's second ticks over, then serves timestamps from monotonic_ns() plus an
+# offset. Every "resync" seconds the RTC is read again; when the interpolated time has left the RTC's current
+# second the offset is corrected and the error is recorded as drift. The RTC is only written by set().
+
+from hal import from_epoch, to_epoch
+
+NS = 1000000000
+
+
+class TimeSource(object):
+
+    def __init__(self, hal, resync=3600.0, align_timeout=1.5):
+        self.hal = hal
+        self.resync_ns = int(resync * NS)
+        self.align_timeout = align_timeout
+        self._offset_ns = None      # epoch ns minus monotonic ns, None until the first sync
+        self._synced_ns = 0         # monotonic_ns() of the last sync
+        self.syncs = 0
+        self.drift = 0.0            # last correction made on a resync, seconds (positive: we were ahead)
+        self.max_drift = 0.0
+
+    def sync(self):
+        """Read the RTC now, on the first sync wait for its second to tick over so the offset is sub-second."""
+        rtc = self.hal.rtc
+        epoch = to_epoch(rtc.datetime)
+        mono = self.hal.monotonic_ns()
+        if self._offset_ns is None:
+            # Poll until the second changes, that instant is exactly "epoch + 1"
+            give_up = mono + int(self.align_timeout * NS)
+            offset = epoch * NS - mono      # good to a second if the RTC never ticks
+            while mono < give_up:
+                now = to_epoch(rtc.datetime)
+                mono = self.hal.monotonic_ns()
+                if now != epoch:
+                    offset = now * NS - mono
+                    break
+                self.hal.sleep(0.001)
+            self._offset_ns = offset
+        else:
+            estimate = mono + self._offset_ns
+            if estimate < epoch * NS:               # behind the RTC's current second
+                error = estimate - epoch * NS
+            elif estimate >= (epoch + 1) * NS:      # already past it
+                error = estimate - (epoch + 1) * NS + 1
+            else:
+                error = 0
+            if error:
+                self._offset_ns -= error
+            self.drift = float(error) / NS
+            if abs(self.drift) > abs(self.max_drift):
+                self.max_drift = self.drift
+        self._synced_ns = mono
+        self.syncs += 1
+
+    def now_ns(self):
+        """Epoch time in nanoseconds, no bus traffic unless a resync is due."""
+        mono = self.hal.monotonic_ns()
+        if self._offset_ns is None or mono - self._synced_ns >= self.resync_ns:
+            self.sync()
+            mono = self.hal.monotonic_ns()
+        return mono + self._offset_ns
+
+    def now(self):
+        """Epoch time in whole seconds."""
+        return self.now_ns() // NS
+
+    def datetime(self):
+        """The current time as a struct_time, like rtc.datetime."""
+        return from_epoch(self.now())
+
+    def set(self, t):
+        """Write the struct_time "t" to the RTC and start over from it."""
+        self.hal.rtc.datetime = t
+        self._offset_ns = None
+        self.sync()
@@ -0,0 +1,186 @@
+# Structured tracing for the state machine, replaces print() and the TESTING flag
+# emit() stores a fixed size record (time, event code, two integer arguments) in a preallocated ring buffer:
+# no string is formatted and nothing goes to USB serial while a transition runs. Records are turned into
+# text only when they leave the ring, from poll() in the main loop or from dump(), using the EVENTS table.
+#
+# Where the text goes is the sink and can be changed at any time, from code or from the serial monitor:
+#   n   none, records stay in the ring (the newest SIZE are kept)     t   print what the ring holds now
+#   p   print each record to the serial monitor                       v   verbose, DEBUG records too
+#   w   write each record to "trace.txt" on the SD card               q   quiet, INFO and up only
+#
+# Record: milliseconds (u32, wraps after 49 days), event code (u16), level (u8), two arguments (i32).
+# Timestamps in arguments are stored as seconds since 2020-01-01 so they stay small integers on the board.
+
+import struct
+
+from hal import from_epoch
+
+DEBUG = 0
+INFO = 1
+WARN = 2
+ERROR = 3
+LEVEL_NAMES = ('DEBUG', 'INFO', 'WARN', 'ERROR')
+
+NONE = 0
+SERIAL = 1
+SD = 2
+
+RECORD = '<IHBxii'
+RECORD_SIZE = struct.calcsize(RECORD)
+SIZE = 128                  # records kept in the ring
+EPOCH_BASE = 1577836800     # 2020-01-01, subtracted from timestamps passed as arguments
+SD_INTERVAL = 1.0           # the SD sink writes at most this often, seconds
+
+# Event codes
+ENTER = 1
+EXIT = 2
+PRESS = 3
+STAMP_IN = 10
+STAMP_OUT = 11
+SESSION = 12
+NOTE = 13
+NO_NOTE = 14
+HEADER = 15
+SCREEN_TEXT = 20
+PLACEHOLDER = 21
+RECOVERED = 30
+RESUMED = 31
+
+# What the arguments hold: 'n' number, 's' state index (its name), 'l' state index (its screen text lines),
+# 't' timestamp, 'p' PLACEHOLDERS index
+EVENTS = {
+    ENTER:       (DEBUG, 'entering %s', 's'),
+    EXIT:        (DEBUG, 'exiting %s', 's'),
+    PRESS:       (DEBUG, 'switch %d pressed in %s', 'ns'),
+    STAMP_IN:    (INFO, 'time in %s', 't'),
+    STAMP_OUT:   (INFO, 'time out %s', 't'),
+    SESSION:     (INFO, 'session %s to %s', 'tt'),
+    NOTE:        (INFO, 'voice note logged', ''),
+    NO_NOTE:     (INFO, 'session ended without a voice note', ''),
+    HEADER:      (INFO, '#### %s State ####', 's'),
+    SCREEN_TEXT: (INFO, '%s', 'l'),
+    PLACEHOLDER: (DEBUG, '%s', 'p'),
+    RECOVERED:   (WARN, 'recovered %d bytes of log from the journal', 'n'),
+    RESUMED:     (WARN, 'resumed in %s from the checkpoint', 's'),
+}
+
+# Text of the placeholder notes the states used to print, for the screens still to be designed
+PLACEHOLDERS = (
+    'Placeholder to display date and time',
+    'Placeholder to display counter for tracked time',
+    'Display Focus Timer counting down',
+    'Placeholder to display "Ah Ah Ah" screen',
+    'Placeholder to display Profile 2 Screen, date and time',
+    'Placeholder to display, "Yes or No" to record a note',
+    'Placeholder to display, "Placeholder for second semester functionality!"',
+)
+DATE_AND_TIME = 0
+TRACKED_COUNTER = 1
+FOCUS_COUNTDOWN = 2
+AH_AH_AH = 3
+PROFILE2_SCREEN = 4
+YES_OR_NO = 5
+SECOND_SEMESTER = 6
+
+
+class Tracer(object):
+
+    def __init__(self, hal, size=SIZE, level=INFO, sink=NONE, name="trace.txt"):
+        self.hal = hal
+        self.size = size
+        self.level = level
+        self.sink = sink
+        self.name = name
+        self.machine = None                     # gives state names and screen text to the decoder
+        self._buf = bytearray(size * RECORD_SIZE)
+        self._levels = bytearray(max(EVENTS) + 1)
+        for code, event in EVENTS.items():
+            self._levels[code] = event[0]
+        self.written = 0                        # records emitted so far
+        self._sent = 0                          # records already passed to the sink
+        self._sd_due = 0.0
+
+    def emit(self, code, a=0, b=0):
+        """Record event "code", the hot path: one level check and one struct.pack_into."""
+        level = self._levels[code]
+        if level < self.level:
+            return
+        struct.pack_into(RECORD, self._buf, (self.written % self.size) * RECORD_SIZE,
+                         int(self.hal.monotonic() * 1000) & 0xffffffff, code, level, a, b)
+        self.written += 1
+
+    def stamp(self, code, epoch, other=None):
+        """emit() with timestamp arguments, epoch seconds."""
+        self.emit(code, epoch - EPOCH_BASE, 0 if other is None else other - EPOCH_BASE)
+
+    def poll(self):
+        """Call from the main loop, passes new records to the sink."""
+        if self.written == self._sent:
+            return
+        if self.sink == NONE:
+            self._sent = self.written
+        elif self.sink == SERIAL:
+            for line in self._pending():
+                print(line)
+        elif self.hal.monotonic() >= self._sd_due:
+            self._sd_due = self.hal.monotonic() + SD_INTERVAL
+            with self.hal.open(self.name, "a") as f:
+                for line in self._pending():
+                    f.write(line + "\r\n")
+
+    def next_due(self):
+        """hal.monotonic() poll() has records to pass on, None when the sink is up to date."""
+        if self.written == self._sent:
+            return None
+        return self._sd_due if self.sink == SD else self.hal.monotonic()
+
+    def dump(self):
+        """Print every record the ring holds, oldest first."""
+        first = max(0, self.written - self.size)
+        for i in range(first, self.written):
+            print(self.decode(i))
+
+    def records(self):
+        """The records the ring holds, oldest first, as (ms, code, level, a, b) tuples."""
+        first = max(0, self.written - self.size)
+        return [struct.unpack_from(RECORD, self._buf, (i % self.size) * RECORD_SIZE) for i in range(first, self.written)]
+
+    def decode(self, i):
+        """Text of record number "i", which must still be in the ring."""
+        ms, code, level, a, b = struct.unpack_from(RECORD, self._buf, (i % self.size) * RECORD_SIZE)
+        event = EVENTS.get(code)
+        if event is None:
+            return '%10.3f %-5s event %d (%d, %d)' % (ms / 1000.0, LEVEL_NAMES[level], code, a, b)
+        kinds = event[2]
+        values = tuple([self._value(kind, value) for kind, value in zip(kinds, (a, b))])
+        return '%10.3f %-5s %s' % (ms / 1000.0, LEVEL_NAMES[level], event[1] % values if values else event[1])
+
+    def _value(self, kind, value):
+        if kind in 'sl' and self.machine is None:
+            return 'state %d' % value
+        if kind == 's':
+            return self.machine.names[value]
+        if kind == 'l':
+            return '\n'.join(self.machine.objects[value].lines)
+        if kind == 't':
+            t = from_epoch(value + EPOCH_BASE)
+            return '%d/%d/%d %d:%02d:%02d' % (t.tm_mon, t.tm_mday, t.tm_year, t.tm_hour, t.tm_min, t.tm_sec)
+        if kind == 'p':
+            return PLACEHOLDERS[value]
+        return value
+
+    def _pending(self):
+        first = max(self._sent, self.written - self.size)
+        lost = first - self._sent
+        self._sent = self.written
+        if lost:
+            yield '%d trace records lost, the sink fell behind' % lost
+        for i in range(first, self.written):
+            yield self.decode(i)
+
+    def commands(self):
+        """Serial monitor letters for StateMachine.commands, see the top of this file."""
+        def setter(attribute, value):
+            return lambda: setattr(self, attribute, value)
+        return {'n': setter('sink', NONE), 'p': setter('sink', SERIAL), 'w': setter('sink', SD),
+                'v': setter('level', DEBUG), 'q': setter('level', INFO), 't': self.dump}